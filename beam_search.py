@@ -0,0 +1,53 @@
+from simplify import *
+import heapq
+import itertools
+import time
+
+#Egyszerűsítés nyalábkereséssel (beam search)
+#A simplify mohó módszere mindig csak a mértéket csökkentő átírásokat fogadja el, ezért beragadhat egy lokális optimumba.
+#A nyalábkeresés szintenként halad: a nyaláb minden kifejezéséből előállítja a rákövetkezőket (egy szabály alkalmazása a
+#teljes fában, mint a simplify_step-ben), és a legegyszerűbb beam_width darab új kifejezés alkotja
+#a következő nyalábot - akkor is, ha egyik sem egyszerűbb a mostaniaknál. A már látott kifejezéseket (az internálás miatt
+#azonosító alapján) nem járja be újra. A keresés végén a legegyszerűbb látott kifejezést adja vissza.
+#Paraméterek: lásd simplify, továbbá
+#beam_width: a nyaláb szélessége
+#max_nodes: legfeljebb ennyi új kifejezést állít elő (None: nincs korlát)
+#time_budget: legfeljebb ennyi másodpercig keres (None: nincs korlát)
+#A keresés akkor is véget ér, ha nincs több új kifejezés.
+def beam_simplify(expr, rules, transformations, simplicity_measure, index=None, memo=None, beam_width=8, max_nodes=10000, time_budget=None):
+    if type(transformations) is not Normalizer:
+        transformations = Normalizer(transformations)
+    deadline = None if time_budget is None else time.perf_counter() + time_budget
+    #Mint a simplify_step-ben, egy kifejezés kifejtésekor a transzformációkat alkalmazza, majd a szabályokat;
+    #az állapotok a szabályok eredményei. A kiinduló állapot a normalizált kifejezés, ez is jelölt (mint a simplify
+    #első lépésében, akkor is, ha nincs szabály). Ha nem talál egyszerűbbet, a kapott kifejezést adja vissza.
+    best = expr
+    best_score = simplicity_measure(expr)
+    visited = {id(expr): expr}
+    start = transformations(expr)
+    if id(start) not in visited:
+        visited[id(start)] = start
+        score = simplicity_measure(start)
+        if score < best_score:
+            best, best_score = start, score
+    beam = [start]
+    nodes = 0
+    order = itertools.count()
+    while beam:
+        candidates = []
+        for state in beam:
+            state = transformations(state)
+            for rule in rules:
+                if max_nodes is not None and nodes >= max_nodes or deadline is not None and time.perf_counter() > deadline:
+                    return best
+                new_expr = apply_rule_in_tree(rule, state, index, memo)
+                if id(new_expr) in visited:
+                    continue
+                visited[id(new_expr)] = new_expr
+                nodes += 1
+                score = simplicity_measure(new_expr)
+                if score < best_score:
+                    best, best_score = new_expr, score
+                candidates.append((score, next(order), new_expr))
+        beam = [new_expr for score, _, new_expr in heapq.nsmallest(beam_width, candidates)]
+    return best
@@ -0,0 +1,386 @@
+from simplify import *
+from measure import m
+import time
+
+##############################################
+# Egyenlőség-telítés (equality saturation) e-gráffal
+##############################################
+
+#E-gráf: a kifejezések ekvivalencia-osztályai (e-osztályok), egy osztály e-csomópontok halmaza.
+#Egy e-csomópont egy (op, gyerekek) pár, ahol a gyerekek e-osztályok azonosítói:
+#   op = ('f', név, commutative, assoc): függvény, a kommutatív függvények gyerekei rendezettek
+#   op = ('leaf', kulcs): levél, lásd _leaf_key (a Var-okat azonosító alapján, a számokat érték szerint azonosítja)
+#A szabályok nem módosítják a kifejezést, hanem a bal és a jobb oldal osztályát összevonják (union), így egyszerre
+#az összes ekvivalens alakot tárolja, a szabályok sorrendje nem számít, és a két irányú szabályok sem "oltják ki" egymást.
+#Az összevonások után a rebuild állítja helyre a kongruenciát: az azonos op-ú és azonos osztályú gyerekeket tartalmazó
+#csomópontok osztályát is összevonja.
+#Minden osztálynak van egy reprezentáns kifejezése (az osztály első kifejezése, de egy szám vagy levél megelőzi a
+#függvényeket, lásd _term_rank), ezen ellenőrzi a változók tag-jeit (var_accepts) és ezt kapják meg az External függvények.
+class EGraph:
+    def __init__(self):
+        self._parent = []
+        self._size = []
+        self._terms = []
+        self._hashcons = {}
+        self._leaves = {}
+        self._nodes = {}
+        self._parents = {}
+        self._by_name = {}
+        self._new_nodes = []
+        self.stop_reason = None
+        self.iterations = 0
+
+    def find(self, c):
+        root = c
+        while self._parent[root] != root:
+            root = self._parent[root]
+        while self._parent[c] != root:
+            self._parent[c], c = root, self._parent[c]
+        return root
+
+    #Két osztály összevonása, igaz, ha eddig különbözőek voltak
+    #A kongruencia helyreállításához utána rebuild kell.
+    #Ha az osztály reprezentánsa egyszerűbb lesz (pl. az x+y-(x+y) osztályába bekerül a 0), akkor a szülő csomópontokat
+    #újra normalizálni kell (lásd saturate), ezért ezek bekerülnek az új csomópontok közé.
+    def union(self, c1, c2):
+        c1, c2 = self.find(c1), self.find(c2)
+        if c1 == c2:
+            return False
+        if self._size[c1] < self._size[c2]:
+            c1, c2 = c2, c1
+        self._parent[c2] = c1
+        self._size[c1] += self._size[c2]
+        self._nodes[c1].extend(self._nodes.pop(c2))
+        parents = self._parents.pop(c2)
+        if _term_rank(self._terms[c2]) < _term_rank(self._terms[c1]):
+            self._terms[c1] = self._terms[c2]
+            self._new_nodes.extend(self._parents[c1])
+        elif _term_rank(self._terms[c1]) < _term_rank(self._terms[c2]):
+            self._new_nodes.extend(parents)
+        self._parents[c1].extend(parents)
+        return True
+
+    def node_count(self):
+        return len(self._hashcons)
+
+    def class_count(self):
+        return len(self._nodes)
+
+    #Egy kifejezés hozzáadása, az osztályát adja vissza
+    def add_term(self, term):
+        if type(term) is Function:
+            children = [self.add_term(arg) for arg in term.args]
+            return self._add_node(('f', term.name, term.commutative, term.assoc), children, term)
+        key = _leaf_key(term)
+        self._leaves.setdefault(key, term)
+        return self._add_node(('leaf', key), (), term)
+
+    #Egy kifejezés osztálya, ha benne van az e-gráfban, egyébként None (nem ad hozzá semmit)
+    def lookup(self, term):
+        if type(term) is Function:
+            children = []
+            for arg in term.args:
+                c = self.lookup(arg)
+                if c is None:
+                    return None
+                children.append(c)
+            node = self._canonical((('f', term.name, term.commutative, term.assoc), tuple(children)))
+        else:
+            node = (('leaf', _leaf_key(term)), ())
+        c = self._hashcons.get(node)
+        return None if c is None else self.find(c)
+
+    #Egy osztály reprezentáns kifejezése
+    def term(self, c):
+        return self._terms[self.find(c)]
+
+    def _canonical(self, node):
+        op, children = node
+        children = tuple(self.find(c) for c in children)
+        if op[0] == 'f' and op[2]:
+            children = tuple(sorted(children))
+        return (op, children)
+
+    def _add_node(self, op, children, term=None):
+        node = self._canonical((op, children))
+        c = self._hashcons.get(node)
+        if c is not None:
+            return self.find(c)
+        if term is None:
+            term = self._node_term(node)
+        c = len(self._parent)
+        self._parent.append(c)
+        self._size.append(1)
+        self._terms.append(term)
+        self._hashcons[node] = c
+        self._nodes[c] = [node]
+        self._parents[c] = []
+        for child in set(node[1]):
+            self._parents[child].append(node)
+        self._by_name.setdefault(op[1] if op[0] == 'f' else None, set()).add(c)
+        self._new_nodes.append(node)
+        return c
+
+    #Egy csomópont kifejezése a gyerekosztályok reprezentánsaiból
+    def _node_term(self, node, terms=None):
+        op, children = node
+        if op[0] == 'leaf':
+            return self._leaves[op[1]]
+        args = [self._terms[self.find(c)] if terms is None else terms[self.find(c)] for c in children]
+        return make_function(op[1], args, op[2], op[3])
+
+    #A kongruencia helyreállítása: a csomópontok gyerekeit a gyökérosztályokra cseréli, és ha két osztályban
+    #azonos csomópont van, akkor a két osztályt összevonja. Addig ismétli, amíg van összevonás.
+    def rebuild(self):
+        changed = True
+        while changed:
+            changed = False
+            hashcons = {}
+            for node, c in self._hashcons.items():
+                node = self._canonical(node)
+                c = self.find(c)
+                other = hashcons.get(node)
+                if other is not None and self.find(other) != c:
+                    self.union(other, c)
+                    changed = True
+                hashcons[node] = c
+            self._hashcons = hashcons
+        self._nodes = {}
+        self._by_name = {}
+        for node, c in self._hashcons.items():
+            c = self.find(c)
+            self._nodes.setdefault(c, []).append(node)
+            self._by_name.setdefault(node[0][1] if node[0][0] == 'f' else None, set()).add(c)
+
+    ##############################################
+    # E-illesztés
+    ##############################################
+
+    #A minta illesztése egy osztályra, a lehetséges illesztéseket (változónév -> osztály, ill. szekvencia-változóra
+    #osztályok tuple-je) adja vissza egyenként. A mintákat a Rule.all_sources tartalmazza (flatten-elt alak).
+    #A függvényeket a match_all-hoz hasonlóan név szerint illeszti (az assoc jelzőtől függetlenül).
+    #Az asszociatív-kommutatív függvények paraméterei tetszőleges sorrendben illeszkednek, az utolsó változó
+    #(ha nincs szekvencia-változó) a maradék paraméterek szorzatára/összegére is illeszkedhet (ezt az osztályt létrehozza).
+    #Szekvencia-változó csak asszociatív-kommutatív függvényben, legfeljebb egy lehet (pl. a rejtett REST).
+    def match(self, pattern, c, subst):
+        c = self.find(c)
+        t = type(pattern)
+        if t is Var:
+            bound = subst.get(pattern.name)
+            if bound is not None:
+                if self.find(bound) == c:
+                    yield subst
+                return
+            if not var_accepts(pattern, self._terms[c]):
+                return
+            res = dict(subst)
+            res[pattern.name] = c
+            yield res
+        elif t is External:
+            values = pattern.func(self._terms[c], *pattern.func_args)
+            if values is None:
+                return
+            res = dict(subst)
+            for name, value in values.items():
+                vc = self.add_term(value)
+                if name in res and self.find(res[name]) != vc:
+                    return
+                res[name] = vc
+            yield res
+        elif t is Function and not _is_ground(pattern):
+            for node in list(self._nodes.get(c, ())):
+                if node[0][0] != 'f' or node[0][1] != pattern.name:
+                    continue
+                if pattern.commutative:
+                    yield from self._match_commutative(pattern, node, subst)
+                elif len(node[1]) == len(pattern.args) and not any(type(arg) is SeqVar for arg in pattern.args):
+                    yield from self._match_list(pattern.args, node[1], subst)
+        elif t is not SeqVar:
+            lc = self.lookup(pattern)
+            if lc is not None and lc == c:
+                yield subst
+
+    def _match_list(self, patterns, children, subst):
+        if not patterns:
+            yield subst
+            return
+        for res in self.match(patterns[0], children[0], subst):
+            yield from self._match_list(patterns[1:], children[1:], res)
+
+    def _match_commutative(self, pattern, node, subst):
+        op, children = node
+        seq = [arg for arg in pattern.args if type(arg) is SeqVar]
+        others = [arg for arg in pattern.args if type(arg) is not SeqVar]
+        if len(seq) > 1:
+            return
+        #Előbb a szerkezettel rendelkező paraméterek, a változók a végén
+        others.sort(key=lambda arg: type(arg) is Var)
+        absorb = not seq and pattern.assoc != -1 and others and type(others[-1]) is Var
+        if len(children) < len(others) or not seq and not absorb and len(children) != len(others):
+            return
+        yield from self._match_multiset(others, list(children), subst, seq[0] if seq else None, absorb, op)
+
+    def _match_multiset(self, patterns, children, subst, seq, absorb, op):
+        if not patterns:
+            if seq is None:
+                if not children:
+                    yield subst
+                return
+            if seq.name in subst or not var_accepts(seq, [self._terms[self.find(c)] for c in children]):
+                return
+            res = dict(subst)
+            res[seq.name] = tuple(children)
+            yield res
+            return
+        if absorb and len(patterns) == 1 and len(children) > 1:
+            #Az utolsó változó a maradék paraméterekre illeszkedik
+            yield from self.match(patterns[0], self._add_node(op, children), subst)
+            return
+        tried = set()
+        for i, c in enumerate(children):
+            c = self.find(c)
+            if c in tried:
+                continue
+            tried.add(c)
+            for res in self.match(patterns[0], c, subst):
+                yield from self._match_multiset(patterns[1:], children[:i] + children[i+1:], res, seq, absorb, op)
+
+    #A szabály jobb oldalának felépítése az e-gráfban, az osztályát adja vissza
+    def instantiate(self, target, subst):
+        if type(target) is Var and target.name in subst:
+            return subst[target.name]
+        if type(target) is not Function:
+            return self.add_term(target)
+        children = self._instantiate_args(target, subst)
+        if len(children) == 1 and target.assoc != -1:
+            return children[0]
+        return self._add_node(('f', target.name, target.commutative, target.assoc), children)
+
+    #A paraméterek osztályai: a szekvencia-változók értékét beilleszti, az azonos asszociatív függvényt összevonja
+    def _instantiate_args(self, target, subst):
+        children = []
+        for arg in target.args:
+            if type(arg) is SeqVar:
+                children.extend(subst.get(arg.name, ()))
+            elif type(arg) is Function and target.assoc != -1 and arg.name == target.name and arg.assoc == target.assoc:
+                children.extend(self._instantiate_args(arg, subst))
+            else:
+                children.append(self.instantiate(arg, subst))
+        return children
+
+    ##############################################
+    # Telítés és kiválasztás
+    ##############################################
+
+    #A szabályok alkalmazása, amíg van új csomópont vagy összevonás (telítés), vagy amíg el nem éri valamelyik korlátot.
+    #transformations: az új csomópontok kifejezéseire alkalmazza (pl. simplify_expr, ez értékeli ki a konstansokat),
+    #   és az eredményt ugyanabba az osztályba teszi.
+    #node_limit, iter_limit, time_limit: a csomópontok számának, az iterációk számának és az időnek (másodperc) a korlátja.
+    #A megállás oka a stop_reason: 'saturated', 'node_limit', 'iter_limit' vagy 'time_limit'.
+    def saturate(self, rules, transformations=(), node_limit=5000, iter_limit=30, time_limit=None):
+        deadline = None if time_limit is None else time.perf_counter() + time_limit
+        self.stop_reason = 'iter_limit'
+        self.rebuild()
+        self.iterations = 0
+        while self.iterations < iter_limit:
+            self.iterations += 1
+            changed = self._normalize_new_nodes(transformations, node_limit)
+            matches = []
+            for rule in rules:
+                for source in rule.all_sources:
+                    classes = self._by_name.get(source.name, ()) if type(source) is Function else list(self._nodes)
+                    for c in sorted(classes):
+                        for subst in self.match(source, c, {}):
+                            if any(name != REST.name for name in subst):
+                                matches.append((rule, subst, c))
+                    if deadline is not None and time.perf_counter() > deadline:
+                        self.stop_reason = 'time_limit'
+                        self.rebuild()
+                        return
+            for rule, subst, c in matches:
+                if self.union(c, self.instantiate(rule.rewrite_target, subst)):
+                    changed = True
+                if self.node_count() > node_limit:
+                    break
+            self.rebuild()
+            if self.node_count() > node_limit:
+                self.stop_reason = 'node_limit'
+                return
+            if not changed and not self._new_nodes:
+                self.stop_reason = 'saturated'
+                return
+            if deadline is not None and time.perf_counter() > deadline:
+                self.stop_reason = 'time_limit'
+                return
+
+    def _normalize_new_nodes(self, transformations, node_limit):
+        changed = False
+        while self._new_nodes and transformations and self.node_count() <= node_limit:
+            new_nodes, self._new_nodes = self._new_nodes, []
+            for node in new_nodes:
+                c = self._hashcons.get(self._canonical(node))
+                if c is None:
+                    continue
+                term = self._node_term(node)
+                for trf in transformations:
+                    term = trf(term)
+                if self.union(c, self.add_term(term)):
+                    changed = True
+            self.rebuild()
+        self._new_nodes = []
+        return changed
+
+    #A legkisebb mértékű kifejezés kiválasztása egy osztályból
+    #measure: a kifejezésekhez számot rendelő függvény (lásd measure.py), alapértelmezetten measure.m.
+    #Osztályonként a legkisebb mértékű kifejezést tartja meg, és ebből építi fel a szülő csomópontok kifejezéseit.
+    #Addig ismétli, amíg valamelyik osztály kifejezése javul. (Ha a mérték nem additív, pl. az m a fa magasságát is
+    #tartalmazza, akkor ez heurisztika, de a visszaadott kifejezés mértéke pontosan a measure értéke.)
+    def extract(self, c, measure=m):
+        self.rebuild()
+        scores = {}
+        terms = {}
+        changed = True
+        while changed:
+            changed = False
+            for cls in sorted(self._nodes):
+                for node in self._nodes[cls]:
+                    if any(self.find(child) not in terms for child in node[1]):
+                        continue
+                    term = self._node_term(node, terms)
+                    score = measure(term)
+                    if cls not in scores or score < scores[cls]:
+                        scores[cls] = score
+                        terms[cls] = term
+                        changed = True
+        return terms[self.find(c)]
+
+#Igaz, ha a mintában nincs változó (az eredményt a mintán tárolja, lásd node_memo)
+def _is_ground(pattern):
+    return node_memo(pattern, 'ground', lambda p: not pattern_var_names(p))
+
+#A reprezentáns kifejezések sorrendje: szám, egyéb levél, függvény
+def _term_rank(term):
+    if type(term) is Function:
+        return 2
+    return 0 if type(term) in (int, Fraction) else 1
+
+#A levelek kulcsa: a számokat érték szerint, a többit (az internálás miatt) azonosító alapján azonosítja
+def _leaf_key(term):
+    if type(term) in (int, Fraction):
+        return ('num', term)
+    return ('obj', id(term))
+
+#Egyszerűsítés egyenlőség-telítéssel
+#A kifejezést és a transzformációkkal normalizált alakját egy e-gráfba teszi, telíti a szabályokkal, majd a
+#legkisebb mértékű ekvivalens kifejezést adja vissza. A paraméterek: lásd EGraph.saturate és EGraph.extract.
+#Ha egraph-ot is kap, abba építi fel a kifejezést (pl. a stop_reason lekérdezéséhez).
+def egraph_simplify(expr, rules, transformations=(simplify_expr,), measure=m, node_limit=5000, iter_limit=30, time_limit=None, egraph=None):
+    if egraph is None:
+        egraph = EGraph()
+    c = egraph.add_term(expr)
+    normalized = expr
+    for trf in transformations:
+        normalized = trf(normalized)
+    egraph.union(c, egraph.add_term(normalized))
+    egraph.saturate(rules, transformations, node_limit, iter_limit, time_limit)
+    return egraph.extract(c, measure)
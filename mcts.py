@@ -0,0 +1,155 @@
+from simplify import *
+import math
+import random
+import time
+
+#Egyszerűsítés Monte Carlo fakereséssel (MCTS)
+#Egy iteráció: a gyökértől az UCT szabály szerint választ a már kifejtett kifejezések között, amíg olyan kifejezéshez
+#nem ér, amelynek van még nem látogatott rákövetkezője (a rákövetkezők, mint a beam_simplify-ban: a transzformációk,
+#majd egy szabály alkalmazása a teljes fában). Ebből véletlen szabályalkalmazásokkal (rollout) halad tovább, a jutalom
+#azt méri, mennyivel egyszerűbb az út legegyszerűbb kifejezése a kiindulásnál. A jutalmat az út összes kifejezésére
+#visszaterjeszti.
+#A statisztikák (látogatások száma, összes jutalom) kifejezésenként vannak tárolva, az internálás miatt azonosító alapján,
+#így a különböző úton elért azonos kifejezések (transzpozíciók) közös statisztikát kapnak.
+#Bármikor megszakítható: a best mindig az eddig látott legegyszerűbb kifejezés (ha nincs egyszerűbb, a kiinduló kifejezés).
+#Paraméterek: lásd simplify, továbbá
+#exploration: az UCT felfedezési konstansa
+#rollout_depth: a véletlen lépések száma egy rolloutban
+#seed: a véletlenszám-generátor kezdőértéke (azonos paraméterekkel és iterációszámmal az eredmény is azonos)
+#clock: az idő mérése a time_budget-hez (másodpercben), alapértelmezetten time.perf_counter
+class MonteCarloTreeSearch:
+    def __init__(self, expr, rules, transformations, simplicity_measure, index=None, memo=None, exploration=1.4, rollout_depth=5, seed=0, clock=time.perf_counter):
+        if type(transformations) is not Normalizer:
+            transformations = Normalizer(transformations)
+        self.rules = rules
+        self.transformations = transformations
+        self.simplicity_measure = simplicity_measure
+        self.index = index
+        self.memo = memo
+        self.exploration = exploration
+        self.rollout_depth = rollout_depth
+        self.random = random.Random(seed)
+        self.clock = clock
+        self.root = expr
+        self.root_score = simplicity_measure(expr)
+        self.best = expr
+        self.best_score = self.root_score
+        self.iterations = 0
+        self._deadline = None
+        self._scale = max(abs(self.root_score), 1)
+        #kifejezés azonosítója -> [kifejezés, látogatások, összes jutalom]
+        self._stats = {}
+        #kifejezés azonosítója -> (kifejezés, rákövetkezők)
+        self._successors = {}
+        self._scores = {}
+
+    #Legfeljebb time_budget másodpercig ill. iterations iterációig keres (ha mindkettő None, akkor egy iterációt végez),
+    #majd az eddigi legjobb kifejezést adja vissza. Többször is hívható, a keresés folytatódik.
+    #Az időkorlátot az iterációkon belül is figyeli (a kiválasztás és a rollout lépései előtt): ha lejárt, az iteráció
+    #az addig bejárt úttal és rollouttal fejeződik be.
+    def run(self, time_budget=None, iterations=None):
+        if time_budget is None and iterations is None:
+            iterations = 1
+        self._deadline = None if time_budget is None else self.clock() + time_budget
+        done = 0
+        try:
+            while (iterations is None or done < iterations) and not self._out_of_time():
+                self.iterate()
+                done += 1
+        finally:
+            self._deadline = None
+        return self.best
+
+    def _out_of_time(self):
+        return self._deadline is not None and self.clock() >= self._deadline
+
+    def iterate(self):
+        self.iterations += 1
+        path = [self.root]
+        on_path = {id(self.root)}
+        state = self.root
+        while not self._out_of_time():
+            successors = [s for s in self.successors(state) if id(s) not in on_path]
+            if not successors:
+                break
+            unvisited = [s for s in successors if id(s) not in self._stats]
+            if unvisited:
+                state = unvisited[0]
+                path.append(state)
+                break
+            state = self._select(state, successors)
+            path.append(state)
+            on_path.add(id(state))
+        reward = self._reward(min(self.score(s) for s in path[1:] or path), self._rollout(state))
+        for s in path:
+            entry = self._stats.get(id(s))
+            if entry is None:
+                entry = self._stats[id(s)] = [s, 0, 0.0]
+            entry[1] += 1
+            entry[2] += reward
+
+    #Látogatások száma és átlagos jutalom egy kifejezésre (0, 0.0 ha még nem látogatott)
+    def statistics(self, expr):
+        entry = self._stats.get(id(expr))
+        if entry is None or entry[0] is not expr:
+            return 0, 0.0
+        return entry[1], entry[2] / entry[1]
+
+    #A különböző rákövetkezők, a szabályok sorrendjében (a kifejezés maga nem)
+    def successors(self, expr):
+        entry = self._successors.get(id(expr))
+        if entry is not None and entry[0] is expr:
+            return entry[1]
+        normalized = self.transformations(expr)
+        res = []
+        seen = {id(expr)}
+        for new_expr in [normalized] + [apply_rule_in_tree(rule, normalized, self.index, self.memo) for rule in self.rules]:
+            if id(new_expr) not in seen:
+                seen.add(id(new_expr))
+                res.append(new_expr)
+        self._successors[id(expr)] = (expr, res)
+        return res
+
+    #A mérték (kifejezésenként tárolva), a legjobb kifejezést is frissíti
+    def score(self, expr):
+        entry = self._scores.get(id(expr))
+        if entry is not None and entry[0] is expr:
+            return entry[1]
+        score = self.simplicity_measure(expr)
+        self._scores[id(expr)] = (expr, score)
+        if score < self.best_score:
+            self.best, self.best_score = expr, score
+        return score
+
+    def _select(self, state, successors):
+        log_n = math.log(self._stats[id(state)][1])
+        best = None
+        best_value = None
+        for s in successors:
+            entry = self._stats[id(s)]
+            value = entry[2] / entry[1] + self.exploration * math.sqrt(log_n / entry[1])
+            if best is None or value > best_value:
+                best, best_value = s, value
+        return best
+
+    def _rollout(self, state):
+        best_score = self.score(state)
+        for _ in range(self.rollout_depth):
+            if self._out_of_time():
+                break
+            successors = self.successors(state)
+            if not successors:
+                break
+            state = self.random.choice(successors)
+            best_score = min(best_score, self.score(state))
+        return best_score
+
+    #A jutalom: mennyivel egyszerűbb az út (ill. a rollout) legegyszerűbb kifejezése a kiindulásnál, a kiindulás mértékéhez
+    #viszonyítva (a mérték előjelétől függetlenül)
+    def _reward(self, *scores):
+        return (self.root_score - min(scores)) / self._scale
+
+#Egyszerűsítés MCTS-sel, legfeljebb time_budget másodpercig ill. iterations iterációig, lásd MonteCarloTreeSearch
+def mcts_simplify(expr, rules, transformations, simplicity_measure, index=None, memo=None, time_budget=1.0, iterations=None, exploration=1.4, rollout_depth=5, seed=0, clock=time.perf_counter):
+    search = MonteCarloTreeSearch(expr, rules, transformations, simplicity_measure, index, memo, exploration, rollout_depth, seed, clock)
+    return search.run(time_budget, iterations)
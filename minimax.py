@@ -1,5 +1,40 @@
-import copy
+import concurrent.futures
 import itertools
+import time
+import simplify
+
+INF = float('inf')
+
+#Kinds of transposition table entries
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+class SearchBudgetExceeded(Exception):
+    """
+    Raised inside the search when the time or node budget of a move runs out
+    """
+    pass
+
+#The SimplifyMiniMax instance of a worker process in the parallel mode
+_worker = None
+
+def _init_worker(rules, ruleApplication, measure, useRuleIndex, useRewriteMemo, tableSize, depth):
+    """
+    Initializes a worker process of the parallel mode: the rules, the rule
+    application and the measure are sent (pickled) once, and the worker builds
+    its own rule index, rewrite memo and transposition table
+    """
+    global _worker
+    ruleIndex = simplify.RuleIndex(rules) if useRuleIndex else None
+    rewriteMemo = simplify.RewriteMemo() if useRewriteMemo else None
+    _worker = SimplifyMiniMax(None, rules, 0, 0, [], ruleApplication, measure, ruleIndex, rewriteMemo, tableSize, depth)
+
+def _evaluate_move(expr, depth):
+    """
+    Returns the exact score of a first level move, computed in a worker process
+    """
+    return _worker.EvaluateMove(expr, depth)
 
 class SimplifyMiniMax:
     """
@@ -10,30 +45,278 @@ class SimplifyMiniMax:
     tries to MAXIMIZE the measure before each new rule application, while
     expectig the worst possible scenario for the given rule application.
     """
-    def __init__(self, expression, rules, iterations, eps, transformations, ruleApplication, measure):
+    def __init__(self, expression, rules, iterations, eps, transformations, ruleApplication, measure, ruleIndex=None, rewriteMemo=None, tableSize=1000000, depth=3, timeBudget=None, nodeBudget=None, processes=None):
         """
         DOT 2018-06-29:
         
         Initalize internal states
+
+        ruleIndex: optional simplify.RuleIndex built from the rules. When given,
+        it is passed to ruleApplication as the index keyword argument, so only
+        the subtrees a rule can match are visited.
+
+        rewriteMemo: optional simplify.RewriteMemo shared by every rule
+        application of the run (passed as the memo keyword argument), so
+        unchanged subtrees are not matched against the same rule again.
+
+        tableSize: the transposition table (successors, measures and scores of
+        the expressions seen so far, kept between moves) is emptied before a
+        move when it has more entries than this.
+
+        depth: the number of rule applications looked ahead in a move (the
+        move itself included).
+
+        timeBudget, nodeBudget: when either is given, a move is searched with
+        iterative deepening: depth 1, 2, ... up to depth (no limit if depth is
+        None) until the time (in seconds) or the number of evaluated nodes
+        runs out. The best move of the deepest completed search is made.
+
+        processes: opt-in parallel mode, the number of worker processes (0
+        means one per CPU). The first level moves are scored in a process
+        pool, see ParallelBestMove. The rules, ruleApplication and measure
+        must be picklable (module level functions, External guards such as
+        separate_2 included). The pool is shut down by Close, which MiniMax
+        calls at the end. Can not be combined with a time or node budget.
         """
+        if processes is not None and (timeBudget is not None or nodeBudget is not None):
+            raise ValueError("the parallel mode can not be used with a time or node budget")
+        if depth is None and timeBudget is None and nodeBudget is None:
+            raise ValueError("depth must be given without a time or node budget")
+        if depth is not None and depth < 1:
+            raise ValueError("depth must be at least 1")
         self._rules = rules
+        self._ruleIndex = ruleIndex
+        self._rewriteMemo = rewriteMemo
         self._transformations = transformations
+        self._normalizer = simplify.Normalizer(transformations)
         self._applyRule = ruleApplication
         self._measure = measure
         self._root = expression
         self._iterations = iterations
         self._eps = eps
+        self._tableSize = tableSize
+        self._depth = depth
+        self._timeBudget = timeBudget
+        self._nodeBudget = nodeBudget
+        self._deadline = None
+        self._nodesLeft = None
+        self._bestSoFar = None
+        self._completedDepth = 0
+        self._expanded = 0
+        self._measured = 0
+        self._processes = processes
+        self._pool = None
+        self.ClearTables()
     
+    def ApplyRule(self, rule, expr):
+        """
+        Applies a single rule to expr, using the rule index and the rewrite
+        memo if there are any
+        """
+        kwargs = {}
+        if self._ruleIndex is not None:
+            kwargs['index'] = self._ruleIndex
+        if self._rewriteMemo is not None:
+            kwargs['memo'] = self._rewriteMemo
+        return self._applyRule(rule, expr, **kwargs)
+
     def NormalizeNode(self):
         """
         DOT 2018-06-29:
         
         Normalizes the root node for further simplification. This means
         the method applies all available transformations
+
+        The transformations are applied through a simplify.Normalizer, which
+        tracks the normalized status of every node. After a move only the
+        rewritten subtree and its path to the root are normalized again.
         """
-        for trf in self._transformations:
-            self._root = trf(copy.deepcopy(self._root))
+        self._root = self._normalizer(self._root)
     
+    def Successors(self, expr):
+        """
+        Returns the distinct expressions reachable from expr with a single rule
+        application, in the order of the rules (the first occurrence is kept).
+        If a rule does not change expr, expr itself is one of the successors.
+        The result is stored in the transposition table.
+        """
+        entry = self._successorTable.get(id(expr))
+        if entry is not None and entry[0] is expr:
+            return entry[1]
+        self._expanded += 1
+        seen = set()
+        successors = []
+        for rule in self._rules:
+            new_expr = self.ApplyRule(rule, expr)
+            if id(new_expr) not in seen:
+                seen.add(id(new_expr))
+                successors.append(new_expr)
+        self._successorTable[id(expr)] = (expr, successors)
+        return successors
+
+    def Measure(self, expr):
+        """
+        Returns the measure of expr, stored in the transposition table
+        """
+        entry = self._measureTable.get(id(expr))
+        if entry is not None and entry[0] is expr:
+            return entry[1]
+        self._measured += 1
+        value = self._measure(expr)
+        self._measureTable[id(expr)] = (expr, value)
+        return value
+
+    def Evaluate(self, expr, depth, maximizing, alpha, beta):
+        """
+        Alpha-beta evaluation of expr, with depth more rule applications to
+        look ahead. maximizing tells whether the rule applied next is chosen to
+        maximize or to minimize the measure; the levels below alternate.
+
+        The returned value v is exact if alpha < v < beta, otherwise it is an
+        upper (v <= alpha) or a lower (v >= beta) bound. Exact values and
+        bounds are stored in the transposition table, keyed by the expression,
+        depth and maximizing.
+        """
+        if self._deadline is not None or self._nodesLeft is not None:
+            self.CheckBudget()
+        if depth == 0:
+            return self.Measure(expr)
+        key = (id(expr), depth, maximizing)
+        entry = self._scoreTable.get(key)
+        if entry is not None and entry[0] is expr:
+            value, flag = entry[1], entry[2]
+            if flag == EXACT or (flag == LOWER and value >= beta) or (flag == UPPER and value <= alpha):
+                return value
+        alphaOrig, betaOrig = alpha, beta
+        if maximizing:
+            value = -INF
+            for child in self.Successors(expr):
+                value = max(value, self.Evaluate(child, depth - 1, not maximizing, alpha, beta))
+                alpha = max(alpha, value)
+                if alpha >= beta:
+                    break
+        else:
+            value = INF
+            for child in self.Successors(expr):
+                value = min(value, self.Evaluate(child, depth - 1, not maximizing, alpha, beta))
+                beta = min(beta, value)
+                if alpha >= beta:
+                    break
+        if value <= alphaOrig:
+            flag = UPPER
+        elif value >= betaOrig:
+            flag = LOWER
+        else:
+            flag = EXACT
+        self._scoreTable[key] = (expr, value, flag)
+        return value
+
+    def EvaluateMove(self, expr, depth):
+        """
+        Returns the exact score of the move to expr, looking ahead depth more
+        rule applications (the worker processes of the parallel mode score
+        the first level moves with this)
+        """
+        self.TrimTables()
+        return self.Evaluate(expr, depth, True, -INF, INF)
+
+    def CheckBudget(self):
+        """
+        Counts an evaluated node and raises SearchBudgetExceeded if the time
+        or node budget of the current move has run out
+        """
+        if self._nodesLeft is not None:
+            self._nodesLeft -= 1
+            if self._nodesLeft < 0:
+                raise SearchBudgetExceeded()
+        if self._deadline is not None and time.perf_counter() > self._deadline:
+            raise SearchBudgetExceeded()
+
+    def BestMove(self, depth):
+        """
+        Returns the best first move from the root, looking ahead depth rule
+        applications (the move itself included), or None if there are no
+        moves. Of the equally good moves, the one whose rule comes first is
+        chosen. The best move found so far is kept in self._bestSoFar.
+        """
+        best = None
+        bestScore = -INF
+        for expr in self.Successors(self._root):
+            score = self.Evaluate(expr, depth - 1, True, bestScore, INF)
+            if best is None or score > bestScore:
+                best, bestScore = expr, score
+                self._bestSoFar = best
+        return best
+
+    def ParallelBestMove(self, depth):
+        """
+        Like BestMove, but the distinct first level moves are scored in the
+        process pool, each one independently and exactly (without the bound of
+        the moves before it). The move is chosen in the parent process from
+        the scores in the order of the rules, so the result is deterministic
+        and the same as in the serial mode.
+        """
+        candidates = self.Successors(self._root)
+        if depth == 1 or len(candidates) < 2:
+            return self.BestMove(depth)
+        best = None
+        bestScore = -INF
+        scores = self.Pool().map(_evaluate_move, candidates, itertools.repeat(depth - 1))
+        for expr, score in zip(candidates, scores):
+            if best is None or score > bestScore:
+                best, bestScore = expr, score
+        return best
+
+    def Pool(self):
+        """
+        Returns the process pool of the parallel mode, starting it if needed
+        """
+        if self._pool is None:
+            self._pool = concurrent.futures.ProcessPoolExecutor(
+                self._processes or None, initializer=_init_worker,
+                initargs=(self._rules, self._applyRule, self._measure, self._ruleIndex is not None,
+                          self._rewriteMemo is not None, self._tableSize, self._depth))
+        return self._pool
+
+    def Close(self):
+        """
+        Shuts down the process pool of the parallel mode, if there is one
+        """
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def IterativeDeepening(self):
+        """
+        Searches the best move with depth 1, 2, ... until the depth limit is
+        reached or the budget runs out, and returns the best move of the
+        deepest completed search. If not even the depth 1 search completed,
+        the best move found by it so far is returned (None if there is none).
+        The transposition table makes the already searched levels cheap.
+        """
+        if self._timeBudget is not None:
+            self._deadline = time.perf_counter() + self._timeBudget
+        self._nodesLeft = self._nodeBudget
+        self._bestSoFar = None
+        self._completedDepth = 0
+        best = None
+        try:
+            depth = 1
+            while self._depth is None or depth <= self._depth:
+                move = self.BestMove(depth)
+                if move is None:
+                    break
+                best = move
+                self._completedDepth = depth
+                depth += 1
+        except SearchBudgetExceeded:
+            if best is None:
+                best = self._bestSoFar
+        finally:
+            self._deadline = None
+            self._nodesLeft = None
+        return best
+
     def GetNextMove(self):
         """
         DOT 2018-06-29:
@@ -42,50 +325,48 @@ class SimplifyMiniMax:
         implements a single MiniMax iteration. Current implementation looks
         ahead three possible moves. Keep in mind, that increasing this number
         greatly effects performance. 
+
+        The lookahead is self._depth moves (three by default). The first move
+        maximizes the score of the expression it produces. The score of an
+        expression is the best score of the next move, and from there on the
+        levels alternate between the worst and the best score; the last level
+        is scored by the measure. The game tree is evaluated depth-first with
+        alpha-beta pruning, so only the path to the current node is held in
+        memory. Only the distinct successors of an expression are evaluated
+        (a rule that does not match produces the expression itself, which is
+        evaluated once). The successors, measures and scores are cached in a
+        transposition table. With a time or node budget the search deepens
+        iteratively (see IterativeDeepening).
         """
         self.NormalizeNode()
-        
-        firstLevelExpressions = []
-        secondLevelExpressions = []
-        thirdLevelExpressions = []
-        
-        secondLevelScores = []
-        firstLevelScores = []
-        
-        #Generate possible next moves
-        for rule in self._rules:
-            firstLevelExpressions.append(self._applyRule(rule, copy.deepcopy(self._root)))
-            firstLevelScores.append(None)
-
-        #Generate possible second level moves
-        for expr in firstLevelExpressions:
-            secondLevelExpressions.append([])
-            secondLevelScores.append([])
-            for rule in self._rules:
-                secondLevelExpressions[-1].append(self._applyRule(rule, copy.deepcopy(expr)))
-                secondLevelScores[-1].append(None)
-
-        #Generate third level moves
-        for flexpr in secondLevelExpressions:
-            thirdLevelExpressions.append([])
-            for expr in flexpr:
-                thirdLevelExpressions[-1].append([])
-                for rule in self._rules:
-                    thirdLevelExpressions[-1][-1].append(self._applyRule(rule, copy.deepcopy(expr)))
-                    
-        #First generate the second level scores from the third level expressions
-        for i in range(0, len(thirdLevelExpressions)):
-            for j in range(0, len(thirdLevelExpressions[i])):
-                candidates = [self._measure(expr) for expr in thirdLevelExpressions[i][j]]
-                secondLevelScores[i][j] = min(candidates)
-            
-        #Finally, generate the firs level scores from the second level scores
-        for i in range(0, len(secondLevelExpressions)):
-            firstLevelScores[i] = max(secondLevelScores[i])
+        self.TrimTables()
+
+        if self._processes is not None:
+            best = self.ParallelBestMove(self._depth)
+        elif self._timeBudget is None and self._nodeBudget is None:
+            best = self.BestMove(self._depth)
+        else:
+            best = self.IterativeDeepening()
         
         #New expression:
-        self._root = firstLevelExpressions[firstLevelScores.index(max(firstLevelScores))]
+        if best is not None:
+            self._root = best
         self.NormalizeNode()
+
+    def ClearTables(self):
+        """
+        Empties the transposition table
+        """
+        self._successorTable = {}
+        self._measureTable = {}
+        self._scoreTable = {}
+
+    def TrimTables(self):
+        """
+        Empties the transposition table if it has more entries than tableSize
+        """
+        if len(self._successorTable) + len(self._scoreTable) + len(self._measureTable) > self._tableSize:
+            self.ClearTables()
         
     def MiniMax(self):
         """
@@ -102,11 +383,14 @@ class SimplifyMiniMax:
         print("eps: "+str(self._eps))
         
         last = None
-        while last != self._root and self._measure(self._root) < self._eps and currentIteration < self._iterations:
-            last = self._root
-            print("[MiniMax] iteration: "+str(currentIteration)+" expression: "+str(self._root)+" measure: "+str(self._measure(self._root)))
-            self.GetNextMove()
-            currentIteration += 1
+        try:
+            while last != self._root and self._measure(self._root) < self._eps and currentIteration < self._iterations:
+                last = self._root
+                print("[MiniMax] iteration: "+str(currentIteration)+" expression: "+str(self._root)+" measure: "+str(self._measure(self._root)))
+                self.GetNextMove()
+                currentIteration += 1
+        finally:
+            self.Close()
             
         print("Minimax end")
             
@@ -0,0 +1,451 @@
+from simplify import *
+import itertools
+import math
+import numbers
+
+##############################################
+# Ritka többváltozós polinomok
+##############################################
+
+#Polinom: a tagok dict-je, kitevő-tuple -> racionális együttható (int vagy normalizált Fraction)
+#variables: a változók tuple-je, a kitevő-tuple i. eleme a variables i. elemének kitevője.
+#   Változó lehet Var vagy bármilyen részfa, ami nem polinom (pl. sin(x), (x+y)^-1), ezeket atomként kezeljük.
+#terms: a nulla együtthatós tagok nincsenek benne, a kitevő-tuple-k végéről a nullák el vannak hagyva,
+#   így a változólista bővítése nem érinti a meglévő tagokat (pl. 3*x*y^2 -> {(1, 2): 3}, a konstans 5 -> {(): 5}).
+class Polynomial:
+    __slots__ = ('variables', 'terms')
+
+    def __init__(self, variables=(), terms=None):
+        self.variables = tuple(variables)
+        self.terms = terms if terms is not None else {}
+
+    def is_zero(self):
+        return not self.terms
+
+    def is_constant(self):
+        return not self.terms or len(self.terms) == 1 and () in self.terms
+
+    #A legnagyobb összfokszám (a nulla polinomé -1)
+    def total_degree(self):
+        return max((sum(exps) for exps in self.terms), default=-1)
+
+    def __add__(self, other):
+        p, q = unify(self, other)
+        return Polynomial(p.variables, _add_terms(p.terms, q.terms))
+
+    def __neg__(self):
+        return Polynomial(self.variables, {exps: rational_sub(0, coef) for exps, coef in self.terms.items()})
+
+    def __sub__(self, other):
+        return self + (-other)
+
+    def __mul__(self, other):
+        p, q = unify(self, other)
+        return Polynomial(p.variables, _mul_terms(p.terms, q.terms))
+
+    #A nulla polinom nulladik hatványa nem definiált (mint a simplify_expr-ben a 0^0)
+    def __pow__(self, n):
+        if n == 0 and not self.terms:
+            raise ZeroDivisionError("0^0 is undefined")
+        return Polynomial(self.variables, _pow_terms(self.terms, n))
+
+    def __eq__(self, other):
+        if type(other) is not Polynomial:
+            return NotImplemented
+        p, q = unify(self, other)
+        return p.terms == q.terms
+
+    def __repr__(self):
+        return "Polynomial({})".format(self.to_expr())
+
+    #Visszaalakítás kifejezésfává
+    #A tagok (monomok) simplify_expr szerinti kanonikus alakúak, fokszám szerint növekvő sorrendben következnek.
+    #Az összeg NEM kanonikus: a teljes összegre nem fut simplify_expr (sok tagra az négyzetes), így a tagok sorrendje
+    #eltérhet a simplify_expr-étől (az összegben nincsenek összevonható tagok). Ha kanonikus alak kell, az eredményre
+    #simplify_expr-t kell alkalmazni (transzformációként pl. [expand, simplify_expr]).
+    def to_expr(self):
+        summands = [_monomial_expr(self.variables, exps, coef) for exps, coef in sorted(self.terms.items(), key=_graded_key)]
+        if not summands:
+            return 0
+        if len(summands) == 1:
+            return summands[0]
+        return AC0('+', *summands)
+
+#Két polinom közös változólistára hozása (a második polinom új változói a lista végére kerülnek)
+def unify(p, q):
+    if p.variables == q.variables:
+        return p, q
+    variables = list(p.variables)
+    index = {var: i for i, var in enumerate(variables)}
+    for var in q.variables:
+        if var not in index:
+            index[var] = len(variables)
+            variables.append(var)
+    positions = [index[var] for var in q.variables]
+    terms = {}
+    for exps, coef in q.terms.items():
+        new_exps = [0] * len(variables)
+        for k, e in zip(positions, exps):
+            new_exps[k] = e
+        terms[_strip(new_exps)] = coef
+    return Polynomial(variables, p.terms), Polynomial(variables, terms)
+
+#A tuple végéről a nullák elhagyása
+def _strip(exps):
+    n = len(exps)
+    while n > 0 and exps[n-1] == 0:
+        n -= 1
+    return tuple(exps[:n])
+
+#Két monom szorzata (a kitevők összege)
+def _mono_mul(a, b):
+    if len(a) < len(b):
+        a, b = b, a
+    return tuple([x + y for x, y in zip(a, b)]) + a[len(b):]
+
+def _add_terms(a, b):
+    res = dict(a)
+    for exps, coef in b.items():
+        c = rational_add(res.get(exps, 0), coef)
+        if c == 0:
+            res.pop(exps, None)
+        else:
+            res[exps] = c
+    return res
+
+def _mul_terms(a, b):
+    if len(a) < len(b):
+        a, b = b, a
+    res = {}
+    for eb, cb in b.items():
+        for ea, ca in a.items():
+            exps = _mono_mul(ea, eb)
+            if type(ca) is int and type(cb) is int:
+                c = ca * cb
+            else:
+                c = rational_mul(ca, cb)
+            old = res.get(exps)
+            if old is None:
+                res[exps] = c
+            elif type(old) is int and type(c) is int:
+                res[exps] = old + c
+            else:
+                res[exps] = rational_add(old, c)
+    return {exps: coef for exps, coef in res.items() if coef != 0}
+
+#Hatványozás ismételt négyzetre emeléssel
+def _pow_terms(a, n):
+    res = {(): 1}
+    while n > 0:
+        if n & 1:
+            res = _mul_terms(res, a)
+        n >>= 1
+        if n:
+            a = _mul_terms(a, a)
+    return res
+
+#Egy tag (együttható * változók hatványai) kifejezésfaként
+def _monomial_expr(variables, exps, coef):
+    factors = [coef]
+    for var, e in zip(variables, exps):
+        if e == 1:
+            factors.append(var)
+        elif e != 0:
+            factors.append(F('^', var, e))
+    if len(factors) == 1:
+        return coef
+    res = simplify_expr(AC0('*', *factors))
+    if res is None:
+        #nem definiált atom (pl. 0^0): a szorzat változatlanul marad
+        return _product(factors[1:] if coef == 1 else factors)
+    return res
+
+#A tagok sorrendje: fokszám, azon belül a kitevő-tuple szerint
+def _graded_key(item):
+    return (sum(item[0]), item[0])
+
+def _is_rational(expr):
+    return isinstance(expr, numbers.Integral) or type(expr) is Fraction and expr.denom != 0
+
+#Kifejezésfa átalakítása polinommá
+#variables: a változók kezdeti sorrendje (a többi változó a megtalálás sorrendjében kerül a végére)
+#expand_atoms: ha igaz, akkor az atomok (pl. sin(...)) paramétereit is kifejti, lásd expand
+def from_expr(expr, variables=(), expand_atoms=False):
+    variables = list(variables)
+    index = {var: i for i, var in enumerate(variables)}
+    terms = _convert(expr, variables, index, expand_atoms)
+    return Polynomial(variables, terms)
+
+def _convert(expr, variables, index, expand_atoms):
+    if _is_rational(expr):
+        value = simplify_rational_number(expr)
+        return {(): value} if value != 0 else {}
+    if type(expr) is Function:
+        name = expr.name
+        if name == '+':
+            res = {}
+            for arg in expr.args:
+                res = _add_terms(res, _convert(arg, variables, index, expand_atoms))
+            return res
+        if name == '*':
+            res = {(): 1}
+            for arg in expr.args:
+                res = _mul_terms(res, _convert(arg, variables, index, expand_atoms))
+                if not res:
+                    break
+            return res
+        if name == '-' and len(expr.args) == 2:
+            rhs = _convert(expr.args[1], variables, index, expand_atoms)
+            return _add_terms(_convert(expr.args[0], variables, index, expand_atoms), _mul_terms(rhs, {(): -1}))
+        if name == '-' and len(expr.args) == 1:
+            return _mul_terms(_convert(expr.args[0], variables, index, expand_atoms), {(): -1})
+        if name == '/' and len(expr.args) == 2:
+            inverse = simplify_int_power(expr.args[1], -1)
+            if inverse is None:
+                return _atom(expr, variables, index, expand_atoms)
+            return _mul_terms(_convert(expr.args[0], variables, index, expand_atoms), _convert(inverse, variables, index, expand_atoms))
+        if name == '^' and len(expr.args) == 2 and isinstance(expr.args[1], numbers.Integral):
+            n = expr.args[1]
+            base = expr.args[0]
+            if n >= 0:
+                terms = _convert(base, variables, index, expand_atoms)
+                if n == 0 and not terms:
+                    #a 0^0 nem definiált (a simplify_expr-ben None), atomként marad
+                    return _atom(expr, variables, index, False)
+                return _pow_terms(terms, n)
+            if _is_rational(base):
+                value = rational_pow(base, n)
+                if value is not None:
+                    return {(): value}
+    return _atom(expr, variables, index, expand_atoms)
+
+#Egy atom (nem polinom részfa) mint változó
+def _atom(expr, variables, index, expand_atoms):
+    if expand_atoms and type(expr) is Function:
+        expr = simplify_expr(map_args(expr, expand))
+    k = index.get(expr)
+    if k is None:
+        k = len(variables)
+        index[expr] = k
+        variables.append(expr)
+    return {(0,) * k + (1,): 1}
+
+##############################################
+# Polinomok legnagyobb közös osztója
+##############################################
+
+#Két polinom legnagyobb közös osztója (racionális együtthatós polinomként, az egység szorzótól eltekintve)
+#Rekurzív primitív maradéksorozattal (primitive PRS): a polinomokat a legnagyobb indexű változójuk szerint
+#egyváltozósnak tekintjük, az együtthatók a többi változó polinomjai.
+#Az eredmény egész együtthatós, az együtthatók relatív prímek és a vezető együttható pozitív (lásd _normalize_numeric).
+def polynomial_gcd(p, q):
+    p, q = unify(p, q)
+    return Polynomial(p.variables, _gcd_terms(p.terms, q.terms))
+
+#Pontos osztás: p/q polinom, ha q osztója p-nek, egyébként None
+def divide(p, q):
+    if q.is_zero():
+        raise ZeroDivisionError("division by the zero polynomial")
+    p, q = unify(p, q)
+    terms = _divide_terms(p.terms, q.terms)
+    if terms is None:
+        return None
+    return Polynomial(p.variables, terms)
+
+#Monomok lexikografikus rendezése (az első változó a legnagyobb súlyú), a tuple-k ki vannak egészítve nullákkal
+def _lex_key(exps, n):
+    return exps + (0,) * (n - len(exps))
+
+def _leading(terms):
+    n = max(len(exps) for exps in terms)
+    return max(terms, key=lambda exps: _lex_key(exps, n))
+
+def _divide_terms(a, b):
+    lb = _leading(b)
+    cb = b[lb]
+    q = {}
+    r = a
+    while r:
+        lr = _leading(r)
+        if len(lr) < len(lb) or any(x < y for x, y in zip(lr, lb)):
+            return None
+        m = _strip([x - y for x, y in itertools.zip_longest(lr, lb, fillvalue=0)])
+        c = rational_div(r[lr], cb)
+        q[m] = c
+        r = _add_terms(r, _mul_terms({m: rational_sub(0, c)}, b))
+    return q
+
+#A k. változó fokszáma
+def _degree(terms, k):
+    return max((exps[k] if len(exps) > k else 0 for exps in terms), default=-1)
+
+#Együtthatók a k. változó hatványai szerint: fokszám -> a többi változó polinomja
+def _coefficients(terms, k):
+    res = {}
+    for exps, coef in terms.items():
+        d = exps[k] if len(exps) > k else 0
+        res.setdefault(d, {})[_strip(exps[:k] + (0,) + exps[k+1:])] = coef
+    return res
+
+#Egész együtthatós, relatív prím együtthatójú, pozitív vezető együtthatójú számszoros
+def _normalize_numeric(terms):
+    if not terms:
+        return terms
+    lcm = 1
+    for coef in terms.values():
+        d = denom(coef)
+        lcm = lcm * d // math.gcd(lcm, d)
+    g = 0
+    for coef in terms.values():
+        g = math.gcd(g, numer(coef) * (lcm // denom(coef)))
+    scale = make_rational(lcm, g)
+    if terms[_leading(terms)] < 0:
+        scale = rational_sub(0, scale)
+    if scale == 1:
+        return terms
+    return {exps: rational_mul(coef, scale) for exps, coef in terms.items()}
+
+#A k. változó szerinti tartalom (az együtthatók lnko-ja)
+def _content(terms, k):
+    res = {}
+    for coef in _coefficients(terms, k).values():
+        res = _gcd_terms(res, coef)
+        if len(res) == 1 and () in res:
+            break
+    return res
+
+#A k. változó szerinti primitív rész
+def _primitive(terms, k):
+    return _normalize_numeric(_divide_terms(terms, _content(terms, k)))
+
+#Pszeudo-maradék a k. változó szerint: lc(b)^(deg a - deg b + 1) * a maradéka b-vel osztva
+def _pseudo_remainder(a, b, k):
+    db = _degree(b, k)
+    lcb = _coefficients(b, k)[db]
+    r = a
+    while r:
+        dr = _degree(r, k)
+        if dr < db:
+            break
+        lcr = _coefficients(r, k)[dr]
+        shift = _strip((0,) * k + (dr - db,))
+        r = _add_terms(_mul_terms(lcb, r), _mul_terms(_mul_terms(lcr, {shift: -1}), b))
+    return r
+
+def _gcd_terms(a, b):
+    if not a:
+        return _normalize_numeric(b)
+    if not b:
+        return _normalize_numeric(a)
+    k = max(len(exps) for exps in itertools.chain(a, b)) - 1
+    if k < 0:
+        return {(): 1}
+    ca = _content(a, k)
+    cb = _content(b, k)
+    g = _gcd_terms(ca, cb)
+    a = _normalize_numeric(_divide_terms(a, ca))
+    b = _normalize_numeric(_divide_terms(b, cb))
+    if _degree(a, k) < _degree(b, k):
+        a, b = b, a
+    while b and _degree(b, k) > 0:
+        r = _pseudo_remainder(a, b, k)
+        a, b = b, (_primitive(r, k) if r else r)
+    h = a if not b else {(): 1}
+    return _normalize_numeric(_mul_terms(g, h))
+
+##############################################
+# Transzformációk
+##############################################
+
+#Kifejtés: a polinom részfákat kifejti és összevonja, pl. (x+y)^2 -> x^2+2*x*y+y^2
+#A nem polinom részfák (pl. sin(...)) paramétereit is kifejti. Használható a simplify/SimplifyMiniMax transzformációjaként.
+#Az eredmény összegei nem kanonikusak (lásd Polynomial.to_expr), a 0^0 részfák változatlanul maradnak.
+def expand(expr):
+    if type(expr) is not Function:
+        return expr
+    if expr.name in "+*-/^":
+        return from_expr(expr, expand_atoms=True).to_expr()
+    return simplify_expr(map_args(expr, expand))
+
+#Összevonás a megadott változók szerint: a többi változót tartalmazó részeket együtthatóként kiemeli,
+#pl. collect(x*y+x*z+y, [x]) -> x*(y+z)+y
+#Transzformációként pl. lambda expr: collect(expr, [Var('x', 'complex')])
+def collect(expr, variables):
+    poly = from_expr(expr, variables)
+    k = len(variables)
+    groups = {}
+    for exps, coef in poly.terms.items():
+        main = _strip(exps[:k])
+        rest = _strip((0,) * k + exps[k:])
+        groups.setdefault(main, {})[rest] = coef
+    summands = []
+    for main, terms in sorted(groups.items(), key=_graded_key):
+        monomial = Polynomial(poly.variables, {main: 1}).to_expr()
+        coef = Polynomial(poly.variables, terms).to_expr()
+        summands.append(simplify_expr(AC0('*', coef, monomial)))
+    if not summands:
+        return 0
+    if len(summands) == 1:
+        return summands[0]
+    return AC0('+', *summands)
+
+#Törtek egyszerűsítése: a '/' csomópontokban, valamint a negatív egész kitevős tényezőket tartalmazó szorzatokban
+#(a simplify_expr az a/b-t a*b^-1 alakra hozza) a számlálót és a nevezőt polinomként a legnagyobb közös osztójukkal
+#egyszerűsíti, pl. (x^2-y^2)/(x-y) -> x+y. A nevező egész, relatív prím együtthatójú, pozitív vezető együtthatójú lesz.
+#Ha nincs mivel egyszerűsíteni, a csomópontot nem bántja. Használható a simplify/SimplifyMiniMax transzformációjaként.
+def cancel(expr):
+    if type(expr) is not Function:
+        return expr
+    expr = map_args(expr, cancel)
+    if expr.name == '/' and len(expr.args) == 2:
+        res = _cancel_quotient(expr.args[0], expr.args[1])
+        if res is None:
+            return expr
+        num, den = res
+        if den == 1:
+            return num
+        return expr.with_args([num, den])
+    if expr.name == '*':
+        num_factors = []
+        den_factors = []
+        for arg in expr.args:
+            if type(arg) is Function and arg.name == '^' and isinstance(arg.args[1], numbers.Integral) and arg.args[1] < 0 and not _is_rational(arg.args[0]):
+                den_factors.append(arg.args[0] if arg.args[1] == -1 else F('^', arg.args[0], -arg.args[1]))
+            else:
+                num_factors.append(arg)
+        if not den_factors:
+            return expr
+        res = _cancel_quotient(_product(num_factors), _product(den_factors))
+        if res is None:
+            return expr
+        num, den = res
+        if den == 1:
+            return num
+        return simplify_expr(Function('*', num, Function('^', den, -1), commutative = expr.commutative, associative = expr.assoc))
+    return expr
+
+def _product(factors):
+    if not factors:
+        return 1
+    if len(factors) == 1:
+        return factors[0]
+    return AC0('*', *factors)
+
+#A számláló és a nevező egyszerűsítése, None ha nincs mit egyszerűsíteni (vagy a nevező nulla)
+def _cancel_quotient(num, den):
+    p, q = unify(from_expr(num), from_expr(den))
+    if q.is_zero():
+        return None
+    g = _gcd_terms(p.terms, q.terms)
+    if len(g) == 1 and () in g:
+        p_terms, q_terms = p.terms, q.terms
+    else:
+        p_terms, q_terms = _divide_terms(p.terms, g), _divide_terms(q.terms, g)
+    normalized = _normalize_numeric(q_terms)
+    if q_terms is q.terms and normalized is q_terms:
+        return None
+    lead = _leading(q_terms)
+    scale = rational_div(normalized[lead], q_terms[lead])
+    if scale != 1:
+        p_terms = {exps: rational_mul(coef, scale) for exps, coef in p_terms.items()}
+    return Polynomial(p.variables, p_terms).to_expr(), Polynomial(p.variables, normalized).to_expr()
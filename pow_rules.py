@@ -14,6 +14,8 @@ add_rule(pow_rules,
 	Var('x', 'complex'),
 	'pow', 'oneway')
 # x^0 = 1 ### x != 0
+# A complex_nonzero tag-et az illesztés ellenőrzi, de a szabály így sem alkalmazható: az add_rule a bal oldalt
+# az 1 konstansra egyszerűsítené, és a simplify_expr az x^0 alakot már a szabályok előtt 1-re hozza.
 add_rule(pow_rules,
 	F('^', Var('x', 'complex_nonzero'), 0),
 	1,
@@ -1,44 +1,145 @@
-import copy
+import collections
 import itertools
+import math
 import numbers
+import weakref
 
 ##############################################
 # Kifejezésfák
 ##############################################
 
+#Az "enumerate_ac_variants" szabályoknál legfeljebb ennyi bal oldali változat áll elő (None: nincs korlát)
+MAX_PATTERN_VARIANTS = 10000
+
 #Átírási szabály
 #source: a szabály bal oldala
 #target: a szabály jobb oldala
 #tags: tag-ek
+#max_variants: lásd MAX_PATTERN_VARIANTS
+#Illesztési módok (tag-ek):
+#   alapértelmezett: asszociatív-kommutatív illesztés (match_all) a flatten-elt bal oldalra.
+#       Ha a bal oldal gyökere asszociatív-kommutatív, akkor egy rejtett szekvencia-változó (REST) elnyeli
+#       a maradék paramétereket, pl. a sin(x)^2+cos(x)^2 minta egy 12 tagú összegben is illeszkedik.
+#   "enumerate_ac_variants": a régi módszer, a bal oldal változatait (generate_patterns) szintaktikusan illeszti.
+#       A változatok lustán, az első használatkor állnak elő, legfeljebb max_variants darab.
+#   "disable_ac_matching": csak a bal oldalt illeszti, szintaktikusan.
 class Rule:
-    def __init__(self, source, target, *tags):
+    def __init__(self, source, target, *tags, max_variants=None):
         self.source = source
-        #A bal oldal összes változatának előállítása és tárolása (kivéve ha le van tiltva egy speciális tag-el)
-        self.all_sources = [source] if "disable_ac_matching" in tags else generate_patterns(source)
         self.target = target
         self.tags = tags
+        self.ac_matching = "disable_ac_matching" not in tags and "enumerate_ac_variants" not in tags
+        #Az átíráskor használt jobb oldal (a rejtett REST változóval kiegészítve, ha kell)
+        self.rewrite_target = target
+        if "disable_ac_matching" in tags:
+            self.all_sources = [source]
+        elif "enumerate_ac_variants" in tags:
+            self.all_sources = generate_patterns(source, max_variants if max_variants is not None else MAX_PATTERN_VARIANTS)
+        else:
+            pattern = flatten(source)
+            if is_ac(pattern) and not any(type(arg) is SeqVar for arg in pattern.args):
+                self.rewrite_target = make_function(pattern.name, (target, REST), pattern.commutative, pattern.assoc)
+                pattern = make_function(pattern.name, pattern.args + (REST,), pattern.commutative, pattern.assoc, pattern.original_arg_count)
+            self.all_sources = [pattern]
     def __repr__(self):
         return str(self.source) + " -> " + str(self.target) + " (tags: {})".format(", ".join(self.tags))
 
+#Változók tag-jei
+#A tag egy típusból és egy opcionális megszorításból áll, pl. complex, complex_nonzero, real_positive, integer.
+#Egy mintában szereplő változó csak olyan részfára illeszkedik, amelyről a properties függvény belátja a tag-ekből
+#következő tulajdonságokat (pl. complex_nonzero: 'nonzero'). Egy kifejezésben szereplő változó tag-jei pedig
+#a változó ismert tulajdonságait adják meg. Az ismeretlen tag-ek nem jelentenek megszorítást.
+TAG_TYPE_PROPERTIES = {
+    'complex': (),
+    'real': ('real',),
+    'rational': ('rational', 'real'),
+    'integer': ('integer', 'rational', 'real'),
+}
+TAG_SUFFIX_PROPERTIES = {
+    'nonzero': ('nonzero',),
+    'positive': ('positive', 'nonzero', 'real'),
+}
+
+def tag_properties(tag):
+    if not isinstance(tag, str):
+        return ()
+    type_name, _, suffix = tag.partition('_')
+    if type_name not in TAG_TYPE_PROPERTIES or suffix and suffix not in TAG_SUFFIX_PROPERTIES:
+        return ()
+    return TAG_TYPE_PROPERTIES[type_name] + (TAG_SUFFIX_PROPERTIES[suffix] if suffix else ())
+
+def tags_properties(tags):
+    res = set()
+    for tag in tags:
+        res.update(tag_properties(tag))
+    return frozenset(res)
+
+#Az egyedi tábla (hash-consing): a strukturálisan azonos csomópontok ugyanazt az objektumot kapják.
+#Gyenge referenciákat tárol, így a már nem használt csomópontok felszabadulnak.
+#A kulcsban a gyerek csomópontokat az azonosítójuk (id) képviseli, ez biztonságos,
+#mert amíg a szülő él, addig a gyerekei is.
+_unique_table = weakref.WeakValueDictionary()
+
+def _node_key(arg):
+    if type(arg) in _NODE_TYPES:
+        return id(arg)
+    return (type(arg), arg)
+
+#Függvény csomópont létrehozása (vagy a már létező példány visszaadása) az egyedi táblából
+#original_arg_count: lásd a Function osztályt, alapértelmezetten a paraméterek száma
+def make_function(name, args, commutative=False, assoc=-1, original_arg_count=None):
+    args = tuple(args)
+    if original_arg_count is None:
+        original_arg_count = len(args)
+    key = (Function, name, tuple(map(_node_key, args)), commutative, assoc, original_arg_count)
+    node = _unique_table.get(key)
+    if node is None:
+        node = object.__new__(Function)
+        _init = object.__setattr__
+        _init(node, 'name', name)
+        _init(node, 'args', args)
+        _init(node, 'original_arg_count', original_arg_count)
+        _init(node, 'commutative', commutative)
+        _init(node, 'assoc', assoc)
+        _init(node, '_hash', hash((Function, name, args, commutative, assoc)))
+        _init(node, '_props', None)
+        _init(node, '_memo', None)
+        _init(node, '_canonical', None)
+        _unique_table[key] = node
+    return node
+
 #Egy függvényt reprezentál a kifejezésfában
 #name: név
+#A csomópontok nem módosíthatók (immutable) és internáltak, lásd make_function.
+#Módosítás helyett új csomópontot kell létrehozni, pl. a with_args metódussal.
 class Function:
-    def __init__(self, name, *args, **kwargs):
-         self.name = name
-         self.args = list(args)
-         #A paraméterlista eredeti hossza
-         #Ahhoz kell, hogy ha asszociatív függvényeket összevonunk (pl. +(1,+(2,3)) -> +(1,2,3))
-         #akkor később vissza tudjuk állítani az összevont alakból az eredetit.
-         self.original_arg_count = len(args)
-         self.commutative = False
-         self.assoc = -1
-         for k, v in kwargs.items():
-             if k == "commutative" and type(v) == bool:
-                self.commutative = v
-             elif k == "associative" and type(v) == int:
-                self.assoc = v
-             else:
+    __slots__ = ('name', 'args', 'original_arg_count', 'commutative', 'assoc', '_hash', '_props', '_memo', '_canonical', '__weakref__')
+
+    def __new__(cls, name, *args, **kwargs):
+        #A paraméterlista eredeti hossza (original_arg_count)
+        #Ahhoz kell, hogy ha asszociatív függvényeket összevonunk (pl. +(1,+(2,3)) -> +(1,2,3))
+        #akkor később vissza tudjuk állítani az összevont alakból az eredetit.
+        commutative = False
+        assoc = -1
+        for k, v in kwargs.items():
+            if k == "commutative" and type(v) == bool:
+                commutative = v
+            elif k == "associative" and type(v) == int:
+                assoc = v
+            else:
                 print("Invalid keyword argument: {} = {}".format(k, v))
+        return make_function(name, args, commutative, assoc)
+    #Ugyanilyen függvény (név, tulajdonságok, eredeti paraméterszám) más paraméterekkel
+    def with_args(self, args):
+        return make_function(self.name, args, self.commutative, self.assoc, self.original_arg_count)
+    def __setattr__(self, name, value):
+        raise AttributeError("Function objects are immutable")
+    def __reduce__(self):
+        return (make_function, (self.name, self.args, self.commutative, self.assoc, self.original_arg_count))
+    def __copy__(self):
+        return self
+    def __deepcopy__(self, memo):
+        return self
     #Kiírás (konvertálás string-é)
     def __repr__(self):
         if self.name in "+-*/%^":
@@ -48,49 +149,412 @@ class Function:
                 return "("+self.name.join(map(str, self.args))+")"
         return "{}({})".format(self.name, ", ".join(map(str, self.args)))
     #Egyenlőség
+    #Az internálás miatt az azonos fák ugyanazok az objektumok. Az egyenlőség ugyanazt nézi, mint az egyedi tábla kulcsa
+    #(a változók tag-jeit és az original_arg_count-ot is), a strukturális összehasonlításra csak a levelek miatt van
+    #szükség (pl. 1 == 1.0).
     def __eq__(self, other):
-        return type(other) is Function and self.name == other.name and self.args == other.args and self.commutative == other.commutative and self.assoc == other.assoc
+        if self is other:
+            return True
+        return type(other) is Function and self._hash == other._hash and self.name == other.name and self.args == other.args and self.commutative == other.commutative and self.assoc == other.assoc and self.original_arg_count == other.original_arg_count
+    def __hash__(self):
+        return self._hash
 
 #Egy szabályillesztésben használt változó a kifejezésfában
 #name: a változó neve
 #további argumentumok: tag-ek
 class Var:
-    def __init__(self, name, *args):
-        self.name = name
-        self.tags = set(args)
+    __slots__ = ('name', 'tags', '_hash', '_props', '_requires', '__weakref__')
+
+    def __new__(cls, name, *args):
+        tags = frozenset(args)
+        key = (Var, name, tags)
+        node = _unique_table.get(key)
+        if node is None:
+            node = object.__new__(Var)
+            object.__setattr__(node, 'name', name)
+            object.__setattr__(node, 'tags', tags)
+            object.__setattr__(node, '_hash', hash((Var, name)))
+            object.__setattr__(node, '_props', None)
+            object.__setattr__(node, '_requires', tags_properties(tags))
+            _unique_table[key] = node
+        return node
+    def __setattr__(self, name, value):
+        raise AttributeError("Var objects are immutable")
+    def __reduce__(self):
+        return (Var, (self.name,) + tuple(self.tags))
+    def __copy__(self):
+        return self
+    def __deepcopy__(self, memo):
+        return self
     def __repr__(self):
         return self.name
     def __eq__(self, other):
-        return type(other) is Var and self.name == other.name
+        return self is other or type(other) is Var and self.name == other.name and self.tags == other.tags
+    def __hash__(self):
+        return self._hash
+
+#Szekvencia-változó: asszociatív vagy kommutatív függvény paraméterlistájában tetszőleges számú (akár nulla) paraméterre illeszkedik.
+#Az értéke a paraméterek tuple-je, a jobb oldalon a függvény paraméterlistájába illesztődik be.
+#Pl. +(sin(x)^2, cos(x)^2, SeqVar('r')) -> +(1, SeqVar('r'))
+class SeqVar:
+    __slots__ = ('name', 'tags', '_hash', '_props', '_requires', '__weakref__')
+
+    def __new__(cls, name, *args):
+        tags = frozenset(args)
+        key = (SeqVar, name, tags)
+        node = _unique_table.get(key)
+        if node is None:
+            node = object.__new__(SeqVar)
+            object.__setattr__(node, 'name', name)
+            object.__setattr__(node, 'tags', tags)
+            object.__setattr__(node, '_hash', hash((SeqVar, name)))
+            object.__setattr__(node, '_props', None)
+            object.__setattr__(node, '_requires', tags_properties(tags))
+            _unique_table[key] = node
+        return node
+    def __setattr__(self, name, value):
+        raise AttributeError("SeqVar objects are immutable")
+    def __reduce__(self):
+        return (SeqVar, (self.name,) + tuple(self.tags))
+    def __copy__(self):
+        return self
+    def __deepcopy__(self, memo):
+        return self
+    def __repr__(self):
+        return self.name + "*"
+    def __eq__(self, other):
+        return self is other or type(other) is SeqVar and self.name == other.name and self.tags == other.tags
+    def __hash__(self):
+        return self._hash
+
+#A rejtett szekvencia-változó, ami az asszociatív-kommutatív gyökerű szabályoknál a maradék paramétereket kapja
+REST = SeqVar('_rest')
 
 #Egyedi illesztési szabály a kifejezésfában
 #Használható konstansok felbontására
 #Pl. a sin(4*a) nem illeszkedik a sin(2*x) szabályra, de a sin([[2k]]*x) szabályra igen
 #func: egy Python függvény neve, ami első paraméterként megkapja az illesztendő kifejezést, a további paraméterei pedig a változónevek amikhez
 #értéket kell rendelni, lásd alább a separate_2 függvényt
+#A többi csomóponthoz hasonlóan nem módosítható és internált (a függvény és a változónevek alapján).
 class External:
-    def __init__(self, func, *func_args):
-        self.func = func
-        self.func_args = func_args
+    __slots__ = ('func', 'func_args', '_hash', '__weakref__')
+
+    def __new__(cls, func, *func_args):
+        key = (External, func, func_args)
+        node = _unique_table.get(key)
+        if node is None:
+            node = object.__new__(External)
+            object.__setattr__(node, 'func', func)
+            object.__setattr__(node, 'func_args', func_args)
+            object.__setattr__(node, '_hash', hash(key))
+            _unique_table[key] = node
+        return node
+    def __setattr__(self, name, value):
+        raise AttributeError("External objects are immutable")
+    def __reduce__(self):
+        return (External, (self.func,) + self.func_args)
+    def __copy__(self):
+        return self
+    def __deepcopy__(self, memo):
+        return self
     def __repr__(self):
         return "[["+self.func.__name__+"({})]]".format(", ".join(self.func_args))
     def __eq__(self, other):
-        return type(other) is External and self.func == other.func and self.func_args == other.func_args
-
+        return self is other or type(other) is External and self.func == other.func and self.func_args == other.func_args
+    def __hash__(self):
+        return self._hash
+
+#Racionális szám a kifejezésfában (num/denom)
+#Létrehozáskor normalizálja: pozitív nevező, relatív prím számláló és nevező, és ha az érték egész, akkor int-et ad
+#(pl. Fraction(6, 4) is Fraction(3, 2), Fraction(6, 1) == 6 és int). A nulla nevezőjű törteket változatlanul tárolja.
+#Így az egyenlőség strukturális (a számláló és a nevező egyezik), és a törtet tartalmazó függvények is ugyanúgy
+#internálódnak, mint az egészeket tartalmazók (pl. F('f', Fraction(6, 2)) is F('f', 3)).
+#Az aritmetikai műveletek is normalizált eredményt adnak, lásd make_rational.
 class Fraction:
-    def __init__(self, num, denom):
-        if not isinstance(num, numbers.Integral) or not isinstance(denom, numbers.Integral):
-            self = None
-            return
+    __slots__ = ('num', 'denom', '_hash', '_props', '__weakref__')
 
-        self.num = num 
-        self.denom = denom
+    def __new__(cls, num, denom):
+        if not isinstance(num, numbers.Integral) or not isinstance(denom, numbers.Integral):
+            return object.__new__(Fraction)
+
+        if denom != 0:
+            num, denom = _normalize(num, denom)
+            if denom == 1:
+                return num
+        key = (Fraction, num, denom)
+        node = _unique_table.get(key)
+        if node is None:
+            node = object.__new__(Fraction)
+            object.__setattr__(node, 'num', num)
+            object.__setattr__(node, 'denom', denom)
+            object.__setattr__(node, '_hash', hash(key))
+            object.__setattr__(node, '_props', None)
+            _unique_table[key] = node
+        return node
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Fraction objects are immutable")
+
+    def __reduce__(self):
+        return (Fraction, (self.num, self.denom))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
 
     def __repr__(self):
         return "Fraction({}, {})".format(self.num, self.denom)
 
     def __eq__(self, other):
-        return type(other) is Fraction and self.num == other.num and self.denom == other.denom
+        return self is other or type(other) is Fraction and self.num == other.num and self.denom == other.denom
+
+    def __hash__(self):
+        return self._hash
+
+    def __lt__(self, other):
+        return _rational_compare(self, other, lambda a, b: a < b)
+
+    def __le__(self, other):
+        return _rational_compare(self, other, lambda a, b: a <= b)
+
+    def __gt__(self, other):
+        return _rational_compare(self, other, lambda a, b: a > b)
+
+    def __ge__(self, other):
+        return _rational_compare(self, other, lambda a, b: a >= b)
+
+    def __neg__(self):
+        return _rational_result(rational_sub(0, self))
+
+    def __add__(self, other):
+        return _rational_result(rational_add(self, other)) if _is_rational(other) else NotImplemented
+
+    def __radd__(self, other):
+        return _rational_result(rational_add(other, self)) if _is_rational(other) else NotImplemented
+
+    def __sub__(self, other):
+        return _rational_result(rational_sub(self, other)) if _is_rational(other) else NotImplemented
+
+    def __rsub__(self, other):
+        return _rational_result(rational_sub(other, self)) if _is_rational(other) else NotImplemented
+
+    def __mul__(self, other):
+        return _rational_result(rational_mul(self, other)) if _is_rational(other) else NotImplemented
+
+    def __rmul__(self, other):
+        return _rational_result(rational_mul(other, self)) if _is_rational(other) else NotImplemented
+
+    def __truediv__(self, other):
+        return _rational_result(rational_div(self, other)) if _is_rational(other) else NotImplemented
+
+    def __rtruediv__(self, other):
+        return _rational_result(rational_div(other, self)) if _is_rational(other) else NotImplemented
+
+    def __pow__(self, n):
+        return _rational_result(rational_pow(self, n)) if isinstance(n, numbers.Integral) else NotImplemented
+
+#Racionális aritmetika
+#A műveletek egészeken (int) és Fraction-ökön dolgoznak, az eredmény normalizált: int, ha az érték egész,
+#egyébként pozitív nevezőjű, relatív prím számlálójú és nevezőjű Fraction. Nulla nevező esetén None.
+def _is_rational(x):
+    return isinstance(x, numbers.Integral) or type(x) is Fraction
+
+#(számláló, nevező) normalizálása: pozitív nevező, relatív prímek (a nevező nem lehet nulla)
+def _normalize(num, denom):
+    if denom == 1:
+        return num, 1
+    g = math.gcd(num, denom)
+    if denom < 0:
+        g = -g
+    return num // g, denom // g
+
+#Normalizált racionális szám, None ha a nevező nulla
+def make_rational(num, denom):
+    if denom == 1:
+        return num
+    if denom == 0:
+        return None
+    num, denom = _normalize(num, denom)
+    if denom == 1:
+        return num
+    return Fraction(num, denom)
+
+def _rational_parts(x):
+    if type(x) is Fraction:
+        return x.num, x.denom
+    return x, 1
+
+def rational_add(v, w):
+    if type(v) is int and type(w) is int:
+        return v + w
+    a, b = _rational_parts(v)
+    c, d = _rational_parts(w)
+    if b == 0 or d == 0:
+        return None
+    return make_rational(a*d + c*b, b*d)
+
+def rational_sub(v, w):
+    if type(v) is int and type(w) is int:
+        return v - w
+    a, b = _rational_parts(v)
+    c, d = _rational_parts(w)
+    if b == 0 or d == 0:
+        return None
+    return make_rational(a*d - c*b, b*d)
+
+def rational_mul(v, w):
+    if type(v) is int and type(w) is int:
+        return v * w
+    a, b = _rational_parts(v)
+    c, d = _rational_parts(w)
+    if b == 0 or d == 0:
+        return None
+    return make_rational(a*c, b*d)
+
+def rational_div(v, w):
+    a, b = _rational_parts(v)
+    c, d = _rational_parts(w)
+    if b == 0 or d == 0 or c == 0:
+        return None
+    return make_rational(a*d, b*c)
+
+#Egész kitevős hatvány (a beépített pow négyzetre emeléses algoritmusával)
+#0 nempozitív kitevős hatványa None.
+def rational_pow(v, n):
+    a, b = _rational_parts(v)
+    if b == 0 or not isinstance(n, numbers.Integral):
+        return None
+    if a == 0:
+        return 0 if n >= 1 else None
+    a, b = _normalize(a, b)
+    if n < 0:
+        a, b, n = b, a, -n
+        if b < 0:
+            a, b = -a, -b
+    if b == 1 or n == 0:
+        return a ** n
+    return Fraction(a ** n, b ** n)
+
+#Az operátorok nulla nevező esetén kivételt dobnak
+def _rational_result(res):
+    if res is None:
+        raise ZeroDivisionError("Fraction with zero denominator")
+    return res
+
+def _rational_compare(v, w, op):
+    if not _is_rational(w):
+        return NotImplemented
+    a, b = _rational_parts(v)
+    c, d = _rational_parts(w)
+    if b == 0 or d == 0:
+        raise ZeroDivisionError("Fraction with zero denominator")
+    if b < 0:
+        a, b = -a, -b
+    if d < 0:
+        c, d = -c, -d
+    return op(a*d, c*b)
+
+_NODE_TYPES = (Function, Var, SeqVar, Fraction, External)
+
+##############################################
+# Tulajdonságok
+##############################################
+
+#Egy kifejezés bizonyíthatóan teljesülő tulajdonságai: 'integer', 'rational', 'real', 'nonzero', 'positive'
+#(frozenset). Csomópontonként egyszer számolja ki és eltárolja (a csomópontok nem módosíthatók, így ez mindig érvényes).
+def properties(expr):
+    t = type(expr)
+    if t is Function or t is Var or t is Fraction:
+        props = expr._props
+        if props is None:
+            props = _compute_properties(expr)
+            object.__setattr__(expr, '_props', props)
+        return props
+    if isinstance(expr, numbers.Integral):
+        return _INT_PROPERTIES[(expr > 0) - (expr < 0)]
+    return _NO_PROPERTIES
+
+_NO_PROPERTIES = frozenset()
+_INT_PROPERTIES = {
+    1: frozenset(('integer', 'rational', 'real', 'nonzero', 'positive')),
+    0: frozenset(('integer', 'rational', 'real')),
+    -1: frozenset(('integer', 'rational', 'real', 'nonzero')),
+}
+
+def _all_have(props_list, prop):
+    for props in props_list:
+        if prop not in props:
+            return False
+    return True
+
+def _compute_properties(expr):
+    t = type(expr)
+    if t is Var:
+        return expr._requires
+    if t is Fraction:
+        if expr.denom == 0:
+            return _NO_PROPERTIES
+        res = {'rational', 'real'}
+        if expr.num % expr.denom == 0:
+            res.add('integer')
+        if expr.num != 0:
+            res.add('nonzero')
+        if expr.num * expr.denom > 0:
+            res.add('positive')
+        return frozenset(res)
+    args = [properties(arg) for arg in expr.args]
+    res = set()
+    if expr.name in ('+', '-', '*') and args:
+        for prop in ('integer', 'rational', 'real'):
+            if _all_have(args, prop):
+                res.add(prop)
+        if expr.name == '*' and _all_have(args, 'nonzero'):
+            res.add('nonzero')
+        if expr.name in ('+', '*') and _all_have(args, 'positive'):
+            res.add('positive')
+    elif expr.name == '^' and len(args) == 2:
+        b, n = args
+        exponent = expr.args[1]
+        if isinstance(exponent, numbers.Integral):
+            if exponent >= 0 or 'nonzero' in b:
+                for prop in ('integer', 'rational', 'real'):
+                    if prop in b and (prop != 'integer' or exponent >= 0):
+                        res.add(prop)
+            if 'nonzero' in b:
+                res.add('nonzero')
+            if 'positive' in b or exponent % 2 == 0 and 'real' in b and 'nonzero' in b:
+                res.update(('positive', 'nonzero'))
+        elif 'positive' in b and 'real' in n:
+            res.update(('positive', 'nonzero', 'real'))
+    elif expr.name == '/' and len(args) == 2:
+        if 'nonzero' in args[1]:
+            for prop in ('rational', 'real', 'nonzero', 'positive'):
+                if prop in args[0] and prop in args[1]:
+                    res.add(prop)
+    elif expr.name == 'exp' and len(args) == 1:
+        res.add('nonzero')
+        if 'real' in args[0]:
+            res.update(('positive', 'real'))
+    elif expr.name in ('sin', 'cos') and len(args) == 1:
+        if 'real' in args[0]:
+            res.add('real')
+    if 'positive' in res:
+        res.update(('nonzero', 'real'))
+    return frozenset(res)
+
+#Illeszkedhet-e a változó (vagy szekvencia-változó) az adott értékre a tag-jei alapján
+def var_accepts(var, value):
+    required = var._requires
+    if not required:
+        return True
+    if type(var) is SeqVar:
+        for v in value:
+            if not required <= properties(v):
+                return False
+        return True
+    return required <= properties(value)
 
 #Megpróbál 2-t leválasztani egy konstansból.
 #Ha nincs illeszkedés, None-t kell visszaadni, egyébként egy dict-et a változónevekkel és hozzájuk tartozó értékekkel
@@ -116,6 +580,7 @@ A3 = lambda name, *args: Function(name, *args, associative=3)
 A4 = lambda name, *args: Function(name, *args, associative=4)
 A5 = lambda name, *args: Function(name, *args, associative=5)
 E = lambda func, *args: External(func, *args)
+S = lambda name, *tags: SeqVar(name, *tags)
 
 ##############################################
 # Mintaillesztés és átírás
@@ -137,63 +602,124 @@ def flatten(tree):
                     new_args.append(flatten(arg))
             else:
                 new_args.append(flatten(arg))
-        tree.args = new_args
+        return tree.with_args(new_args)
     return tree
 
 #A flatten fordítottja, a "legbaloldalibb" fát állítja elő
 #Pl. +(1,2,3,4) -> +(+(+(1,2),3),4)
 def unflatten(param_list, orig_function):
-    if len(param_list) == orig_function.original_arg_count:
+    n = orig_function.original_arg_count
+    if len(param_list) == n:
         return param_list
-    new_list = copy.deepcopy(param_list)
-    func = copy.deepcopy(orig_function)
-    func.args = copy.deepcopy(new_list[:orig_function.original_arg_count])
-    new_list[:orig_function.original_arg_count] = [func]
-    return unflatten(new_list, orig_function)
+    func = orig_function.with_args(param_list[:n])
+    return unflatten([func] + list(param_list[n:]), orig_function)
 
-#Mint az unflatten, de az összes lehetséges fát előállítja
+#Mint az unflatten, de az összes lehetséges fát előállítja (generátor)
 def generate_assoc_trees(param_list, orig_function):
-    if len(param_list) == orig_function.original_arg_count:
-        return [param_list]
-    res = []
-    for k in range(len(param_list)-orig_function.original_arg_count+1):
-        new_list = copy.deepcopy(param_list)
-        func = copy.deepcopy(orig_function)
-        func.args = copy.deepcopy(new_list[k:k+orig_function.original_arg_count])
-        new_list[k:k+orig_function.original_arg_count] = [func]
-        res = res + generate_assoc_trees(new_list, orig_function)
-    return res
-
-#Egy mintához az összes lehetséges bal oldal előállítása (a kommutatív és asszociatív tulajdonságok alapján)
+    n = orig_function.original_arg_count
+    if len(param_list) == n:
+        yield param_list
+        return
+    for k in range(len(param_list)-n+1):
+        func = orig_function.with_args(param_list[k:k+n])
+        new_list = list(param_list[:k]) + [func] + list(param_list[k+n:])
+        yield from generate_assoc_trees(new_list, orig_function)
+
+#Lustán előállított, memoizált sorozat (a minta-változatokhoz)
+#Az elemeket csak akkor állítja elő, amikor valaki eljut hozzájuk, az egyszer előállított elemeket megjegyzi.
+#limit: legfeljebb ennyi elemet állít elő (None: nincs korlát)
+#pattern: a minta, amelynek a változatait adja (lásd generate_patterns). Ha meg van adva, akkor a sorozat pickle-ölhető:
+#   a mintából és a korlátból áll elő újra (pl. a SimplifyMiniMax párhuzamos módjában a szabályokkal együtt).
+class LazyVariants:
+    def __init__(self, iterable, limit=None, pattern=None):
+        self._items = []
+        self._source = iter(iterable) if limit is None else itertools.islice(iterable, limit)
+        self._limit = limit
+        self._pattern = pattern
+    def __reduce__(self):
+        if self._pattern is None:
+            raise TypeError("LazyVariants without a pattern can not be pickled")
+        return (generate_patterns, (self._pattern, self._limit))
+    def _next(self):
+        try:
+            self._items.append(next(self._source))
+            return True
+        except StopIteration:
+            self._source = None
+            return False
+    def __iter__(self):
+        k = 0
+        while k < len(self._items) or (self._source is not None and self._next()):
+            yield self._items[k]
+            k += 1
+    def __len__(self):
+        while self._source is not None and self._next():
+            pass
+        return len(self._items)
+    def __getitem__(self, k):
+        while k >= len(self._items) and self._source is not None and self._next():
+            pass
+        return self._items[k]
+    def __repr__(self):
+        return "LazyVariants({} generated{})".format(len(self._items), "" if self._source is None else ", more pending")
+
+#Egy függvény csomóponthoz tartozó származtatott adat (pl. a minta változatai, a lefordított illesztő), a csomóponton tárolva
+#A csomópontok nem módosíthatók, így az adat mindig érvényes, és a csomóponttal együtt szabadul fel (nincs globális,
+#azonosító alapú tábla, ami a már nem használt mintákat is életben tartaná). A levelekre nem tárol, ezekre a számítás olcsó.
+#Ha az eredmény maga a csomópont, akkor helyette a _SAME jelzőt tárolja (így nem keletkezik körkörös hivatkozás).
+def node_memo(node, key, compute):
+    if type(node) is not Function:
+        return compute(node)
+    memo = node._memo
+    if memo is None:
+        memo = {}
+        object.__setattr__(node, '_memo', memo)
+    res = memo.get(key, _MISSING)
+    if res is _MISSING:
+        res = compute(node)
+        memo[key] = _SAME if res is node else res
+        return res
+    return node if res is _SAME else res
+
+_MISSING = object()
+_SAME = object()
+
+#A (rész)minták változatai, mintánként egyszer előállítva és megjegyezve (lásd node_memo).
+#Az internálás miatt a szabályokban szereplő azonos részminták ugyanazok az objektumok, így a változataik közösek.
+def pattern_variants(pattern):
+    return node_memo(pattern, 'variants', lambda p: LazyVariants(iter_patterns(p)))
+
+#A paraméterek változatainak összes kombinációja (az első paraméter változik a leggyorsabban)
+def _arg_combinations(variant_lists, k):
+    if k == 0:
+        yield []
+        return
+    for v in variant_lists[k-1]:
+        for prefix in _arg_combinations(variant_lists, k-1):
+            yield prefix + [v]
+
+#Egy mintához az összes lehetséges bal oldal előállítása (a kommutatív és asszociatív tulajdonságok alapján), lustán
 #Pl. +(x,y) mintához +(y,x) is, +(1,+(x,y)) mintához +(+(1,x),y), +(+(x,1),y), +(1,+(y,x)), +(x,+(1,y)) stb.
-def generate_patterns_internal(pattern):
+def iter_patterns(pattern):
     if type(pattern) is Function:
-        patterns = [pattern]
-        for k in range(len(pattern.args)):
-            new_patterns = []
-            for new_arg_k in generate_patterns_internal(pattern.args[k]):
-                for old_pattern in patterns:
-                    p = copy.deepcopy(old_pattern)
-                    p.args[k] = new_arg_k
-                    new_patterns.append(p)
-            patterns = new_patterns
-        res = []
-        for p in patterns:
+        variant_lists = [pattern_variants(arg) for arg in pattern.args]
+        for args in _arg_combinations(variant_lists, len(variant_lists)):
+            p = pattern.with_args(args)
             for perm in (itertools.permutations(p.args) if p.commutative else [p.args]):
                 if p.assoc >= -1 and len(p.args) > p.original_arg_count:
-                    assoc_trees = generate_assoc_trees(list(perm), p)
-                    for tree in assoc_trees:
-                        res.append(copy.deepcopy(p))
-                        res[-1].args = tree
+                    for tree in generate_assoc_trees(list(perm), p):
+                        yield p.with_args(tree)
                 else:
-                    res.append(copy.deepcopy(p))
-                    res[-1].args = list(perm)
-        return res
+                    yield p.with_args(perm)
     else:
-        return [pattern]
+        yield pattern
+
+def generate_patterns_internal(pattern):
+    return list(pattern_variants(pattern))
 
-def generate_patterns(pattern):
-    return generate_patterns_internal(flatten(pattern))
+#A minta változatai lustán, legfeljebb limit darab
+def generate_patterns(pattern, limit=None):
+    return LazyVariants(pattern_variants(flatten(pattern)), limit, pattern)
 
 #Ellenőrzi, hogy két dict-el megadott változó -> érték hozzárendelés kompatibilis-e (ha mindkettőben szerepel egy változó, akkor ugyanaz-e az érték?)
 def is_compatible_match(m1, m2):
@@ -203,53 +729,730 @@ def is_compatible_match(m1, m2):
             if m1[key] != m2[key]: return False
     return True
 
-#Mintaillesztés rekurzívan
-def match(tree, pattern):
-    if type(pattern) is External:
-        res = pattern.func(tree, *pattern.func_args)
-        if res != None:
-            return res
-    if type(pattern) is Var:
-        return {pattern.name: tree}
-    if type(pattern) is Function and type(tree) is Function and pattern.name == tree.name:
-        current_match = {}
-        if len(pattern.args) != len(tree.args):
+def is_ac(tree):
+    return type(tree) is Function and tree.commutative and tree.assoc != -1
+
+#Az azonos asszociatív függvények paramétereinek összegyűjtése (mint a flatten, de nem módosítja a paramétereket)
+#Pl. +(1,+(2,+(3,4))) -> [1,2,3,4]
+def ac_args(tree):
+    if tree.assoc == -1:
+        return tree.args
+    res = []
+    for arg in tree.args:
+        if type(arg) is Function and arg.name == tree.name and arg.assoc == tree.assoc:
+            res.extend(ac_args(arg))
+        else:
+            res.append(arg)
+    return res
+
+#Egy változó értéke, ha egy asszociatív függvény több paraméterére illeszkedik: ugyanilyen függvény ezekkel a paraméterekkel
+def ac_value(tree, elems):
+    if len(elems) == 1:
+        return elems[0]
+    return make_function(tree.name, elems, tree.commutative, tree.assoc, min(len(elems), tree.original_arg_count))
+
+def _bind(bindings, name, value):
+    res = dict(bindings)
+    res[name] = value
+    return res
+
+#Kiveszi az elems listából a values elemeit (multihalmazként), ha nincs meg mind, akkor None
+def _remove_all(elems, values):
+    rest = list(elems)
+    for v in values:
+        for k in range(len(rest)):
+            if rest[k] == v:
+                del rest[k]
+                break
+        else:
             return None
+    return rest
+
+#Mintaillesztés rekurzívan, az összes illeszkedést előállítja (generátor)
+#bindings: az eddigi változó -> érték hozzárendelések, az eredmények ennek a bővítései
+#ac: ha True, akkor az asszociatív/kommutatív mintákat asszociatív-kommutatív illesztéssel illeszti (lásd _match_args),
+#    egyébként szintaktikusan (a paraméterek sorban, azonos darabszámmal)
+def match_all(tree, pattern, bindings, ac=True):
+    t = type(pattern)
+    if t is Var:
+        if pattern.name in bindings:
+            if bindings[pattern.name] == tree:
+                yield bindings
+        elif var_accepts(pattern, tree):
+            yield _bind(bindings, pattern.name, tree)
+    elif t is Function:
+        if type(tree) is Function and pattern.name == tree.name:
+            if ac and (pattern.commutative or pattern.assoc != -1):
+                yield from _match_args(tree, pattern, bindings)
+            elif len(pattern.args) == len(tree.args):
+                yield from _match_seq(tree.args, 0, pattern.args, 0, bindings, None, ac)
+    elif t is External:
+        res = pattern.func(tree, *pattern.func_args)
+        if res != None and is_compatible_match(res, bindings):
+            yield dict(bindings, **res)
+    elif pattern == tree:
+        yield bindings
+
+#Asszociatív és/vagy kommutatív függvény paramétereinek illesztése.
+#Ha a minta és a fa is asszociatív, akkor mindkettőnek az ac_args szerinti paraméterlistáját illeszti, és egy változó
+#több paraméterre is illeszkedhet (pl. sin(x+y) illeszkedik a sin(a+b+c)-re: x = a, y = b+c).
+#Kommutatív esetben a paraméterek sorrendje tetszőleges, egyébként sorban illeszt.
+def _match_args(tree, pattern, bindings):
+    assoc = pattern.assoc != -1 and tree.assoc != -1
+    elems = ac_args(tree) if assoc else tree.args
+    pats = ac_args(pattern) if pattern.assoc != -1 else pattern.args
+    group = tree if assoc else None
+    has_seq = any(type(p) is SeqVar for p in pats)
+    if not has_seq and (len(pats) > len(elems) or not assoc and len(pats) != len(elems)):
+        return
+    if not pattern.commutative:
+        yield from _match_seq(elems, 0, pats, 0, bindings, group, True)
+        return
+    fixed = [p for p in pats if type(p) is not Var and type(p) is not SeqVar]
+    variables = [p for p in pats if type(p) is Var]
+    seqs = [p for p in pats if type(p) is SeqVar]
+    for rest, b in _match_fixed(list(elems), fixed, 0, bindings):
+        for rest2, b2 in _match_vars(rest, variables, 0, b, group, bool(seqs)):
+            yield from _match_seqvars(rest2, seqs, 0, b2)
+
+#A nem változó mintaelemek (függvények, konstansok, External) mindegyike pontosan egy paraméterre illeszkedik
+def _match_fixed(elems, fixed, k, bindings):
+    if k == len(fixed):
+        yield elems, bindings
+        return
+    pattern = fixed[k]
+    #Ha a részmintának legfeljebb egy illeszkedése lehet, akkor a lefordított illesztőt használjuk
+    matcher = compiled_matcher(pattern) if type(pattern) is Function else None
+    for i in range(len(elems)):
+        if matcher is not None and matcher.unique:
+            res = matcher(elems[i])
+            if res is None or not is_compatible_match(res, bindings):
+                continue
+            yield from _match_fixed(elems[:i] + elems[i+1:], fixed, k+1, dict(bindings, **res))
+        else:
+            for b in match_all(elems[i], pattern, bindings):
+                yield from _match_fixed(elems[:i] + elems[i+1:], fixed, k+1, b)
+
+#A változók illesztése a maradék paraméterekre.
+#Asszociatív esetben (group nem None) egy változó a paraméterek egy nemüres részhalmazára illeszkedik,
+#egyébként pontosan egy paraméterre. Ha nincs szekvencia-változó, akkor az utolsó változó megkapja az összes maradékot.
+def _match_vars(elems, variables, k, bindings, group, has_seq):
+    if k == len(variables):
+        if has_seq or not elems:
+            yield elems, bindings
+        return
+    var = variables[k]
+    if var.name in bindings:
+        value = bindings[var.name]
+        if group is not None and type(value) is Function and value.name == group.name and value.assoc == group.assoc:
+            rest = _remove_all(elems, ac_args(value))
         else:
-            for k in range(len(pattern.args)):
-                match_res = match(tree.args[k], pattern.args[k])
-                if is_compatible_match(match_res, current_match):
-                    current_match = dict(current_match, **match_res)
+            rest = _remove_all(elems, [value])
+        if rest is not None:
+            yield from _match_vars(rest, variables, k+1, bindings, group, has_seq)
+        return
+    if group is None:
+        sizes = [1]
+    elif k == len(variables)-1 and not has_seq:
+        #Az utolsó változó az összes maradékot kapja; ha nincs maradék (pl. egy már kötött változó elvitte), nem illeszkedik
+        if not elems:
+            return
+        sizes = [len(elems)]
+    else:
+        sizes = range(1, len(elems)+1)
+    for size in sizes:
+        for chosen in itertools.combinations(range(len(elems)), size):
+            value = ac_value(group, [elems[i] for i in chosen]) if group is not None else elems[chosen[0]]
+            if not var_accepts(var, value):
+                continue
+            rest = [elems[i] for i in range(len(elems)) if i not in chosen]
+            yield from _match_vars(rest, variables, k+1, _bind(bindings, var.name, value), group, has_seq)
+
+#A szekvencia-változók illesztése: az utolsó megkapja az összes maradék paramétert
+def _match_seqvars(elems, seqs, k, bindings):
+    if k == len(seqs):
+        if not elems:
+            yield bindings
+        return
+    seq = seqs[k]
+    if seq.name in bindings:
+        rest = _remove_all(elems, bindings[seq.name])
+        if rest is not None:
+            yield from _match_seqvars(rest, seqs, k+1, bindings)
+        return
+    sizes = [len(elems)] if k == len(seqs)-1 else range(len(elems)+1)
+    for size in sizes:
+        for chosen in itertools.combinations(range(len(elems)), size):
+            value = tuple(elems[i] for i in chosen)
+            if not var_accepts(seq, value):
+                continue
+            rest = [elems[i] for i in range(len(elems)) if i not in chosen]
+            yield from _match_seqvars(rest, seqs, k+1, _bind(bindings, seq.name, value))
+
+#Paraméterlisták illesztése sorban (nem kommutatív eset)
+#Ha group nem None (asszociatív függvény), akkor egy változó egymás utáni paraméterek nemüres sorozatára is illeszkedhet.
+#Szekvencia-változó egymás utáni paraméterek tetszőleges (akár üres) sorozatára illeszkedik.
+def _match_seq(elems, i, pats, j, bindings, group, ac):
+    if j == len(pats):
+        if i == len(elems):
+            yield bindings
+        return
+    p = pats[j]
+    if type(p) is SeqVar:
+        if p.name in bindings:
+            value = bindings[p.name]
+            if tuple(elems[i:i+len(value)]) == value:
+                yield from _match_seq(elems, i+len(value), pats, j+1, bindings, group, ac)
+        else:
+            for end in range(i, len(elems)+1):
+                value = tuple(elems[i:end])
+                if var_accepts(p, value):
+                    yield from _match_seq(elems, end, pats, j+1, _bind(bindings, p.name, value), group, ac)
+    elif type(p) is Var and group is not None and p.name not in bindings:
+        for end in range(i+1, len(elems)+1):
+            value = ac_value(group, elems[i:end])
+            if not var_accepts(p, value):
+                continue
+            yield from _match_seq(elems, end, pats, j+1, _bind(bindings, p.name, value), group, ac)
+    elif type(p) is Var and group is not None and type(bindings[p.name]) is Function and bindings[p.name].name == group.name:
+        value = ac_args(bindings[p.name])
+        if list(elems[i:i+len(value)]) == list(value):
+            yield from _match_seq(elems, i+len(value), pats, j+1, bindings, group, ac)
+    elif i < len(elems):
+        for b in match_all(elems[i], p, bindings, ac):
+            yield from _match_seq(elems, i+1, pats, j+1, b, group, ac)
+
+#Mintaillesztés: az első illeszkedés változó -> érték hozzárendelése (dict), vagy None ha nem illeszkedik
+def match(tree, pattern, ac=True):
+    return next(match_all(tree, pattern, {}, ac), None)
+
+#Mintaillesztő függvény generálása egy mintához.
+#A match-hez hasonlóan működik (az első illeszkedés dict-jét vagy None-t adja vissza), de a minta szerkezete bele van
+#"égetve" a generált Python kódba: a függvénynevek és paraméterszámok ellenőrzése közvetlen összehasonlítás,
+#a változók értékei lokális változókban vannak, dict csak a végén készül.
+#Az asszociatív/kommutatív részmintákat (és a szekvencia-változós paraméterlistákat) a match_all illeszti,
+#ezek a generált kódban ciklusként jelennek meg, a további feltételek sikertelensége esetén a következő illeszkedéssel folytatja.
+#External: az eredményéből a func_args-ban megadott változók kerülnek át.
+#A CPython legfeljebb 20 egymásba ágyazott blokkot enged: ha egy kommutatív részminta ciklusai túllépnék a
+#_MAX_LOOP_DEPTH mélységet, akkor azt a részmintát is a match_all illeszti (egyetlen ciklus).
+_MAX_LOOP_DEPTH = 16
+
+class _PatternCompiler:
+    def __init__(self, ac):
+        self.ac = ac
+        self.lines = []
+        self.consts = []
+        self.bound = {}
+        self.counter = 0
+        self.depth = 1
+        self.in_loop = False
+        #Igaz, ha nincs match_all-ra bízott részminta, ekkor legfeljebb egy illeszkedés van
+        self.unique = True
+
+    def fail(self):
+        return 'continue' if self.in_loop else 'return None'
+
+    def emit(self, line):
+        self.lines.append('    ' * self.depth + line)
+
+    def const(self, value):
+        self.consts.append(value)
+        return 'K[{}]'.format(len(self.consts)-1)
+
+    def local(self, prefix):
+        self.counter += 1
+        return '{}{}'.format(prefix, self.counter)
+
+    def bindings(self):
+        return '{' + ', '.join('{!r}: {}'.format(name, loc) for name, loc in self.bound.items()) + '}'
+
+    #A változó tag-jeiből következő feltétel ellenőrzése, mielőtt a további részmintákat illesztené
+    def guard(self, var, expr):
+        if var._requires:
+            self.emit('if not var_accepts({}, {}): {}'.format(self.const(var), expr, self.fail()))
+
+    def bind(self, name, expr):
+        loc = self.local('v')
+        self.emit('{} = {}'.format(loc, expr))
+        self.bound[name] = loc
+
+    def compile(self, pattern, expr):
+        t = type(pattern)
+        if t is Var:
+            if pattern.name in self.bound:
+                self.emit('if {} != {}: {}'.format(expr, self.bound[pattern.name], self.fail()))
+            else:
+                self.guard(pattern, expr)
+                self.bind(pattern.name, expr)
+        elif t is Function:
+            if self.ac and pattern.commutative:
+                self.compile_commutative(pattern, expr)
+                return
+            if self.ac and pattern.assoc != -1 or any(type(arg) is SeqVar for arg in pattern.args):
+                self.emit('if type({0}) is not Function or {0}.name != {1!r}: {2}'.format(expr, pattern.name, self.fail()))
+                self.delegate(pattern, expr)
+                return
+            self.emit('if type({0}) is not Function or {0}.name != {1!r} or len({0}.args) != {2}: {3}'.format(expr, pattern.name, len(pattern.args), self.fail()))
+            if pattern.args:
+                args = self.local('a')
+                self.emit('{} = {}.args'.format(args, expr))
+                for k in range(len(pattern.args)):
+                    arg = '{}[{}]'.format(args, k)
+                    if type(pattern.args[k]) is Function:
+                        node = self.local('n')
+                        self.emit('{} = {}'.format(node, arg))
+                        arg = node
+                    self.compile(pattern.args[k], arg)
+        elif t is External:
+            p = self.const(pattern)
+            res = self.local('r')
+            self.emit('{} = {}.func({}, *{}.func_args)'.format(res, p, expr, p))
+            self.emit('if {} is None: {}'.format(res, self.fail()))
+            for name in pattern.func_args:
+                if name in self.bound:
+                    self.emit('if {0}.get({1!r}, {2}) != {2}: {3}'.format(res, name, self.bound[name], self.fail()))
                 else:
-                    return None
-            return current_match
-    if pattern != tree:
-        return None
-    return {}
+                    self.bind(name, '{}.get({!r})'.format(res, name))
+        elif t is SeqVar:
+            self.delegate(pattern, expr)
+        else:
+            self.emit('if {} != {}: {}'.format(expr, self.const(pattern), self.fail()))
+
+    #Kommutatív (és esetleg asszociatív) függvény illesztése, mint a _match_args:
+    #a nem változó részminták egymásba ágyazott ciklusokban választanak paramétert, a maradékot a változók
+    #(_match_vars) és a szekvencia-változók (_match_seqvars) kapják. Egyetlen szekvencia-változót közvetlenül köt.
+    def compile_commutative(self, pattern, expr):
+        pats = ac_args(pattern) if pattern.assoc != -1 else pattern.args
+        fixed = [p for p in pats if type(p) is not Var and type(p) is not SeqVar]
+        if self.depth + len(fixed) + 2 > _MAX_LOOP_DEPTH:
+            self.delegate(pattern, expr)
+            return
+        self.unique = False
+        self.emit('if type({0}) is not Function or {0}.name != {1!r}: {2}'.format(expr, pattern.name, self.fail()))
+        variables = [p for p in pats if type(p) is Var]
+        seqs = [p for p in pats if type(p) is SeqVar]
+        elems = self.local('e')
+        group = self.local('g')
+        if pattern.assoc != -1:
+            self.emit('if {0}.assoc != -1: {1}, {2} = ac_args({0}), {0}'.format(expr, elems, group))
+            self.emit('else: {1}, {2} = {0}.args, None'.format(expr, elems, group))
+        else:
+            self.emit('{1}, {2} = {0}.args, None'.format(expr, elems, group))
+        if not seqs:
+            self.emit('if len({0}) < {1} or {2} is None and len({0}) != {1}: {3}'.format(elems, len(pats), group, self.fail()))
+        indices = []
+        for p in fixed:
+            i = self.local('i')
+            self.emit('for {} in range(len({})):'.format(i, elems))
+            self.depth += 1
+            self.in_loop = True
+            if indices:
+                self.emit('if {} in ({},): continue'.format(i, ', '.join(indices)))
+            node = self.local('n')
+            self.emit('{} = {}[{}]'.format(node, elems, i))
+            self.compile(p, node)
+            indices.append(i)
+        rest = self.local('rest')
+        if indices:
+            self.emit('{0} = [{1}[k] for k in range(len({1})) if k not in ({2},)]'.format(rest, elems, ', '.join(indices)))
+        else:
+            self.emit('{} = list({})'.format(rest, elems))
+        if not variables and not seqs:
+            self.emit('if {}: {}'.format(rest, self.fail()))
+        elif not variables and len(seqs) == 1 and seqs[0].name not in self.bound:
+            self.guard(seqs[0], rest)
+            self.bind(seqs[0].name, 'tuple({})'.format(rest))
+        else:
+            res = self.local('b')
+            rest2 = self.local('rest')
+            self.emit('for {}, {} in _match_vars({}, {}, 0, {}, {}, {}):'.format(rest2, res, rest, self.const(variables), self.bindings(), group, bool(seqs)))
+            self.depth += 1
+            self.in_loop = True
+            res2 = self.local('b')
+            self.emit('for {} in _match_seqvars({}, {}, 0, {}):'.format(res2, rest2, self.const(seqs), res))
+            self.depth += 1
+            for p in variables + seqs:
+                if p.name not in self.bound:
+                    self.bind(p.name, '{}[{!r}]'.format(res2, p.name))
+
+    def delegate(self, pattern, expr):
+        self.unique = False
+        res = self.local('b')
+        self.emit('for {} in match_all({}, {}, {}, {}):'.format(res, expr, self.const(pattern), self.bindings(), self.ac))
+        self.depth += 1
+        self.in_loop = True
+        for name in pattern_var_names(pattern):
+            if name not in self.bound:
+                self.bind(name, '{}.get({!r})'.format(res, name))
+
+    def finish(self):
+        self.emit('return ' + self.bindings())
+        if self.in_loop:
+            self.lines.append('    return None')
+        return 'def _match(t):\n' + '\n'.join(self.lines) + '\n'
+
+#A mintában szereplő változónevek (a megjelenésük sorrendjében)
+def pattern_var_names(pattern, res=None):
+    if res is None:
+        res = []
+    if type(pattern) in (Var, SeqVar):
+        if pattern.name not in res:
+            res.append(pattern.name)
+    elif type(pattern) is External:
+        for name in pattern.func_args:
+            if name not in res:
+                res.append(name)
+    elif type(pattern) is Function:
+        for arg in pattern.args:
+            pattern_var_names(arg, res)
+    return res
+
+#Ha a generált kód nem fordítható (pl. túl sok egymásba ágyazott blokk a delegált részminták miatt, vagy túl mély minta),
+#akkor a match-et hívó illesztőt adja vissza (source: None).
+def compile_pattern(pattern, ac=True):
+    compiler = _PatternCompiler(ac)
+    try:
+        compiler.compile(pattern, 't')
+        code = compiler.finish()
+        namespace = {'Function': Function, 'match_all': match_all, 'var_accepts': var_accepts, 'ac_args': ac_args, '_match_vars': _match_vars, '_match_seqvars': _match_seqvars, 'K': compiler.consts}
+        exec(code, namespace)
+    except (SyntaxError, RecursionError):
+        return _interpreted_matcher(pattern, ac)
+    func = namespace['_match']
+    func.source = code
+    func.unique = compiler.unique
+    return func
+
+def _interpreted_matcher(pattern, ac):
+    def _match(t):
+        return match(t, pattern, ac)
+    _match.source = None
+    _match.unique = False
+    return _match
+
+#A lefordított mintaillesztő, mintánként és illesztési módonként a mintán tárolva (lásd node_memo)
+#Az internálás miatt a szabályok közös részmintái is közösek.
+def compiled_matcher(pattern, ac=True):
+    return node_memo(pattern, ('matcher', ac), lambda p: compile_pattern(p, ac))
+
+#Igaz, ha az illesztés tényleg hozzárendelt valamit egy változóhoz (a rejtett REST változót nem számítva).
+#Változó nélküli szabályokat nem alkalmazunk.
+def is_nontrivial_match(match_res):
+    if match_res == None:
+        return False
+    for key in match_res:
+        if key != REST.name:
+            return True
+    return False
+
+#A func függvényt alkalmazza a fa paramétereire.
+#Ha egyik paraméter sem változik, akkor az eredeti fát adja vissza (új lista vagy csomópont létrehozása nélkül),
+#egyébként csak ezt az egy csomópontot építi újra, a változatlan részfák közösek maradnak.
+def map_args(tree, func):
+    new_args = None
+    args = tree.args
+    for k in range(len(args)):
+        arg = args[k]
+        new_arg = func(arg)
+        if new_arg is not arg:
+            if new_args is None:
+                new_args = list(args)
+            new_args[k] = new_arg
+    if new_args is None:
+        return tree
+    return tree.with_args(new_args)
 
 #Az első paraméter egy fa, a második egy dict ami változó -> érték párokat tartalmaz.
 #A fában a változókat lecseréli az adott értékekre.
+#A szekvencia-változók értékét (tuple) beilleszti a paraméterlistába, ha így egy asszociatív függvénynek
+#egyetlen paramétere marad, akkor azt adja vissza (pl. +(1, r*) ahol r = () -> 1).
 def replace_in_tree(tree, match_res):
     if type(tree) is Function:
-        for k in range(len(tree.args)):
-            tree.args[k] = replace_in_tree(tree.args[k], match_res)
+        if any(type(arg) is SeqVar for arg in tree.args):
+            new_args = []
+            for arg in tree.args:
+                if type(arg) is SeqVar and arg.name in match_res:
+                    new_args.extend(match_res[arg.name])
+                else:
+                    new_args.append(replace_in_tree(arg, match_res))
+            if len(new_args) == 1 and tree.assoc != -1:
+                return new_args[0]
+            return make_function(tree.name, new_args, tree.commutative, tree.assoc, min(tree.original_arg_count, len(new_args)))
+        return map_args(tree, lambda arg: replace_in_tree(arg, match_res))
     if type(tree) is Var:
         if tree.name in match_res:
             return match_res[tree.name]
     return tree
 
+#Szabály jobb oldalának lefordítása példányosító függvénnyé: a visszaadott függvény az illesztés eredményéből
+#(változónév -> érték) közvetlenül felépíti a replace_in_tree(target, match_res) eredményét.
+#A változót nem tartalmazó részfákat nem építi újra, hanem a mintából veszi át (közös részfák).
+def compile_template(target):
+    if type(target) is Var:
+        name = target.name
+        return lambda match_res: match_res.get(name, target)
+    if type(target) is not Function or not pattern_var_names(target):
+        return lambda match_res: target
+    builders = [compile_template(arg) for arg in target.args]
+    seq_names = [arg.name if type(arg) is SeqVar else None for arg in target.args]
+    if not any(seq_names):
+        def build(match_res):
+            return target.with_args([builder(match_res) for builder in builders])
+        return build
+    parts = list(zip(seq_names, builders))
+    def build_spliced(match_res):
+        new_args = []
+        for name, builder in parts:
+            if name is not None and name in match_res:
+                new_args.extend(match_res[name])
+            else:
+                new_args.append(builder(match_res))
+        if len(new_args) == 1 and target.assoc != -1:
+            return new_args[0]
+        return make_function(target.name, new_args, target.commutative, target.assoc, min(target.original_arg_count, len(new_args)))
+    return build_spliced
+
+#A jobb oldal példányosítása az illesztés eredményével (a lefordított változattal, a jobb oldalon tárolva, lásd node_memo)
+def instantiate(target, match_res):
+    return node_memo(target, 'template', compile_template)(match_res)
+
+#A szabályok bal oldalainak indexe (discrimination net)
+#Minden (szabály, változat) párt a minta prefix bejárása szerinti szimbólumsorozattal tárol egy trie-ban:
+#   (név, paraméterszám): függvény, a paraméterei következnek
+#   (név, None): asszociatív/kommutatív függvény, a paraméterei tetszőleges sorrendben/számban illeszkednek, ezért kimaradnak
+#   ('const', érték): konstans
+#   '*': változó, szekvencia-változó, External - bármilyen részfára illeszkedik
+#Egy részfához egyetlen bejárással megkapjuk azokat a párokat, amelyek illeszkedhetnek rá (a többi biztosan nem illeszkedik).
+class RuleIndex:
+    WILDCARD = '*'
+
+    def __init__(self, rules, cache_size=100000):
+        self.rules = list(rules)
+        self._root = {}
+        self._cache_size = cache_size
+        self._lookup_cache = {}
+        self._relevant_cache = {}
+        order = 0
+        for rule in self.rules:
+            for variant in rule.all_sources:
+                node = self._root
+                for symbol in self._symbols(variant, rule.ac_matching):
+                    node = node.setdefault(symbol, {})
+                node.setdefault(None, []).append((order, rule, variant))
+                order += 1
+
+    #A minta szimbólumsorozata (prefix bejárás)
+    def _symbols(self, pattern, ac):
+        if type(pattern) is Function:
+            if ac and (pattern.commutative or pattern.assoc != -1):
+                return [(pattern.name, None)]
+            res = [(pattern.name, len(pattern.args))]
+            for arg in pattern.args:
+                res.extend(self._symbols(arg, ac))
+            return res
+        if type(pattern) in (Var, SeqVar, External):
+            return [self.WILDCARD]
+        try:
+            hash(pattern)
+        except TypeError:
+            return [self.WILDCARD]
+        return [('const', pattern)]
+
+    def _retrieve(self, node, stack, res):
+        if not stack:
+            res.extend(node.get(None, ()))
+            return
+        t = stack[-1]
+        rest = stack[:-1]
+        child = node.get(self.WILDCARD)
+        if child is not None:
+            self._retrieve(child, rest, res)
+        if type(t) is Function:
+            child = node.get((t.name, None))
+            if child is not None:
+                self._retrieve(child, rest, res)
+            child = node.get((t.name, len(t.args)))
+            if child is not None:
+                self._retrieve(child, rest + list(reversed(t.args)), res)
+        elif type(t) is not Var:
+            try:
+                child = node.get(('const', t))
+            except TypeError:
+                child = None
+            if child is not None:
+                self._retrieve(child, rest, res)
+
+    def _cached(self, cache, tree, compute):
+        entry = cache.get(id(tree))
+        if entry is not None and entry[0] is tree:
+            return entry[1]
+        value = compute(tree)
+        if len(cache) >= self._cache_size:
+            cache.clear()
+        cache[id(tree)] = (tree, value)
+        return value
+
+    #A részfára (a gyökerében) illeszkedő lehetséges (szabály, változat) párok, a szabályok sorrendjében
+    def candidates(self, tree):
+        res = []
+        self._retrieve(self._root, [tree], res)
+        res.sort(key=lambda entry: entry[0])
+        return [(rule, variant) for (order, rule, variant) in res]
+
+    #Mint a candidates, de szabályonként csoportosítva: dict szabály -> változatok listája (memoizált)
+    def lookup(self, tree):
+        return self._cached(self._lookup_cache, tree, self._lookup)
+
+    def _lookup(self, tree):
+        res = {}
+        for rule, variant in self.candidates(tree):
+            res.setdefault(rule, []).append(variant)
+        return res
+
+    #Azon szabályok halmaza, amelyek a fa valamelyik részfájára illeszkedhetnek (memoizált)
+    def relevant(self, tree):
+        return self._cached(self._relevant_cache, tree, self._relevant)
+
+    def _relevant(self, tree):
+        res = set(self.lookup(tree))
+        if type(tree) is Function:
+            for arg in tree.args:
+                res.update(self.relevant(arg))
+        return frozenset(res)
+
+#Korlátos méretű gyorsítótár, amelynek kulcsai objektumok (azonosító alapján, az internálás miatt az azonos részfák
+#ugyanazok az objektumok). A bejegyzés a kulcs objektumokat is tárolja, így az azonosítójuk nem kerülhet újra
+#felhasználásra. Legfeljebb max_size bejegyzést tárol, a legrégebben használtat dobja el (LRU).
+class LRUCache:
+    def __init__(self, max_size=100000):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._table = collections.OrderedDict()
+
+    #A kulcs objektumokhoz tartozó bejegyzés (a kulcs objektumok és az érték tuple-je), vagy None
+    def get_entry(self, *keys):
+        key = tuple(map(id, keys))
+        entry = self._table.get(key)
+        if entry is None or any(a is not b for a, b in zip(entry, keys)):
+            self.misses += 1
+            return None
+        self._table.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    #Egy bejegyzés (a kulcs objektumok, majd az érték) tárolása
+    def put_entry(self, *entry):
+        key = tuple(map(id, entry[:-1]))
+        self._table[key] = entry
+        self._table.move_to_end(key)
+        while len(self._table) > self.max_size:
+            self._table.popitem(last=False)
+
+    def clear(self):
+        self._table.clear()
+
+    def __len__(self):
+        return len(self._table)
+
+    def __repr__(self):
+        return "{}(size={}, hits={}, misses={})".format(type(self).__name__, len(self._table), self.hits, self.misses)
+
+#Szabályalkalmazások memoizálása egy egyszerűsítés teljes futása alatt
+#A kulcs a szabály és a részfa, az érték az apply_rule_in_tree eredménye az adott részfán: maga a részfa, ha a szabály
+#sehol sem illeszkedik benne ("nincs illeszkedés"), egyébként az átírt részfa. Lásd LRUCache.
+class RewriteMemo(LRUCache):
+    #A (szabály, részfa, eredmény) bejegyzés, vagy None
+    def get(self, rule, tree):
+        return self.get_entry(rule, tree)
+
+    def put(self, rule, tree, result):
+        self.put_entry(rule, tree, result)
+
 #Egy átírási szabályt alkalmaz egy fára (rekurzívan).
 #Megnézi, hogy az adott részfa illeszkedik-e a szabály bal oldalára (match),
 #ha igen, akkor átírja a fát a szabály jobb oldalaként adott kifejezésre (replace_in_tree).
-def apply_rule_in_tree(rule, tree):
+#A bemenő fát nem módosítja: ha a szabály sehol sem illeszkedik, akkor ugyanazt az objektumot adja vissza,
+#egyébként csak a gyökértől az átírt részfákig vezető utakat építi újra, a többi részfa közös marad.
+#index: opcionális RuleIndex, ekkor csak azokat a részfákat és változatokat nézi, amelyekre a szabály illeszkedhet
+#memo: opcionális RewriteMemo, a már látott (szabály, részfa) párokra nem illeszt újra
+def apply_rule_in_tree(rule, tree, index=None, memo=None):
+    if index is not None and rule not in index.relevant(tree):
+        return tree
+    if memo is not None and type(tree) is Function:
+        entry = memo.get(rule, tree)
+        if entry is not None:
+            return entry[2]
+        result = _apply_rule_at(rule, tree, index, memo)
+        memo.put(rule, tree, result)
+        return result
+    return _apply_rule_at(rule, tree, index, memo)
+
+def _apply_rule_at(rule, tree, index, memo):
+    if type(tree) is Function:
+        tree = map_args(tree, lambda arg: apply_rule_in_tree(rule, arg, index, memo))
+    res = rewrite_root(rule, tree, index)
+    return tree if res is None else res
+
+#A szabály alkalmazása a fa gyökerén (a részfákon nem), az átírt fát adja vissza, vagy None-t, ha a szabály nem illeszkedik
+def rewrite_root(rule, tree, index=None):
+    sources = rule.all_sources if index is None else index.lookup(tree).get(rule, ())
+    for src in sources:
+        match_res = compiled_matcher(src, rule.ac_matching)(tree)
+        if is_nontrivial_match(match_res):
+            return instantiate(rule.rewrite_target, match_res)
+    return None
+
+#Egy részfa lecserélése az adott pozíción (a pozíció a paraméterindexek sorozata a gyökértől)
+#Csak a gyökértől a pozícióig vezető utat építi újra.
+def replace_at(tree, position, subtree):
+    if not position:
+        return subtree
+    k = position[0]
+    args = list(tree.args)
+    args[k] = replace_at(args[k], position[1:], subtree)
+    return tree.with_args(args)
+
+#Egy lépéses átírás: melyik szabály, melyik bal oldali változat, melyik pozíción, és az eredmény (a teljes fa)
+Rewrite = collections.namedtuple('Rewrite', ['rule', 'variant', 'position', 'result'])
+
+#A fa pozíciói és részfái prefix sorrendben; index esetén kihagyja azokat a részfákat, ahol egy szabály sem illeszkedhet
+def _positions(tree, index, position=()):
+    if index is not None and not index.relevant(tree):
+        return
+    yield position, tree
     if type(tree) is Function:
         for k in range(len(tree.args)):
-            tree.args[k] = apply_rule_in_tree(rule, tree.args[k])
-    for src in rule.all_sources:
-        match_res = match(tree, src)
-        if match_res != None and match_res != {}:
-            return replace_in_tree(copy.deepcopy(rule.target), match_res)
-    return tree
+            yield from _positions(tree.args[k], index, position + (k,))
+
+#Az összes különböző egy lépéses átírás lusta előállítása (generátor)
+#Egyetlen bejárással, pozíciónként és szabályonként (a szabályok sorrendjében) egy-egy Rewrite-ot ad, az eredményt
+#a gyökértől a pozícióig vezető út újraépítésével kapjuk, a többi részfa közös.
+#Az eredeti fával azonos és a már előállított eredményeket kihagyja, így a hívó bármikor abbahagyhatja a fogyasztást.
+#index: opcionális RuleIndex, ekkor csak a jelölt (szabály, változat) párokat próbálja
+#all_matches: ha True, akkor egy változat összes illeszkedését felhasználja (match_all), egyébként csak az elsőt
+def one_step_rewrites(tree, rules, index=None, all_matches=False):
+    seen = {tree}
+    rule_set = set(rules) if index is not None else None
+    for position, subtree in _positions(tree, index):
+        if index is not None:
+            candidates = [(rule, src) for rule, src in index.candidates(subtree) if rule in rule_set]
+        else:
+            candidates = [(rule, src) for rule in rules for src in rule.all_sources]
+        for rule, src in candidates:
+            if all_matches:
+                matches = match_all(subtree, src, {}, rule.ac_matching)
+            else:
+                match_res = compiled_matcher(src, rule.ac_matching)(subtree)
+                matches = [match_res] if match_res is not None else []
+            for match_res in matches:
+                if not is_nontrivial_match(match_res):
+                    continue
+                result = replace_at(tree, position, instantiate(rule.rewrite_target, match_res))
+                if result in seen:
+                    continue
+                seen.add(result)
+                yield Rewrite(rule, src, position, result)
 
 ##############################################
 # Egyszerűsítés
@@ -258,11 +1461,15 @@ def apply_rule_in_tree(rule, tree):
 #Az egyszerűsítés egy lépése
 #Alkalmazza a megadott transzformációkat és átírási szabályokat.
 #Az eredményt csak akkor tartja meg ha egyszerűbb a megadott mérték szerint.
-def simplify_step(expr, rules, transformations, simplicity_measure):
-    for trf in transformations:
-        expr = trf(copy.deepcopy(expr))
+#index, memo: opcionális RuleIndex és RewriteMemo, lásd apply_rule_in_tree
+def simplify_step(expr, rules, transformations, simplicity_measure, index=None, memo=None):
+    if type(transformations) is Normalizer:
+        expr = transformations(expr)
+    else:
+        for trf in transformations:
+            expr = trf(expr)
     for rule in rules:
-        new_expr = apply_rule_in_tree(rule, copy.deepcopy(expr))
+        new_expr = apply_rule_in_tree(rule, expr, index, memo)
         if simplicity_measure(new_expr) < simplicity_measure(expr):
             expr = new_expr
     return expr
@@ -270,13 +1477,134 @@ def simplify_step(expr, rules, transformations, simplicity_measure):
 #Egyszerűsítés
 #expr: az egyszerűsítendő kifejezés
 #rules: átírási szabályok
-#transformations: transzformációk amik nem fejezhetők ki átírási szabályként
+#transformations: transzformációk amik nem fejezhetők ki átírási szabályként (lista vagy Normalizer)
+#   A futás során egy Normalizer alkalmazza őket, így egy már normalizált kifejezést nem normalizál újra.
 #simplicity_measure: egy függvény amely egy kifejezéshez egy számot rendel, minél "egyszerűbb" egy kifejezés annál kisebbet
-def simplify(expr, rules, transformations, simplicity_measure):
-    new_expr = simplify_step(expr, rules, transformations, simplicity_measure)
-    if simplicity_measure(new_expr) < simplicity_measure(expr):
-        expr = simplify(new_expr, rules, transformations, simplicity_measure)
-    return expr
+#index: opcionális RuleIndex a szabályokhoz
+#memo: opcionális RewriteMemo, a futás során a már látott részfákra nem alkalmazza újra a szabályokat
+#Az eredményt (a lépések számát és a megállás okát) lásd simplify_run.
+def simplify(expr, rules, transformations, simplicity_measure, index=None, memo=None):
+    return simplify_run(expr, rules, transformations, simplicity_measure, index, memo).expr
+
+#A simplify_run eredménye
+#expr: az egyszerűsített kifejezés
+#steps: a sikeres (a mértéket csökkentő) lépések száma
+#reason: a megállás oka
+#   'no_improvement': a következő lépés nem csökkenti a mértéket
+#   'cycle': a következő lépés egy már látott kifejezést adna (pl. egy két irányú szabály visszaalakítaná az előzőt;
+#       a mérték szigorú csökkenése miatt ez csak nem determinisztikus vagy inkonzisztens mértéknél fordulhat elő)
+#   'max_steps': elérte a max_steps lépést
+SimplifyResult = collections.namedtuple('SimplifyResult', ['expr', 'steps', 'reason'])
+
+#Egyszerűsítés ciklusként (nem rekurzívan, így akárhány lépés lehet), a látott kifejezések nyilvántartásával
+#Paraméterek: lásd simplify, továbbá max_steps: legfeljebb ennyi lépés (None: nincs korlát)
+def simplify_run(expr, rules, transformations, simplicity_measure, index=None, memo=None, max_steps=None):
+    if type(transformations) is not Normalizer:
+        transformations = Normalizer(transformations)
+    visited = {id(expr): expr}
+    score = simplicity_measure(expr)
+    steps = 0
+    while True:
+        if max_steps is not None and steps >= max_steps:
+            return SimplifyResult(expr, steps, 'max_steps')
+        new_expr = simplify_step(expr, rules, transformations, simplicity_measure, index, memo)
+        new_score = simplicity_measure(new_expr)
+        if not new_score < score:
+            return SimplifyResult(expr, steps, 'no_improvement')
+        if id(new_expr) in visited:
+            return SimplifyResult(expr, steps, 'cycle')
+        visited[id(new_expr)] = new_expr
+        expr, score = new_expr, new_score
+        steps += 1
+
+#Egyszerűsítés munkalistával (worklist): csak a megváltozott részfákat vizsgálja újra
+#Paraméterek: lásd simplify (index nélkül a szabályokból egy RuleIndex-et épít). RewriteMemo-t nem használ: az a teljes
+#részfára alkalmazott szabályok eredményeit tárolja, a munkalista pedig csak a részfák gyökerén ír át, és maga jegyzi meg
+#a nem átírható részfákat.
+#Mint a simplify lépései, egy kör a fa normalizálásával kezdődik, és a szabályok eredményeit nem normalizálja.
+#A munkalista pozíciókat tartalmaz, kezdetben a fa összes pozícióját, a levelektől a gyökér felé.
+#Egy pozíción az első olyan szabályt alkalmazza a részfa gyökerén, amelynek eredményével a teljes fa mértéke csökken
+#(mint a simplify-ban, a mértéknek nem kell a részfákban monotonnak lennie).
+#Egy átírás után csak az új részfa pozícióit és a pozíció őseit teszi a munkalistára. Azokat a részfákat, amelyek
+#gyökerére egy szabály sem illeszkedik, megjegyzi (az internálás miatt azonosító alapján), ezeket nem vizsgálja újra,
+#a későbbi körökben sem. Ha egy részfa átírásai nem csökkentették a mértéket, akkor azt a részfát csak az adott
+#körben és csak az adott pozíción hagyja ki (máshol, más környezetben a mérték csökkenhet).
+#Ha a munkalista kiürült, és a kör csökkentette a teljes fa mértékét, akkor új kört kezd (a Normalizer
+#csak a megváltozott utakat normalizálja újra), egyébként az előző kör eredményét adja vissza.
+def worklist_simplify(expr, rules, transformations, simplicity_measure, index=None):
+    if type(transformations) is not Normalizer:
+        transformations = Normalizer(transformations)
+    if index is None:
+        index = RuleIndex(rules)
+    irreducible = {}
+    score = simplicity_measure(expr)
+    while True:
+        tree = transformations(expr)
+        tree_score = simplicity_measure(tree)
+        rejected = {}
+        worklist = collections.deque()
+        queued = set()
+        _enqueue_subtree(tree, (), worklist, queued, irreducible)
+        while worklist:
+            position = worklist.popleft()
+            queued.discard(position)
+            node = subtree_at(tree, position)
+            if node is None or id(node) in irreducible or (position, id(node)) in rejected:
+                continue
+            res = _reduce_at(tree, tree_score, position, node, rules, simplicity_measure, index)
+            if res is None:
+                irreducible[id(node)] = node
+                continue
+            if res is False:
+                rejected[position, id(node)] = node
+                continue
+            new_node, tree, tree_score = res
+            _enqueue_subtree(new_node, position, worklist, queued, irreducible)
+            for k in range(len(position) - 1, -1, -1):
+                if position[:k] not in queued:
+                    queued.add(position[:k])
+                    worklist.append(position[:k])
+        if not tree_score < score:
+            return expr
+        expr, score = tree, tree_score
+
+#A részfa az adott pozíción, vagy None, ha nincs ilyen pozíció
+def subtree_at(tree, position):
+    for k in position:
+        if type(tree) is not Function or k >= len(tree.args):
+            return None
+        tree = tree.args[k]
+    return tree
+
+#A részfa pozícióinak munkalistára tétele a levelektől a gyökér felé (a gyökerükön nem átírható részfák kivételével)
+def _enqueue_subtree(tree, position, worklist, queued, irreducible):
+    if type(tree) is Function:
+        for k in range(len(tree.args)):
+            _enqueue_subtree(tree.args[k], position + (k,), worklist, queued, irreducible)
+    if id(tree) not in irreducible and position not in queued:
+        queued.add(position)
+        worklist.append(position)
+
+#Az első olyan szabály átírása a pozíción lévő részfa gyökerén, amellyel a teljes fa mértéke csökken:
+#(új részfa, új fa, új mérték). None, ha egy szabály sem illeszkedik a részfa gyökerére, False, ha illeszkedik,
+#de egyik eredménnyel sem csökken a mérték.
+def _reduce_at(tree, score, position, node, rules, simplicity_measure, index):
+    candidates = index.lookup(node)
+    if not candidates:
+        return None
+    res = None
+    for rule in rules:
+        if rule not in candidates:
+            continue
+        new_node = rewrite_root(rule, node, index)
+        if new_node is None:
+            continue
+        new_tree = replace_at(tree, position, new_node)
+        new_score = simplicity_measure(new_tree)
+        if new_score < score:
+            return new_node, new_tree, new_score
+        res = False
+    return res
 
 #Feladatok
 # Irodalom feldolgozása - hogyan működnek ezek az algoritmusok, használható ötleteket kigyűjteni, stb.
@@ -327,6 +1655,93 @@ def simplify(expr, rules, transformations, simplicity_measure):
 #       Mivel itt most nincs az algoritmus mögött egy komputeralgebra-rendszer ami ezt megtenné, ezért a legalapvetőbb
 #       kifejezéseket célszerű mégis kiértékelni, lásd fentebb az eval_tree transzformációt.
 
+#A simplify_expr eredményeinek tárolása részfánként (kanonikus alakok), a simplify_expr_cache-ként opcionálisan használható
+#A kulcs a részfa (a Var tag-ek és a kommutatív/asszociatív jelzők is számítanak), az érték a simplify_expr eredménye.
+#Lásd LRUCache.
+class CanonicalCache(LRUCache):
+    #A (részfa, eredmény) bejegyzés, vagy None
+    def get(self, tree):
+        return self.get_entry(tree)
+
+    def put(self, tree, result):
+        self.put_entry(tree, result)
+
+#Transzformációk sorozatának alkalmazása (normalizálás), a normalizált csomópontok nyilvántartásával
+#Csomópontonként tárolja a normalizált alakot (gyenge kulccsal, így a csomóponttal együtt törlődik), és a normalizálás
+#eredményét is normalizáltnak jelöli (is_normalized), így azt már nem normalizálja újra. A transzformációkat tehát
+#idempotensnek tekinti; a simplify_expr a less inkonzisztens rendezése miatt nem mindig az, ekkor az első alakot tartja meg.
+#Ha egyetlen transzformáció van, és annak van gyökér lépése (root attribútum: egy csomópontot normalizál, ha a paraméterei
+#már normalizáltak, pl. simplify_expr.root = simplify_root), akkor lentről felfelé, csomópontonként normalizál, és a már
+#normalizált részfáknál megáll. Mivel egy átírás a változatlan részfákat közösen használja (lásd apply_rule_in_tree),
+#egy normalizált fa átírása után csak az átírt részfát és a gyökérig vezető utat normalizálja.
+#Egyébként a transzformációkat a teljes fára alkalmazza, és csak a gyökeret jelöli.
+#Hívható objektum, a simplify és a SimplifyMiniMax ezen keresztül alkalmazza a transzformációkat.
+class Normalizer:
+    def __init__(self, transformations):
+        self.transformations = list(transformations)
+        self.root = getattr(self.transformations[0], 'root', None) if len(self.transformations) == 1 else None
+        self.hits = 0
+        self.misses = 0
+        self._status = weakref.WeakKeyDictionary()
+
+    def __call__(self, tree):
+        if self.root is not None:
+            return self._normalize(tree)
+        res = self._lookup(tree)
+        if res is not _MISSING:
+            return res
+        res = tree
+        for trf in self.transformations:
+            res = trf(res)
+        self._record(tree, res)
+        return res
+
+    #Lentről felfelé normalizálás a gyökér lépéssel
+    def _normalize(self, tree):
+        if type(tree) is not Function:
+            return self.root(tree)
+        res = self._lookup(tree)
+        if res is not _MISSING:
+            return res
+        res = self.root(map_args(tree, self._normalize))
+        self._record(tree, res)
+        return res
+
+    #A tárolt normalizált alak, vagy _MISSING
+    def _lookup(self, tree):
+        if type(tree) is not Function:
+            return _MISSING
+        res = self._status.get(tree, _MISSING)
+        if res is _MISSING:
+            self.misses += 1
+            return _MISSING
+        self.hits += 1
+        return tree if res is _SAME else res
+
+    def _record(self, tree, res):
+        if type(tree) is Function:
+            self._status[tree] = _SAME if res is tree else res
+        if type(res) is Function and res is not tree:
+            self._status[res] = _SAME
+
+    def is_normalized(self, tree):
+        if type(tree) is not Function:
+            return self(tree) is tree
+        return self._status.get(tree) is _SAME
+
+    def __len__(self):
+        return len(self._status)
+
+    def __repr__(self):
+        return "Normalizer(size={}, hits={}, misses={})".format(len(self._status), self.hits, self.misses)
+
+#A simplify_expr a kanonikus alakot a részfán tárolja (mint a properties), így egy változatlan részfa újbóli kanonikus
+#alakra hozása csak egy keresés, és az eredmény a részfával együtt szabadul fel. Ha a részfa már kanonikus, akkor
+#a _SAME jelzőt tárolja (nem keletkezik körkörös hivatkozás).
+#simplify_expr_cache: opcionális CanonicalCache (korlátos méret, LRU, statisztikák); ha meg van adva, akkor a csomópontok
+#helyett ezt használja. Alapértelmezetten None.
+simplify_expr_cache = None
+
 def simplify_expr(expr):
     if isinstance(expr, numbers.Integral) or type(expr) is Var:
         return expr
@@ -335,21 +1750,47 @@ def simplify_expr(expr):
         return simplify_rational_number(expr)
 
     if type(expr) is Function:
-        expr.args = list(map(simplify_expr, expr.args))
-        
-        if expr.name == '^':
-            return simplify_power(expr)
-        if expr.name == '+':
-            return simplify_sum(expr)
-        if expr.name == '-':
-            return simplify_diff(expr)
-        if expr.name == '*':
-            return simplify_product(expr)
-        if expr.name == '/':
-            return simplify_quot(expr)
+        cache = simplify_expr_cache
+        if cache is None:
+            res = expr._canonical
+            if res is None:
+                res = simplify_function(expr)
+                object.__setattr__(expr, '_canonical', _SAME if res is expr else res)
+                return res
+            return expr if res is _SAME else res
+        entry = cache.get(expr)
+        if entry is not None:
+            return entry[1]
+        res = simplify_function(expr)
+        cache.put(expr, res)
+        return res
+
+    return expr
+
+#Egy függvény kanonikus alakra hozása (a paramétereit simplify_expr-rel)
+def simplify_function(expr):
+    return simplify_root(map_args(expr, simplify_expr))
+
+#A simplify_expr gyökér lépése: egy kifejezés kanonikus alakra hozása, ha a paraméterei már kanonikusak (lásd Normalizer)
+def simplify_root(expr):
+    if type(expr) is not Function:
+        return simplify_expr(expr)
+
+    if expr.name == '^':
+        return simplify_power(expr)
+    if expr.name == '+':
+        return simplify_sum(expr)
+    if expr.name == '-':
+        return simplify_diff(expr)
+    if expr.name == '*':
+        return simplify_product(expr)
+    if expr.name == '/':
+        return simplify_quot(expr)
 
     return expr
 
+simplify_expr.root = simplify_root
+
 def simplify_diff(expr):
     rhs = simplify_product(Function('*', -1, expr.args[1]))
     return simplify_sum(Function('+', expr.args[0], rhs, commutative = expr.commutative, associative = expr.assoc))
@@ -401,7 +1842,7 @@ def simplify_int_power(v, n):
             return Function('^', r, p)
 
         if v.name == '*':
-            v.args = list(map(lambda x: simplify_int_power(x, n), v.args))
+            v = v.with_args([simplify_int_power(x, n) for x in v.args])
             return simplify_product(v)
 
     return Function('^', v, n);
@@ -420,7 +1861,7 @@ def simplify_product(expr):
         return expr.args[0]
 
     # SPRD-4
-    v = simplify_product_rec(expr.args, expr.commutative, expr.assoc)
+    v = simplify_product_rec(list(expr.args), expr.commutative, expr.assoc)
     
     if len(v) == 1: # SPRD-4-1
         return v[0]
@@ -467,55 +1908,74 @@ def simplify_product_rec(L, c, a):
 
         # SPRDREC-2-1
         elif type(L[0]) is Function and L[0].name == '*' and type(L[1]) is Function and L[1].name == '*':
-            return merge_products(L[0].args, L[1].args, c, a)
+            return merge_products(list(L[0].args), list(L[1].args), c, a)
 
         # SPRDREC-2-2
         elif type(L[0]) is Function and L[0].name == '*':
-            return merge_products(L[0].args, [L[1]], c, a)
+            return merge_products(list(L[0].args), [L[1]], c, a)
 
         # SPRDREC-2-3
         elif type(L[1]) is Function and L[1].name == '*':
-            return merge_products([L[0]], L[1].args, c, a)
+            return merge_products([L[0]], list(L[1].args), c, a)
 
     # SPRDREC-3
+    # A rekurzió (L[1:]) helyett jobbról balra haladva fűzzük be a tényezőket, ugyanabban a sorrendben.
+    # A lépésszám továbbra is négyzetes a tényezők számában (minden tényező befűzése lineáris), csak a rekurzió és a
+    # listamásolások maradtak el. Egy egyszeri rendezés (O(n log n)) nem adná ugyanazt az eredményt, mert a less nem
+    # konzisztens rendezés (pl. less(2*a, -1*c) és less(-1*c, 2*a) is igaz), így az eredmény a befűzések sorrendjétől függ.
     elif len(L) > 2:
-        w = simplify_product_rec(L[1:], c, a)
-
-        # SPRDREC-3-1
-        if type(L[0]) is Function and L[0].name == '*':
-            return merge_products(L[0].args, w, c, a)
+        w = simplify_product_rec(L[-2:], c, a)
+        for k in range(len(L)-3, -1, -1):
+            # SPRDREC-3-1
+            if type(L[k]) is Function and L[k].name == '*':
+                w = merge_products(list(L[k].args), w, c, a)
 
-        # SPRDREC-3-2
-        else:
-            return merge_products([L[0]], w, c, a)
+            # SPRDREC-3-2
+            else:
+                w = merge_products([L[k]], w, c, a)
+        return w
 
+#Két rendezett tényezőlista összefésülése
+#A rekurzív definíció (p[1:], q[1:]) helyett indexekkel halad végig a listákon, az eredmény ugyanaz.
+#A listák hosszával lineáris, lásd SPRDREC-3.
 def merge_products(p, q, c, a):
-    # MPRD-1
-    if q == []:
-        return p
-
-    # MPRD-2
-    if p == []:
-        return q
-
-    # MPRD-3
-    h = simplify_product_rec([p[0], q[0]], c, a)
- 
-    # MPRD-3-1
-    if h == []:
-        return merge_products(p[1:], q[1:], c, a)
-    # MPRD-3-2
-    elif len(h) == 1:
-        return [h[0]] + merge_products(p[1:], q[1:], c, a)
-    
-    elif len(h) == 2:
+    res = []
+    i = 0
+    j = 0
+    while True:
+        # MPRD-1
+        if j == len(q):
+            return res + p[i:]
+
+        # MPRD-2
+        if i == len(p):
+            return res + q[j:]
+
+        # MPRD-3
+        h = simplify_product_rec([p[i], q[j]], c, a)
+
+        # MPRD-3-1
+        if h == []:
+            i += 1
+            j += 1
+        # MPRD-3-2
+        elif len(h) == 1:
+            res.append(h[0])
+            i += 1
+            j += 1
+
         # MPRD-3-3
-        if h[0] == p[0]:
-            return [h[0]] + merge_products(p[1:], q, c, a)
-        
+        elif len(h) == 2 and h[0] == p[i]:
+            res.append(h[0])
+            i += 1
+
         # MPRD-3-3
-        elif h[0] == q[0]:
-            return [h[0]] + merge_products(p, q[1:], c, a)
+        elif len(h) == 2 and h[0] == q[j]:
+            res.append(h[0])
+            j += 1
+
+        else:
+            return None
 
 def simplify_sum(expr):
     # SSRD-1
@@ -527,7 +1987,7 @@ def simplify_sum(expr):
         return expr.args[0]
 
     # SSRD-4
-    v = simplify_sum_rec(expr.args, expr.commutative, expr.assoc)
+    v = simplify_sum_rec(list(expr.args), expr.commutative, expr.assoc)
     
     if len(v) == 1: # SSRD-4-1
         return v[0]
@@ -574,56 +2034,70 @@ def simplify_sum_rec(L, c, a):
 
         # SSRDREC-2-1
         elif type(L[0]) is Function and L[0].name == '+' and type(L[1]) is Function and L[1].name == '+':
-            return merge_sums(L[0].args, L[1].args, c, a)
+            return merge_sums(list(L[0].args), list(L[1].args), c, a)
 
         # SSRDREC-2-2
         elif type(L[0]) is Function and L[0].name == '+':
-            return merge_sums(L[0].args, [L[1]], c, a)
+            return merge_sums(list(L[0].args), [L[1]], c, a)
 
         # SSRDREC-2-3
         elif type(L[1]) is Function and L[1].name == '+':
-            return merge_sums([L[0]], L[1].args, c, a)
+            return merge_sums([L[0]], list(L[1].args), c, a)
 
     # SSRDREC-3
+    # Lásd SPRDREC-3.
     elif len(L) > 2:
-        w = simplify_sum_rec(L[1:], c, a)
-
-        # SSRDREC-3-1
-        if type(L[0]) is Function and L[0].name == '+':
-            return merge_sums(L[0].args, w, c, a)
+        w = simplify_sum_rec(L[-2:], c, a)
+        for k in range(len(L)-3, -1, -1):
+            # SSRDREC-3-1
+            if type(L[k]) is Function and L[k].name == '+':
+                w = merge_sums(list(L[k].args), w, c, a)
 
-        # SSRDREC-3-2
-        else:
-            return merge_sums([L[0]], w, c, a)
+            # SSRDREC-3-2
+            else:
+                w = merge_sums([L[k]], w, c, a)
+        return w
 
+#Két rendezett taglista összefésülése, lásd merge_products
 def merge_sums(p, q, c, a):
-    # MSRD-1
-    if q == []:
-        return p
-
-    # MSRD-2
-    if p == []:
-        return q
-
-    # MSRD-3
-    h = simplify_sum_rec([p[0], q[0]], c, a)
-    
-    # MSRD-3-1
-    if h == []:
-        return merge_sums(p[1:], q[1:], c, a)
+    res = []
+    i = 0
+    j = 0
+    while True:
+        # MSRD-1
+        if j == len(q):
+            return res + p[i:]
+
+        # MSRD-2
+        if i == len(p):
+            return res + q[j:]
+
+        # MSRD-3
+        h = simplify_sum_rec([p[i], q[j]], c, a)
+
+        # MSRD-3-1
+        if h == []:
+            i += 1
+            j += 1
+
+        # MSRD-3-2
+        elif len(h) == 1:
+            res.append(h[0])
+            i += 1
+            j += 1
 
-    # MSRD-3-2
-    elif len(h) == 1:
-        return [h[0]] + merge_sums(p[1:], q[1:], c, a)
-    
-    elif len(h) == 2:
         # MSRD-3-3
-        if h[0] == p[0]:
-            return [h[0]] + merge_sums(p[1:], q, c, a)
-        
+        elif len(h) == 2 and h[0] == p[i]:
+            res.append(h[0])
+            i += 1
+
         # MSRD-3-3
-        elif h[0] == q[0]:
-            return [h[0]] + merge_sums(p, q[1:], c, a)
+        elif len(h) == 2 and h[0] == q[j]:
+            res.append(h[0])
+            j += 1
+
+        else:
+            return None
 
 def simplify_rne(u):
     v = simplify_rne_rec(u)
@@ -665,77 +2139,34 @@ def simplify_rne_rec(u):
 
                 return eval_power(v, u.args[1])
 
+#Az eval_* függvények a racionális aritmetikát használják (lásd make_rational), az eredmény már normalizált.
 def eval_quot(v, w):
-    if numer(w)*denom(v) == 0:
-        return None
-
-    return Fraction(numer(v) * denom(w), numer(w) * denom(v))
+    return rational_div(v, w)
 
 def eval_power(v, n):
-    if numer(v) != 0:
-        if n > 0:
-            s = eval_power(v, n-1)
-            return eval_prod(s, v)
-        elif n == 0:
-            return 1
-        elif n == -1:
-            return Fraction(denom(v), numer(v))
-        elif n < -1:
-            s = Fraction(denom(v), numer(v))
-            return eval_power(s, -n)
-    else:
-        if n >= 1:
-            return 0
-        else:
-            return None
+    return rational_pow(v, n)
 
 def eval_sum(v, w):
-    if denom(v) * denom(w) == 0:
-        return None
-
-    return Fraction(numer(v)*denom(w) + numer(w)*denom(v), denom(v)*denom(w))
+    return rational_add(v, w)
 
 def eval_diff(v, w):
-    if denom(v) * denom(w) == 0:
-        return None
-
-    return Fraction(numer(v)*denom(w) - numer(w)*denom(v), denom(v)*denom(w))
+    return rational_sub(v, w)
 
 def eval_prod(v, w):
-    if denom(v) * denom(w) == 0:
-        return None
-
-    return Fraction(numer(v)*numer(w), denom(v)*denom(w))
+    return rational_mul(v, w)
 
 def simplify_rational_number(u):
     if isinstance(u, numbers.Integral):
         return u
 
     if type(u) is Fraction:
-        n = u.num
-        d = u.denom
-
-        if n % d == 0:
-            return n//d
-
-        g = gcd(n, d)
-        if d > 0:
-            return Fraction(n // g, d // g)
-        else:
-            return Fraction(-n // g, -d // g)
+        return make_rational(u.num, u.denom)
 
 def gcd(a, b):
     if not isinstance(a, numbers.Integral) or not isinstance(b, numbers.Integral):
         return None
 
-    A = a
-    B = b
-    while B != 0:
-        R = A % B
-        A = B
-        B = R
-
-    return abs(A)
+    return math.gcd(a, b)
 
 def term(expr):
     if type(expr) is Var or type(expr) is Function and expr.name != '*':
@@ -801,6 +2232,14 @@ def denom(expr):
 
     return 1
 
+#Paraméterlisták összehasonlítása (O-3, O-6-b)
+def less_args(uargs, vargs):
+    for i in range(min(len(uargs), len(vargs))):
+        if less(uargs[i], vargs[i]):
+            return True
+
+    return len(uargs) < len(vargs)
+
 def less(u, v):
     # O-1
     if isinstance(u, numbers.Number) and isinstance(v, numbers.Number):
@@ -822,11 +2261,7 @@ def less(u, v):
     if type(u) is Function and type(v) is Function:
         # O-3
         if u.name == '+' and v.name == '+' or u.name == '*' and v.name =='*':
-            for i in range(min(len(u.args), len(v.args))):
-                if less(u.args[i], v.args[i]):
-                    return True
-
-            return len(u.args) < len(v.args)
+            return less_args(u.args, v.args)
 
         # O-4
         if u.name == '^' and v.name == '^':
@@ -841,30 +2276,28 @@ def less(u, v):
                 return u.name < v.name
 
             # O-6-b
-            for i in range(min(len(u.args), len(v.args))):
-                if less(u.args[i], v.args[i]):
-                    return True
-
-            return len(u.args) < len(v.args)
+            return less_args(u.args, v.args)
 
     # O-7
     if (isinstance(u, numbers.Number) or type(u) is Fraction) and not (isinstance(v, numbers.Number) or type(v) is Fraction):
         return True
 
-    # O-8
+    # O-8: u < *(v), a csomagoló függvény létrehozása nélkül (O-3)
     if type(u) is Function and u.name == '*':
         if type(v) is Var or type(v) is Function and v.name != '*':
-            return less(u, Function('*', v))
+            return less_args(u.args, (v,))
 
-    # O-9
+    # O-9: u < v^1 (O-4)
     if type(u) is Function and u.name == '^':
         if type(v) is Var or type(v) is Function and v.name not in "^*":
-            return less(u, Function('^', v, 1))
+            if u.args[0] != v:
+                return less(u.args[0], v)
+            return less(u.args[1], 1)
 
-    # O-10
+    # O-10: u < +(v) (O-3)
     if type(u) is Function and u.name == '+':
         if type(v) is Var or type(v) is Function and v.name not in "+*":
-            return less(u, Function('+', v))
+            return less_args(u.args, (v,))
 
     # O-12
     if type(u) is Function and u.name not in "+^/-*" and type(v) is Var:
@@ -1,5 +1,12 @@
+import copy
+import gc
+import pickle
+import sys
+import time
 import unittest
+import weakref
 from simplify import *
+import simplify as simplify_module
 import rules
 
 import pow_rules
@@ -7,6 +14,10 @@ import trig_rules
 import minimax
 from measure import *
 import string_to_expr
+import polynomial
+import beam_search
+import egraph
+import mcts
 
 class HelperTests(unittest.TestCase):
     def test_base(self):
@@ -55,6 +66,33 @@ class HelperTests(unittest.TestCase):
         self.assertEqual(term(Fraction(1,2)), None)
         self.assertEqual(term(1), None)
 
+class InternTest(unittest.TestCase):
+    def test_same_object(self):
+        self.assertIs(AC0('+', Var('x', 'complex'), 1), AC0('+', Var('x', 'complex'), 1))
+        self.assertIs(Var('x'), Var('x'))
+        self.assertIs(Fraction(1, 2), Fraction(1, 2))
+        self.assertIsNot(F('+', 1, 2), AC0('+', 1, 2))
+        self.assertIs(F('sin', E(separate_2, 'k')), F('sin', E(separate_2, 'k')))
+
+    def test_eq_and_hash(self):
+        self.assertNotEqual(Var('x'), Var('x', 'complex'))
+        self.assertNotEqual(F('f', Var('x')), F('f', Var('x', 'complex')))
+        self.assertNotEqual(flatten(AC0('+', 1, AC0('+', 2, 3))), AC0('+', 1, 2, 3))
+        self.assertEqual(hash(F('f', Var('x'))), hash(F('f', Var('x', 'complex'))))
+        self.assertEqual(len({F('f', 1), F('f', 1), F('f', 2)}), 2)
+
+    def test_immutable(self):
+        f = F('f', 1)
+        with self.assertRaises(AttributeError):
+            f.args = (2,)
+        self.assertIs(copy.deepcopy(f), f)
+
+    def test_with_args(self):
+        f = flatten(AC0('+', 1, AC0('+', 2, 3)))
+        self.assertEqual(f.args, (1, 2, 3))
+        self.assertEqual(f.original_arg_count, 2)
+        self.assertIs(f.with_args(f.args), f)
+
 class GcdTest(unittest.TestCase):
     def test_gcd(self):
         self.assertEqual(gcd(None, 1), None)
@@ -165,6 +203,22 @@ class OrderingTests(unittest.TestCase):
     def test_var_vs_func(self):
         self.assertTrue(less(Var("f"), Function("g")))
 
+    def test_wrapped_nonsum_nonprod_nonpower(self):
+        exprs = [Var("x"), Var("y"), Function("sin", Var("x")), Function('^', Var("x"), 2), Function('+', Var("x"), 1)]
+        for u in [Function('*', 2, Var("x")), Function('*', Var("x"), Var("y")), Function('^', Var("x"), 3), Function('^', Var("y"), -1), Function('+', 1, Var("y")), Function('+', Var("x"), Var("x"))]:
+            for v in exprs:
+                if u.name == '*' and v.name != '*':
+                    self.assertEqual(less(u, v), less(u, Function('*', v)))
+                if u.name == '^' and v.name not in "^*":
+                    self.assertEqual(less(u, v), less(u, Function('^', v, 1)))
+                if u.name == '+' and v.name not in "+*":
+                    self.assertEqual(less(u, v), less(u, Function('+', v)))
+
+    def test_less_args(self):
+        self.assertTrue(less_args((1, Var("x")), (2, Var("x"))))
+        self.assertTrue(less_args((Var("x"),), (Var("x"), Var("y"))))
+        self.assertFalse(less_args((Var("x"), Var("y")), (Var("x"),)))
+
 class RationalTest(unittest.TestCase):
     def test_numer(self):
         self.assertEqual(numer(1), 1)
@@ -236,6 +290,36 @@ class RationalTest(unittest.TestCase):
         self.assertEqual(simplify_rne(Fraction(4,2)), 2)
         self.assertEqual(simplify_rne(Fraction(2,0)), None)
 
+    def test_normalized_on_construction(self):
+        self.assertIs(Fraction(6, 4), Fraction(3, 2))
+        self.assertIs(Fraction(-6, -4), Fraction(3, 2))
+        self.assertEqual((Fraction(6, -4).num, Fraction(6, -4).denom), (-3, 2))
+        self.assertIs(type(Fraction(6, 1)), int)
+        self.assertEqual(Fraction(6, 2), 3)
+        self.assertEqual(Fraction(0, 5), 0)
+        self.assertIs(F('f', Fraction(6, 2)), F('f', 3))
+        self.assertIs(F('f', Fraction(2, 4)), F('f', Fraction(1, 2)))
+        self.assertEqual((Fraction(2, 0).num, Fraction(2, 0).denom), (2, 0))
+        self.assertNotEqual(Fraction(1, 0), Fraction(2, 0))
+        self.assertNotEqual(Fraction(1, 2), None)
+
+    def test_operators(self):
+        self.assertIs(type(Fraction(1, 2) + Fraction(1, 2)), int)
+        self.assertEqual(Fraction(1, 2) + Fraction(1, 3), Fraction(5, 6))
+        self.assertEqual(1 - Fraction(1, 3), Fraction(2, 3))
+        self.assertEqual(Fraction(2, 3) * 3, 2)
+        self.assertEqual(Fraction(2, 3) / Fraction(4, 3), Fraction(1, 2))
+        self.assertEqual(Fraction(2, -3) ** -2, Fraction(9, 4))
+        self.assertTrue(Fraction(1, 3) < Fraction(1, 2) <= 1)
+        self.assertRaises(ZeroDivisionError, lambda: Fraction(1, 2) / 0)
+
+    def test_big_powers(self):
+        self.assertEqual(eval_power(Fraction(2, 3), 5000), Fraction(2**5000, 3**5000))
+        self.assertEqual(eval_power(Fraction(2, 4), -2), 4)
+        self.assertEqual(eval_power(Fraction(2, 4), 0), 1)
+        self.assertEqual(eval_power(0, -1), None)
+        self.assertEqual(simplify_expr(Function('^', 2, 10000)), 2**10000)
+
 class SimplifyExprTest(unittest.TestCase):
     def test_simplify_int_power(self):
         self.assertEqual(simplify_int_power(2, 2), 4)
@@ -327,6 +411,14 @@ class SimplifyExprTest(unittest.TestCase):
         self.assertEqual(simplify_sum(Function('+', 0, 2)), 2)
         self.assertEqual(simplify_sum(Function('+', Var("x"), Var("y"), Var("z"))), Function('+', Var("x"), Var("y"), Var("z")))
 
+    def test_simplify_large_sum_and_product(self):
+        n = 3 * sys.getrecursionlimit()
+        powers = [Function('^', Var("x"), i) for i in range(2, n)]
+        res = simplify_sum(Function('+', Var("x"), *powers, commutative = True, associative = 0))
+        self.assertEqual(res.args, (Var("x"),) + tuple(powers))
+        res = simplify_product(Function('*', *([Var("x")] * n), commutative = True, associative = 1))
+        self.assertEqual(res, Function('^', Var("x"), n))
+
     def test_simplify_expr(self):
         self.assertEqual(simplify_expr(None), None)       
         self.assertEqual(simplify_expr(1), 1)       
@@ -363,6 +455,416 @@ class ApplyTest(unittest.TestCase):
 		e1 = simplify_expr(e1)
 		self.assertEqual(apply_rule_in_tree(trig_rules.trig_rules[8], e1), 1)
 
+	def test_apply_miss_returns_same_object(self):
+		e1 = string_to_expr.expression_from_string("f(x^2, y) + g(z)")
+		self.assertIs(apply_rule_in_tree(trig_rules.trig_rules[8], e1), e1)
+
+	def test_apply_shares_unchanged_subtrees(self):
+		e1 = string_to_expr.expression_from_string("f(x^2, y) + tan(z)")
+		e2 = apply_rule_in_tree(trig_rules.trig_rules[0], e1)
+		self.assertEqual(e2.args[1], replace_in_tree(trig_rules.trig_rules[0].target, {'x': Var('z', 'complex')}))
+		self.assertIs(e2.args[0], e1.args[0])
+
+class ACMatchTest(unittest.TestCase):
+	def test_pythagorean_in_long_sum(self):
+		terms = ["x%s" % c for c in "abcdefghij"]
+		e1 = string_to_expr.expression_from_string("+".join(terms[:5] + ["sin(y)^2"] + terms[5:] + ["cos(y)^2"]))
+		e2 = string_to_expr.expression_from_string("+".join(terms))
+		self.assertEqual(simplify_expr(apply_rule_in_tree(trig_rules.trig_rules[8], e1)), simplify_expr(AC0('+', e2, 1)))
+
+	def test_bracketing_does_not_matter(self):
+		e1 = string_to_expr.expression_from_string("(sin(y)^2 + a) + (b + cos(y)^2)")
+		self.assertEqual(str(apply_rule_in_tree(trig_rules.trig_rules[8], e1)), "(1+a+b)")
+
+	def test_var_takes_subsum(self):
+		res = match(F('sin', AC0('+', Var('a'), Var('b'), Var('c'))), F('sin', AC0('+', Var('x'), Var('y'))))
+		self.assertEqual(res, {'x': Var('a'), 'y': AC0('+', Var('b'), Var('c'))})
+
+	def test_last_var_never_empty(self):
+		pattern = F('g', Var('x'), AC0('+', Var('x'), Var('y')))
+		a, b = Var('a'), Var('b')
+		self.assertEqual(list(match_all(F('g', AC0('+', a, b), AC0('+', a, b)), pattern, {})), [])
+		self.assertIsNone(compiled_matcher(pattern)(F('g', AC0('+', a, b), AC0('+', a, b))))
+		self.assertEqual(match(F('g', a, AC0('+', a, b)), pattern), {'x': a, 'y': b})
+
+	def test_seq_var(self):
+		pattern = AC0('+', F('f', Var('x')), SeqVar('r'))
+		res = match(AC0('+', Var('a'), AC0('+', F('f', 1), Var('b'))), pattern)
+		self.assertEqual(res['x'], 1)
+		self.assertEqual(sorted(map(str, res['r'])), ['a', 'b'])
+		self.assertEqual(replace_in_tree(AC0('+', F('g', Var('x')), SeqVar('r')), {'x': 1, 'r': ()}), F('g', 1))
+
+	def test_rule_memory_is_flat(self):
+		wide = AC0('+', *[F('f', Var('x%d' % k)) for k in range(8)])
+		self.assertEqual(len(Rule(wide, 0).all_sources), 1)
+		self.assertEqual(len(Rule(AC0('+', Var('x'), AC0('+', 1, Var('y'))), 0, 'enumerate_ac_variants').all_sources), 12)
+
+class PatternVariantsTest(unittest.TestCase):
+	def test_lazy_and_capped(self):
+		wide = AC0('+', *[F('f', Var('x%d' % k)) for k in range(12)])
+		rule = Rule(wide, 0, 'enumerate_ac_variants', max_variants=5)
+		self.assertEqual(rule.all_sources[0], wide)
+		self.assertEqual(len(rule.all_sources), 5)
+
+	#A régi, mohó generate_patterns eredménye erre a mintára
+	EAGER_VARIANTS = [
+		'((x+1)+f((y*2)))', '(x+(1+f((y*2))))', '((x+f((y*2)))+1)', '(x+(f((y*2))+1))', '((1+x)+f((y*2)))', '(1+(x+f((y*2))))',
+		'((1+f((y*2)))+x)', '(1+(f((y*2))+x))', '((f((y*2))+x)+1)', '(f((y*2))+(x+1))', '((f((y*2))+1)+x)', '(f((y*2))+(1+x))',
+		'((x+1)+f((2*y)))', '(x+(1+f((2*y))))', '((x+f((2*y)))+1)', '(x+(f((2*y))+1))', '((1+x)+f((2*y)))', '(1+(x+f((2*y))))',
+		'((1+f((2*y)))+x)', '(1+(f((2*y))+x))', '((f((2*y))+x)+1)', '(f((2*y))+(x+1))', '((f((2*y))+1)+x)', '(f((2*y))+(1+x))',
+	]
+
+	def test_same_as_eager(self):
+		pattern = AC0('+', Var('x'), AC0('+', 1, F('f', AC0('*', Var('y'), 2))))
+		self.assertEqual([str(p) for p in generate_patterns(pattern)], self.EAGER_VARIANTS)
+
+	def test_cached_on_the_pattern(self):
+		pattern = AC0('+', Var('x'), AC0('+', 1, F('g', AC0('*', Var('y'), 3))))
+		list(pattern_variants(pattern))
+		compiled_matcher(pattern)
+		instantiate(pattern, {})
+		ref = weakref.ref(pattern)
+		del pattern
+		gc.collect()
+		self.assertIsNone(ref())
+
+	def test_shared_subpatterns(self):
+		sub = AC0('*', Var('y'), 2)
+		self.assertIs(pattern_variants(sub), pattern_variants(AC0('*', Var('y'), 2)))
+
+class RuleIndexTest(unittest.TestCase):
+	def setUp(self):
+		self.rules = pow_rules.pow_rules + trig_rules.trig_rules
+		self.index = RuleIndex(self.rules)
+
+	def test_candidates_by_head(self):
+		candidates = self.index.candidates(string_to_expr.expression_from_string("tan(x)"))
+		self.assertEqual([rule for rule, variant in candidates], [trig_rules.trig_rules[0]])
+		self.assertEqual(self.index.candidates(Var('x')), [])
+		candidates = self.index.candidates(string_to_expr.expression_from_string("(x*y)^2"))
+		self.assertEqual([rule for rule, variant in candidates], [pow_rules.pow_rules[0]])
+
+	def test_same_result_with_index(self):
+		for s in ["tan(x)*cot(y)", "sin(a+b)^2 + cos(a+b)^2 + c", "(x*y)^2"]:
+			expr = simplify_expr(string_to_expr.expression_from_string(s))
+			for rule in self.rules:
+				self.assertEqual(apply_rule_in_tree(rule, expr, self.index), apply_rule_in_tree(rule, expr))
+
+	def test_minimax_with_index(self):
+		expr = string_to_expr.expression_from_string("(x*y)^2")
+		simp1 = minimax.SimplifyMiniMax(expr, self.rules, 5, 100, [simplify_expr], apply_rule_in_tree, m2)
+		simp2 = minimax.SimplifyMiniMax(expr, self.rules, 5, 100, [simplify_expr], apply_rule_in_tree, m2, self.index)
+		simp1.GetNextMove()
+		simp2.GetNextMove()
+		self.assertEqual(simp1._root, simp2._root)
+
+class CompiledMatcherTest(unittest.TestCase):
+	def test_same_as_match(self):
+		exprs = ["sin(a+b)^2 + cos(a+b)^2 + c", "tan(x)*cot(y)", "(x*y)^2", "(x^a)^b", "sin(a+b+c)", "f(x, g(x, 2))", "f(x, g(y, 2))"]
+		patterns = [(src, rule.ac_matching) for rule in pow_rules.pow_rules + trig_rules.trig_rules for src in rule.all_sources]
+		patterns += [(F('f', Var('x'), F('g', Var('x'), 2)), True), (F('sin', AC0('*', E(separate_2, 'k'), Var('x'))), False)]
+		for s in exprs:
+			for expr in (string_to_expr.expression_from_string(s), simplify_expr(string_to_expr.expression_from_string(s))):
+				for pattern, ac in patterns:
+					self.assertEqual(compiled_matcher(pattern, ac)(expr), match(expr, pattern, ac))
+
+	def test_external(self):
+		matcher = compiled_matcher(F('sin', AC0('*', E(separate_2, 'k'), Var('x'))), False)
+		self.assertEqual(matcher(F('sin', AC0('*', 4, Var('a')))), {'k': 2, 'x': Var('a')})
+		self.assertEqual(matcher(F('sin', AC0('*', 3, Var('a')))), None)
+
+	def test_cached(self):
+		pattern = F('f', Var('x'), F('g', Var('x'), 2))
+		self.assertIs(compiled_matcher(pattern), compiled_matcher(F('f', Var('x'), F('g', Var('x'), 2))))
+		self.assertIn("'g'", compiled_matcher(pattern).source)
+
+	def test_wide_commutative_pattern(self):
+		def wide(names):
+			x = [Var(name, 'complex') for name in names]
+			res = AC1('*', F('sin', x[0]), F('cos', x[1]))
+			for i in range(1, 7):
+				res = AC0('+', res, AC1('*', F('sin', x[i]), F('cos', x[i+1])))
+			return res
+		rule = Rule(wide('abcdefgh'), 0)
+		pattern = rule.all_sources[0]
+		expr = simplify_expr(wide('pqrstuvw'))
+		self.assertIsNotNone(match(expr, pattern))
+		self.assertEqual(compiled_matcher(pattern)(expr), match(expr, pattern))
+		self.assertEqual(apply_rule_in_tree(rule, expr), 0)
+
+class VarTagTest(unittest.TestCase):
+	def test_properties(self):
+		self.assertIn('integer', properties(AC0('+', 2, Var('n', 'integer'))))
+		self.assertNotIn('integer', properties(AC0('+', 2, Var('x', 'complex'))))
+		self.assertIn('nonzero', properties(AC0('*', 2, Var('y', 'real_nonzero'))))
+		self.assertNotIn('nonzero', properties(AC0('*', 0, Var('y', 'real_nonzero'))))
+		self.assertIn('nonzero', properties(Fraction(1, 2)))
+		self.assertEqual(properties(Fraction(1, 0)), frozenset())
+
+	def test_guards(self):
+		self.assertEqual(match(Var('x', 'complex'), F('f', Var('n', 'integer'))), None)
+		self.assertEqual(match(F('f', 3), F('f', Var('n', 'integer'))), {'n': 3})
+		pattern = F('^', Var('x', 'complex_nonzero'), 0)
+		for expr, matches in [(F('^', 0, 0), False), (F('^', Var('x', 'complex'), 0), False), (F('^', 2, 0), True)]:
+			self.assertEqual(match(expr, pattern) is not None, matches)
+			self.assertEqual(compiled_matcher(pattern)(expr) is not None, matches)
+
+	def test_guard_on_subsum(self):
+		pattern = F('f', AC0('+', Var('n', 'integer'), Var('x', 'complex')))
+		res = match(F('f', AC0('+', Var('a', 'complex'), 2)), pattern)
+		self.assertEqual(res, {'n': 2, 'x': Var('a', 'complex')})
+
+	def test_zero_pow_zero(self):
+		rule = Rule(F('^', Var('x', 'complex_nonzero'), 0), 1)
+		self.assertEqual(apply_rule_in_tree(rule, F('f', F('^', 0, 0), F('^', 5, 0))), F('f', F('^', 0, 0), 1))
+
+class RewriteMemoTest(unittest.TestCase):
+	def test_same_results(self):
+		rules = pow_rules.pow_rules + trig_rules.trig_rules
+		memo = RewriteMemo()
+		expr = simplify_expr(string_to_expr.expression_from_string("sin(a+b)^2 + cos(a+b)^2 + tan(c)*(x*y)^2"))
+		for rule in rules:
+			self.assertEqual(apply_rule_in_tree(rule, expr, memo=memo), apply_rule_in_tree(rule, expr))
+		misses, hits = memo.misses, memo.hits
+		for rule in rules:
+			self.assertEqual(apply_rule_in_tree(rule, expr, memo=memo), apply_rule_in_tree(rule, expr))
+		self.assertEqual(memo.misses, misses)
+		self.assertEqual(memo.hits, hits + len(rules))
+
+	def test_bounded(self):
+		memo = RewriteMemo(max_size=3)
+		rule = trig_rules.trig_rules[0]
+		expr = string_to_expr.expression_from_string("f(g(h(tan(x))))")
+		apply_rule_in_tree(rule, expr, memo=memo)
+		self.assertEqual(len(memo), 3)
+
+	def test_simplify_with_memo(self):
+		expr = string_to_expr.expression_from_string("sin(x)^2 + cos(x)^2 + f(g(z), h(z))")
+		memo = RewriteMemo()
+		res = simplify(expr, pow_rules.pow_rules + trig_rules.trig_rules, [simplify_expr], m2, memo=memo)
+		self.assertEqual(res, simplify(expr, pow_rules.pow_rules + trig_rules.trig_rules, [simplify_expr], m2))
+		self.assertGreater(memo.hits, 0)
+
+class OneStepRewritesTest(unittest.TestCase):
+	def setUp(self):
+		self.rules = pow_rules.pow_rules + trig_rules.trig_rules
+
+	def test_single_positions(self):
+		expr = simplify_expr(string_to_expr.expression_from_string("tan(a) + tan(b)"))
+		results = [(r.rule, r.position) for r in one_step_rewrites(expr, self.rules)]
+		self.assertEqual(results, [(trig_rules.trig_rules[0], (0,)), (trig_rules.trig_rules[0], (1,))])
+		first = next(one_step_rewrites(expr, self.rules))
+		self.assertIs(first.result.args[1], expr.args[1])
+		self.assertEqual(first.result.args[0], replace_in_tree(trig_rules.trig_rules[0].target, {'x': Var('a', 'complex')}))
+
+	def test_same_as_with_index(self):
+		expr = simplify_expr(string_to_expr.expression_from_string("sin(a+b)^2 + cos(a+b)^2 + tan(c)*(x*y)^2"))
+		plain = [r.result for r in one_step_rewrites(expr, self.rules)]
+		indexed = [r.result for r in one_step_rewrites(expr, self.rules, RuleIndex(self.rules))]
+		self.assertEqual(plain, indexed)
+		self.assertEqual(len(plain), len(set(plain)))
+		self.assertNotIn(expr, plain)
+
+	def test_all_matches(self):
+		expr = simplify_expr(string_to_expr.expression_from_string("sin(a+b+c)"))
+		self.assertEqual(len(list(one_step_rewrites(expr, trig_rules.trig_rules[4:5]))), 1)
+		self.assertEqual(len(list(one_step_rewrites(expr, trig_rules.trig_rules[4:5], all_matches=True))), 6)
+
+class TemplateTest(unittest.TestCase):
+	def test_same_as_replace_in_tree(self):
+		match_res = {'x': Var('a'), 'y': F('+', Var('b'), 2), 'z': Var('c'), 'a': Var('d'), 'b': Var('e')}
+		for rule in pow_rules.pow_rules + trig_rules.trig_rules:
+			self.assertIs(instantiate(rule.target, match_res), replace_in_tree(rule.target, match_res))
+
+	def test_ground_subtrees_shared(self):
+		ground = F('sin', F('+', Var('a'), 1))
+		target = F('*', Var('x'), ground)
+		self.assertIs(instantiate(target, {'x': Var('b')}).args[1], ground)
+		self.assertIs(instantiate(ground, {'x': Var('b')}), ground)
+
+	def test_seqvar_splicing(self):
+		target = AC0('+', Var('x'), S('r'))
+		self.assertIs(instantiate(target, {'x': Var('a'), 'r': (Var('b'), Var('c'))}), make_function('+', (Var('a'), Var('b'), Var('c')), True, 0, 2))
+		self.assertIs(instantiate(target, {'x': Var('a'), 'r': ()}), Var('a'))
+
+class CanonicalCacheTest(unittest.TestCase):
+	def setUp(self):
+		self.saved = simplify_module.simplify_expr_cache
+
+	def tearDown(self):
+		simplify_module.simplify_expr_cache = self.saved
+
+	def test_same_result_and_hits(self):
+		expr = string_to_expr.expression_from_string("(x*y)^2 + 2*(a+b+a) - sin(c/d)")
+		simplify_module.simplify_expr_cache = None
+		expected = simplify_expr(expr)
+		cache = CanonicalCache()
+		simplify_module.simplify_expr_cache = cache
+		self.assertIs(simplify_expr(expr), expected)
+		self.assertEqual(cache.hits, 0)
+		self.assertIs(simplify_expr(expr), expected)
+		self.assertEqual(cache.hits, 1)
+		changed = expr.with_args([expr.args[0], F('sin', Var('e'))])
+		misses = cache.misses
+		simplify_expr(changed)
+		self.assertEqual(cache.misses - misses, 2)
+
+	def test_lru_bound(self):
+		cache = CanonicalCache(max_size=3)
+		simplify_module.simplify_expr_cache = cache
+		simplify_expr(F('sin', F('cos', F('tan', F('exp', Var('x'))))))
+		self.assertEqual(len(cache), 3)
+		self.assertIsNone(cache.get(F('exp', Var('x'))))
+		self.assertIsNotNone(cache.get(F('sin', F('cos', F('tan', F('exp', Var('x')))))))
+
+	def test_default_cache_is_on_the_node(self):
+		self.assertIsNone(self.saved)
+		expr = string_to_expr.expression_from_string("(x*y)^2 + 2*(a+b+a) - sin(c/d)")
+		res = simplify_expr(expr)
+		self.assertIs(simplify_expr(expr), res)
+		ref = weakref.ref(expr)
+		del expr
+		gc.collect()
+		self.assertIsNone(ref())
+
+	def test_tags_are_part_of_the_key(self):
+		cache = CanonicalCache()
+		simplify_module.simplify_expr_cache = cache
+		simplify_expr(F('sin', Var('x')))
+		self.assertIsNone(cache.get(F('sin', Var('x', 'real'))))
+
+class NormalizerTest(unittest.TestCase):
+	def test_remembers_normalized_trees(self):
+		calls = []
+		def trf(expr):
+			calls.append(expr)
+			return simplify_expr(expr)
+		normalizer = Normalizer([trf])
+		expr = string_to_expr.expression_from_string("(x*y)^2 + 2*(a+b+a)")
+		res = normalizer(expr)
+		self.assertIs(res, simplify_expr(expr))
+		self.assertIs(normalizer(expr), res)
+		self.assertTrue(normalizer.is_normalized(res))
+		self.assertFalse(normalizer.is_normalized(expr))
+		self.assertIs(normalizer(res), res)
+		self.assertEqual(len(calls), 1)
+		self.assertEqual((normalizer.hits, normalizer.misses), (2, 1))
+
+	def test_renormalizes_only_the_changed_path(self):
+		normalizer = Normalizer([simplify_expr])
+		res = normalizer(string_to_expr.expression_from_string("sin(x*y)^2 + 2*(a+b+a) - sin(c/d)"))
+		for name in 'zw':
+			changed = replace_at(res, (1, 0, 0, 1), Var(name, 'complex'))
+			misses, hits = normalizer.misses, normalizer.hits
+			res = normalizer(changed)
+			self.assertIs(res, simplify_expr(changed))
+			self.assertTrue(normalizer.is_normalized(res))
+		#a gyökértől az átírt levélig vezető út négy csomópontja, a két másik tag normalizált
+		self.assertEqual((normalizer.misses - misses, normalizer.hits - hits), (4, 2))
+
+	def test_status_is_weak(self):
+		normalizer = Normalizer([simplify_expr])
+		expr = string_to_expr.expression_from_string("sin(p*q)^2 + 2*(r+s+r)")
+		normalizer(expr)
+		self.assertGreater(len(normalizer), 0)
+		del expr
+		gc.collect()
+		self.assertEqual(len(normalizer), 0)
+
+	def test_simplify_accepts_normalizer(self):
+		rules = pow_rules.pow_rules+trig_rules.trig_rules
+		expr = string_to_expr.expression_from_string("y^(cos(x)^2) * y^(sin(x)^2)")
+		normalizer = Normalizer([simplify_expr])
+		self.assertEqual(simplify(expr, rules, normalizer, m2), simplify(expr, rules, [simplify_expr], m2))
+		self.assertGreater(normalizer.misses, 0)
+
+class PolynomialTest(unittest.TestCase):
+	def expr(self, s):
+		return simplify_expr(string_to_expr.expression_from_string(s))
+
+	def test_from_expr(self):
+		x, y = Var('x', 'complex'), Var('y', 'complex')
+		p = polynomial.from_expr(self.expr("3*x*y^2 - y/2 + 5"), [x, y])
+		self.assertEqual(p.variables, (x, y))
+		self.assertEqual(p.terms, {(1, 2): 3, (0, 1): Fraction(-1, 2), (): 5})
+		p = polynomial.from_expr(simplify_expr(AC0('+', F('^', F('sin', x), 2), AC0('*', 2, F('sin', x)), F('/', 1, x))))
+		self.assertEqual(p.variables, (F('sin', x), F('^', x, -1)))
+		self.assertEqual(p.total_degree(), 2)
+
+	def test_expand(self):
+		self.assertEqual(polynomial.expand(self.expr("(x+y)^2")), polynomial.from_expr(self.expr("x^2 + 2*x*y + y^2")).to_expr())
+		self.assertEqual(polynomial.expand(self.expr("(x+y)*(x-y) + y^2")), self.expr("x^2"))
+		self.assertEqual(polynomial.expand(self.expr("(x+1)/(y+2)*(y+2) - 1")), Var('x', 'complex'))
+		self.assertEqual(polynomial.expand(self.expr("sin((a+b)^2 - b^2)")), self.expr("sin(a^2 + 2*a*b)"))
+		self.assertEqual(len(polynomial.expand(self.expr("(x+y+z+1)^10")).args), 286)
+
+	def test_zero_pow_zero_is_opaque(self):
+		x = Var('x', 'complex')
+		undefined = F('^', 0, 0)
+		self.assertIsNone(simplify_expr(undefined))
+		self.assertEqual(polynomial.from_expr(undefined).variables, (undefined,))
+		self.assertIs(polynomial.expand(undefined), undefined)
+		self.assertEqual(polynomial.expand(AC0('*', undefined, x)), AC0('*', undefined, x))
+		self.assertEqual(polynomial.from_expr(F('^', x, 0)).terms, {(): 1})
+		with self.assertRaises(ZeroDivisionError):
+			polynomial.Polynomial() ** 0
+
+	def test_collect(self):
+		expr = self.expr("x*y + x*z + y + x^2*y + x^2")
+		res = polynomial.collect(expr, [Var('x', 'complex')])
+		self.assertEqual(set(map(str, res.args)), {'y', '(x*(y+z))', '((1+y)*(x^2))'})
+		self.assertEqual(polynomial.from_expr(res), polynomial.from_expr(expr))
+
+	def test_arithmetic(self):
+		p = polynomial.from_expr(self.expr("x+y"))
+		q = polynomial.from_expr(self.expr("x-y"))
+		self.assertEqual(p * q, polynomial.from_expr(self.expr("x^2 - y^2")))
+		self.assertTrue((p - p).is_zero())
+		self.assertEqual(p ** 3, polynomial.from_expr(self.expr("(x+y)^3")))
+
+	def test_as_transformation(self):
+		expr = self.expr("(x+1)^2 - x^2 - 2*x")
+		self.assertEqual(simplify(expr, [], [polynomial.expand, simplify_expr], m2), 1)
+
+class PolynomialGcdTest(unittest.TestCase):
+	def poly(self, s):
+		return polynomial.from_expr(simplify_expr(string_to_expr.expression_from_string(s)))
+
+	def assertPolynomialEqual(self, first, second):
+		self.assertEqual(polynomial.from_expr(polynomial.expand(first)), polynomial.from_expr(polynomial.expand(second)))
+
+	def test_gcd(self):
+		self.assertEqual(polynomial.polynomial_gcd(self.poly("x^2-y^2"), self.poly("x-y")), self.poly("x-y"))
+		self.assertEqual(polynomial.polynomial_gcd(self.poly("6*x^2+12*x+6"), self.poly("4*x+4")), self.poly("x+1"))
+		self.assertEqual(polynomial.polynomial_gcd(self.poly("(x+y)^3*(x-2*z)"), self.poly("(x+y)^2*(x*z+1)")), self.poly("(x+y)^2"))
+		self.assertEqual(polynomial.polynomial_gcd(self.poly("x^2+1"), self.poly("x+1")), self.poly("1"))
+		self.assertEqual(polynomial.polynomial_gcd(self.poly("x*y^2*z"), self.poly("x^2*z^3")), self.poly("x*z"))
+
+	def test_divide(self):
+		self.assertEqual(polynomial.divide(self.poly("x^3-y^3"), self.poly("x-y")), self.poly("x^2+x*y+y^2"))
+		self.assertIsNone(polynomial.divide(self.poly("x^2+1"), self.poly("x+1")))
+
+	def test_cancel_quotients(self):
+		expr = string_to_expr.expression_from_string
+		self.assertPolynomialEqual(polynomial.cancel(expr("(x^2-y^2)/(x-y)")), expr("x+y"))
+		self.assertEqual(polynomial.cancel(expr("x/(2*x)")), Fraction(1, 2))
+		res = polynomial.cancel(expr("(x^3-y^3)/(x^2-y^2)"))
+		self.assertEqual(res.name, '/')
+		self.assertEqual(polynomial.from_expr(res.args[1]), self.poly("x+y"))
+		unchanged = expr("(x+1)/(x+2)")
+		self.assertIs(polynomial.cancel(unchanged), unchanged)
+
+	def test_cancel_simplified_products(self):
+		expr = simplify_expr(string_to_expr.expression_from_string("sin((a^2-1)/(a+1)) * (x^2+2*x+1)/(x+1)"))
+		res = polynomial.cancel(expr)
+		self.assertFalse(any(type(arg) is Function and arg.name == '^' for arg in res.args))
+		self.assertPolynomialEqual(res, string_to_expr.expression_from_string("sin(a-1)*(x+1)"))
+
+def decrement(expr, varname):
+	if type(expr) is not int or expr <= 0:
+		return None
+	return {varname: expr - 1}
+
 def expr_simplify_to_the_same(tester, s_expr1, s_expr2):
 	expr1 = string_to_expr.expression_from_string(s_expr1)
 	expr2 = string_to_expr.expression_from_string(s_expr2)
@@ -382,6 +884,95 @@ def expr_simplify_to_the_same_old(tester, s_expr1, s_expr2):
 class MinimaxTest(unittest.TestCase):
 	def test_minimax_1(self):
 		expr_simplify_to_the_same(self, "x^2*y^2", "(x*y)^2")
+
+	def test_same_move_as_full_lookahead(self):
+		rules = pow_rules.pow_rules+trig_rules.trig_rules
+		for s_expr in ["x^2*y^2", "sin(x)^2 + cos(x)^2", "y^(cos(x)^2) * y^(sin(x)^2)", "(x^a)^b*sin(x*y)"]:
+			for measure in [m, m1, m2]:
+				expr = simplify_expr(string_to_expr.expression_from_string(s_expr))
+				apply_all = lambda e: [apply_rule_in_tree(rule, e) for rule in rules]
+				scores = [max(min(measure(e3) for e3 in apply_all(e2)) for e2 in apply_all(e1)) for e1 in apply_all(expr)]
+				expected = simplify_expr(apply_all(expr)[scores.index(max(scores))])
+				simp = minimax.SimplifyMiniMax(expr, rules, 1, 100, [simplify_expr], apply_rule_in_tree, measure)
+				simp.GetNextMove()
+				self.assertEqual(simp._root, expected)
+				self.assertLess(simp._measured, len(rules)**3)
+
+	def test_successors_are_distinct(self):
+		rules = pow_rules.pow_rules+trig_rules.trig_rules
+		expr = simplify_expr(string_to_expr.expression_from_string("x^2*y^2"))
+		simp = minimax.SimplifyMiniMax(expr, rules, 1, 100, [simplify_expr], apply_rule_in_tree, m2)
+		successors = simp.Successors(expr)
+		self.assertEqual(len(set(map(id, successors))), len(successors))
+		self.assertIn(expr, successors)
+		self.assertIs(simp.Successors(expr), successors)
+		self.assertEqual(simp._expanded, 1)
+
+	def test_depth(self):
+		rules = pow_rules.pow_rules+trig_rules.trig_rules
+		expr = simplify_expr(string_to_expr.expression_from_string("y^(cos(x)^2) * y^(sin(x)^2)"))
+		simp1 = minimax.SimplifyMiniMax(expr, rules, 1, 100, [simplify_expr], apply_rule_in_tree, m1, depth=1)
+		simp1.GetNextMove()
+		successors = [simplify_expr(apply_rule_in_tree(rule, expr)) for rule in rules]
+		self.assertEqual(simp1._root, max(successors, key=m1))
+		for depth in [2, 4]:
+			simp = minimax.SimplifyMiniMax(expr, rules, 1, 100, [simplify_expr], apply_rule_in_tree, m2, depth=depth)
+			simp.GetNextMove()
+			self.assertIn(simp._root, successors)
+		self.assertRaises(ValueError, minimax.SimplifyMiniMax, expr, rules, 1, 100, [simplify_expr], apply_rule_in_tree, m2, depth=0)
+		self.assertRaises(ValueError, minimax.SimplifyMiniMax, expr, rules, 1, 100, [simplify_expr], apply_rule_in_tree, m2, depth=None)
+
+	def test_iterative_deepening(self):
+		rules = pow_rules.pow_rules+trig_rules.trig_rules
+		expr = simplify_expr(string_to_expr.expression_from_string("y^(cos(x)^2) * y^(sin(x)^2)"))
+		fixed = minimax.SimplifyMiniMax(expr, rules, 1, 100, [simplify_expr], apply_rule_in_tree, m2)
+		fixed.GetNextMove()
+		deepening = minimax.SimplifyMiniMax(expr, rules, 1, 100, [simplify_expr], apply_rule_in_tree, m2, nodeBudget=10**6)
+		deepening.GetNextMove()
+		self.assertEqual(deepening._completedDepth, 3)
+		self.assertIs(deepening._root, fixed._root)
+		limited = minimax.SimplifyMiniMax(expr, rules, 1, 100, [simplify_expr], apply_rule_in_tree, m2, depth=None, nodeBudget=50)
+		limited.GetNextMove()
+		self.assertGreaterEqual(limited._completedDepth, 1)
+		self.assertIn(limited._root, [simplify_expr(e) for e in limited.Successors(expr)])
+
+	def test_time_budget(self):
+		rules = pow_rules.pow_rules+trig_rules.trig_rules
+		expr = simplify_expr(string_to_expr.expression_from_string("y^(cos(x)^2) * y^(sin(x)^2)"))
+		simp = minimax.SimplifyMiniMax(expr, rules, 1, 100, [simplify_expr], apply_rule_in_tree, m2, depth=None, timeBudget=0)
+		simp.GetNextMove()
+		self.assertEqual(simp._completedDepth, 0)
+		self.assertIs(simp._root, expr)
+
+	def test_parallel_same_as_serial(self):
+		rules = pow_rules.pow_rules+trig_rules.trig_rules
+		for s_expr in ["y^(cos(x)^2) * y^(sin(x)^2)", "sin(2*x)*(x^a)^b + x^a*x^b"]:
+			expr = simplify_expr(string_to_expr.expression_from_string(s_expr))
+			serial = minimax.SimplifyMiniMax(expr, rules, 1, 100, [simplify_expr], apply_rule_in_tree, m, depth=4)
+			parallel = minimax.SimplifyMiniMax(expr, rules, 1, 100, [simplify_expr], apply_rule_in_tree, m, depth=4, processes=2)
+			try:
+				for i in range(2):
+					serial.GetNextMove()
+					parallel.GetNextMove()
+					self.assertIs(parallel._root, serial._root)
+			finally:
+				parallel.Close()
+		self.assertRaises(ValueError, minimax.SimplifyMiniMax, expr, rules, 1, 100, [simplify_expr], apply_rule_in_tree, m, processes=2, timeBudget=1)
+
+	def test_parallel_enumerated_variants(self):
+		rules = [Rule(rule.source, rule.target, *(rule.tags + ('enumerate_ac_variants',))) for rule in trig_rules.trig_rules]
+		restored = pickle.loads(pickle.dumps(rules[0]))
+		self.assertEqual(list(restored.all_sources), list(rules[0].all_sources))
+		expr = simplify_expr(string_to_expr.expression_from_string("tan(x)*cos(x)"))
+		serial = minimax.SimplifyMiniMax(expr, rules, 1, 100, [simplify_expr], apply_rule_in_tree, m, depth=2)
+		parallel = minimax.SimplifyMiniMax(expr, rules, 1, 100, [simplify_expr], apply_rule_in_tree, m, depth=2, processes=2)
+		try:
+			serial.GetNextMove()
+			parallel.GetNextMove()
+			self.assertIsNot(serial._root, expr)
+			self.assertIs(parallel._root, serial._root)
+		finally:
+			parallel.Close()
 	
 	##associative nem egyezik, NEM OK
 	#def test_minimax_2(self):
@@ -413,6 +1004,193 @@ class SimplifyTest(unittest.TestCase):
 	def test_simplify_5(self):
 		expr_simplify_to_the_same_old(self, "y^(cos(x)^2) * y^(sin(x)^2)", "y")
 
+	def test_simplify_run(self):
+		expr = string_to_expr.expression_from_string("sin(x)^2 + cos(x)^2")
+		res = simplify_run(expr, pow_rules.pow_rules+trig_rules.trig_rules, [simplify_expr], m2)
+		self.assertEqual(res.expr, 1)
+		self.assertEqual(res.steps, 1)
+		self.assertEqual(res.reason, 'no_improvement')
+		res = simplify_run(expr, pow_rules.pow_rules+trig_rules.trig_rules, [simplify_expr], m2, max_steps=0)
+		self.assertEqual((res.expr, res.steps, res.reason), (expr, 0, 'max_steps'))
+
+	def test_thousands_of_steps(self):
+		countdown = Rule(F('c', E(decrement, 'k')), F('c', Var('k')), 'disable_ac_matching')
+		res = simplify_run(F('c', 3000), [countdown], [], lambda expr: expr.args[0])
+		self.assertEqual((res.expr, res.steps, res.reason), (F('c', 0), 3000, 'no_improvement'))
+		self.assertEqual(simplify(F('c', 3000), [countdown], [], lambda expr: expr.args[0]), F('c', 0))
+
+	def test_cycle(self):
+		rule_list = []
+		rules.add_rule(rule_list, F('f', Var('x')), F('g', Var('x')))
+		calls = []
+		def always_simpler(expr):
+			calls.append(expr)
+			return -len(calls)
+		res = simplify_run(F('f', Var('a')), rule_list, [], always_simpler)
+		self.assertEqual(res.reason, 'cycle')
+		self.assertEqual(res.steps, 0)
+		self.assertEqual(res.expr, F('f', Var('a')))
+
+
+class WorklistSimplifyTest(unittest.TestCase):
+	def setUp(self):
+		self.rules = pow_rules.pow_rules+trig_rules.trig_rules
+
+	def test_same_results_as_simplify(self):
+		for s_expr in ["x^2*y^2", "sin(x)^2 + cos(x)^2", "y^(cos(x)^2) * y^(sin(x)^2)", "(x^a)^b + tan(x)", "z"]:
+			expr = string_to_expr.expression_from_string(s_expr)
+			for measure in [m, m2]:
+				res = worklist_simplify(expr, self.rules, [simplify_expr], measure)
+				self.assertEqual(measure(res), measure(simplify(expr, self.rules, [simplify_expr], measure)))
+		self.assertIs(worklist_simplify(Var('z'), self.rules, [simplify_expr], m2), Var('z'))
+
+	def test_large_sum(self):
+		terms = [AC1('*', F('^', Var('v{}'.format(chr(97 + i % 26) * (i // 26 + 1))), 2), F('^', Var('y'), 2)) if i % 2 else F('tan', Var('w')) for i in range(200)]
+		expr = AC0('+', *terms)
+		calls = []
+		def measure(expr):
+			calls.append(expr)
+			return m2(expr)
+		res = worklist_simplify(expr, self.rules, [simplify_expr], measure)
+		self.assertEqual(m2(res), m2(simplify(expr, self.rules, [simplify_expr], m2)))
+		self.assertLess(len(calls), 10 * len(terms))
+
+	def test_whole_tree_measure(self):
+		x, a = Var('x', 'complex'), Var('a', 'complex')
+		rule = Rule(F('f', x, x), F('g', x))
+		#A g a h alatt nagyon bonyolult, így a mérték nem monoton: f(a, a) -> g(a) a részfában egyszerűsít, h alatt nem
+		def penalty(expr):
+			if type(expr) is not Function:
+				return 0
+			own = 100 if expr.name == 'h' and type(expr.args[0]) is Function and expr.args[0].name == 'g' else 0
+			return own + sum(penalty(arg) for arg in expr.args)
+		def measure(expr):
+			return m2(expr) + penalty(expr)
+		expr = F('h', F('f', a, a))
+		self.assertIs(simplify(expr, [rule], [], measure), expr)
+		self.assertIs(worklist_simplify(expr, [rule], [], measure), expr)
+		#Csak az a részfa íródik át, amellyel a teljes fa mértéke csökken
+		expr = F('k', F('h', F('f', a, a)), F('f', a, a))
+		self.assertIs(worklist_simplify(expr, [rule], [], measure), F('k', F('h', F('f', a, a)), F('g', a)))
+
+	def test_rewrite_root(self):
+		rule = pow_rules.pow_rules[1]
+		expr = simplify_expr(string_to_expr.expression_from_string("x^2*y^2"))
+		self.assertIsNone(rewrite_root(rule, F('sin', expr)))
+		self.assertEqual(rewrite_root(rule, expr), apply_rule_in_tree(rule, expr))
+		self.assertIs(subtree_at(F('sin', expr), (0,)), expr)
+		self.assertIsNone(subtree_at(F('sin', expr), (1,)))
+
+class BeamSearchTest(unittest.TestCase):
+	def setUp(self):
+		self.rules = pow_rules.pow_rules+trig_rules.trig_rules
+
+	def test_escapes_local_minimum(self):
+		expr = string_to_expr.expression_from_string("((x^x)^b)^(8*x)")
+		self.assertEqual(simplify(expr, self.rules, [simplify_expr], m2), expr)
+		res = beam_search.beam_simplify(expr, self.rules, [simplify_expr], m2)
+		self.assertEqual(str(res), "(x^(8*b*(x^2)))")
+
+	def test_same_results_as_simplify(self):
+		for s_expr, expected in [("x^2*y^2", "(x*y)^2"), ("sin(x)^2 + cos(x)^2", "1"), ("y^(cos(x)^2) * y^(sin(x)^2)", "y")]:
+			expr = string_to_expr.expression_from_string(s_expr)
+			res = beam_search.beam_simplify(expr, self.rules, [simplify_expr], m2, beam_width=4)
+			self.assertEqual(res, simplify(string_to_expr.expression_from_string(expected), self.rules, [simplify_expr], m2))
+
+	def test_budget(self):
+		expr = string_to_expr.expression_from_string("y^(cos(x)^2) * y^(sin(x)^2)")
+		self.assertIs(beam_search.beam_simplify(expr, self.rules, [simplify_expr], m2, max_nodes=0), simplify_expr(expr))
+		self.assertIs(beam_search.beam_simplify(expr, self.rules, [simplify_expr], m2, time_budget=0), simplify_expr(expr))
+		self.assertIs(beam_search.beam_simplify(Var('x'), self.rules, [simplify_expr], m2), Var('x'))
+
+	def test_normalized_start(self):
+		x = Var('x', 'complex')
+		expr = AC0('+', x, x, x)
+		res = beam_search.beam_simplify(expr, [], [simplify_expr], m2)
+		self.assertEqual(str(res), "(3*x)")
+		self.assertIs(res, simplify(expr, [], [simplify_expr], m2))
+		self.assertIs(beam_search.beam_simplify(expr, self.rules, [simplify_expr], m2, max_nodes=0), res)
+
+class EGraphTest(unittest.TestCase):
+	def setUp(self):
+		self.rules = pow_rules.pow_rules+trig_rules.trig_rules
+
+	def test_congruence_closure(self):
+		g = egraph.EGraph()
+		fa = g.add_term(F('f', Var('a'), Var('c')))
+		fb = g.add_term(F('f', Var('b'), Var('c')))
+		self.assertNotEqual(g.find(fa), g.find(fb))
+		g.union(g.lookup(Var('a')), g.lookup(Var('b')))
+		g.rebuild()
+		self.assertEqual(g.find(fa), g.find(fb))
+		self.assertEqual(g.lookup(F('f', Var('b'), Var('c'))), g.find(fa))
+		self.assertIsNone(g.lookup(F('f', Var('c'), Var('c'))))
+
+	def test_simplify(self):
+		for s_expr, expected in [("sin(x)^2 + cos(x)^2", "1"), ("x^2*y^2", "((x*y)^2)"), ("y^(cos(x)^2) * y^(sin(x)^2)", "y")]:
+			expr = string_to_expr.expression_from_string(s_expr)
+			res = egraph.egraph_simplify(expr, self.rules, node_limit=1000)
+			self.assertEqual(str(res), expected)
+
+	def test_rule_order_does_not_matter(self):
+		expr = string_to_expr.expression_from_string("sin(a+b)^2+cos(a+b)^2+(x^a)^b*y^2*x^2")
+		g1 = egraph.EGraph()
+		res1 = egraph.egraph_simplify(expr, self.rules, egraph=g1)
+		res2 = egraph.egraph_simplify(expr, self.rules[::-1])
+		self.assertEqual(g1.stop_reason, 'saturated')
+		self.assertEqual(res1, res2)
+		self.assertEqual(str(res1), "(1+(((x^a)^b)*((x*y)^2)))")
+
+	def test_limits(self):
+		expr = string_to_expr.expression_from_string("y^(cos(x)^2) * y^(sin(x)^2)")
+		for kwargs, reason in [({'iter_limit': 1}, 'iter_limit'), ({'node_limit': 50}, 'node_limit'), ({'time_limit': 0}, 'time_limit')]:
+			g = egraph.EGraph()
+			res = egraph.egraph_simplify(expr, self.rules, egraph=g, **kwargs)
+			self.assertEqual(g.stop_reason, reason)
+			self.assertLessEqual(m(res), m(simplify_expr(expr)))
+
+class MCTSTest(unittest.TestCase):
+	def setUp(self):
+		self.rules = pow_rules.pow_rules+trig_rules.trig_rules
+
+	def test_finds_simpler_than_greedy(self):
+		expr = string_to_expr.expression_from_string("((x^x)^b)^(8*x)")
+		res = mcts.mcts_simplify(expr, self.rules, [simplify_expr], m2, time_budget=None, iterations=300)
+		self.assertEqual(str(res), "(x^(8*b*(x^2)))")
+		self.assertEqual(mcts.mcts_simplify(string_to_expr.expression_from_string("y^(cos(x)^2) * y^(sin(x)^2)"), self.rules, [simplify_expr], m, time_budget=None, iterations=300), Var('y', 'complex'))
+
+	def test_anytime(self):
+		expr = string_to_expr.expression_from_string("(cos(cos(3))^((1*b*a)*(2+3+b)))^cos((cos(1)^cos(x)))")
+		search = mcts.MonteCarloTreeSearch(expr, self.rules, [simplify_expr], m)
+		self.assertIs(search.best, expr)
+		scores = []
+		for i in range(4):
+			search.run(iterations=25)
+			scores.append(search.best_score)
+		self.assertEqual(search.iterations, 100)
+		self.assertEqual(scores, sorted(scores, reverse=True))
+		self.assertLess(scores[-1], m(expr))
+		visits, reward = search.statistics(search.root)
+		self.assertEqual(visits, 100)
+		self.assertGreater(reward, 0)
+
+	def test_time_budget_and_determinism(self):
+		expr = string_to_expr.expression_from_string("y^(cos(x)^2) * y^(sin(x)^2)")
+		ticks = []
+		def clock():
+			ticks.append(None)
+			return len(ticks)
+		#Minden lépés előtt egy óraleolvasás: a rollout sem futhat túl az időkorláton
+		search = mcts.MonteCarloTreeSearch(expr, self.rules, [simplify_expr], m2, rollout_depth=10**6, clock=clock)
+		search.run(time_budget=20)
+		self.assertGreater(search.iterations, 0)
+		self.assertLessEqual(len(ticks), 22)
+		iterations = search.iterations
+		search.run(time_budget=0)
+		self.assertEqual(search.iterations, iterations)
+		res1 = mcts.mcts_simplify(expr, self.rules, [simplify_expr], m2, time_budget=None, iterations=50, seed=3)
+		res2 = mcts.mcts_simplify(expr, self.rules, [simplify_expr], m2, time_budget=None, iterations=50, seed=3)
+		self.assertIs(res1, res2)
 
 class StringToExprTest(unittest.TestCase):
     def test_tokenizer(self):